@@ -0,0 +1,692 @@
+# Adafruit MicroPython Tool - asyncio Board Connections
+# Copyright (c) 2016 Adafruit Industries
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+# Pyboard and Files for asyncio (Python 3.7 and later), so many boards can be
+# driven from one event loop without a thread each.  The rest of ampy doesn't
+# import this module.
+import ast
+import asyncio
+import binascii
+import contextlib
+import io
+import os
+
+from ampy.files import (
+    BLOCK_SIZE,
+    BUFFER_SIZE,
+    COMPRESSION_THRESHOLD,
+    IMPORT_BINASCII,
+    DEFINE_DECOMPRESSOR,
+    DirEntry,
+    DirectoryExistsError,
+    _list_literal,
+    _os_error,
+    _StreamDecoder,
+    compress,
+    file_digest,
+    helper_command,
+    listing,
+    probe_command,
+)
+from ampy.pyboard import (
+    MAIN_WAIT,
+    RAW_REPL_BANNER,
+    PyboardError,
+    ReadUntil,
+    check_exec_ok,
+    raw_paste_flow,
+    raw_paste_reply,
+    raw_paste_window,
+    stdout_write_bytes,
+)
+
+
+READ_SIZE = 4096  # Most bytes taken from a connection at a time.
+
+TELNET_PORT = 23
+
+# Telnet commands: interpret as command, and the option negotiations which
+# are followed by an option byte.
+IAC = 255
+NEGOTIATIONS = (251, 252, 253, 254)  # WILL, WONT, DO, DONT
+
+
+class _TelnetProtocol(asyncio.StreamReaderProtocol):
+    """Stream protocol dropping the telnet negotiation the board's telnet
+    server sends (IAC sequences), so the reader only gets the REPL's output.
+    """
+
+    def __init__(self, reader):
+        super().__init__(reader)
+        # Start of a command split across two reads.
+        self._pending = b""
+
+    def data_received(self, data):
+        data = self._pending + data
+        out = bytearray()
+        start = 0
+        while True:
+            command = data.find(bytes([IAC]), start)
+            if command == -1:
+                out.extend(data[start:])
+                start = len(data)
+                break
+            out.extend(data[start:command])
+            if command + 1 >= len(data):
+                start = command
+                break
+            if data[command + 1] == IAC:
+                # An escaped 255 data byte.
+                out.append(IAC)
+                start = command + 2
+            elif data[command + 1] in NEGOTIATIONS:
+                if command + 2 >= len(data):
+                    start = command
+                    break
+                start = command + 3
+            else:
+                start = command + 2
+        self._pending = data[start:]
+        if out:
+            super().data_received(bytes(out))
+
+
+class _SerialWriter(object):
+    """Write side of a serial port opened by open_serial, with the part of
+    asyncio.StreamWriter AsyncPyboard uses.  Writes never block, what the
+    driver can't take yet is kept and written once the port is writable.
+    """
+
+    def __init__(self, loop, port):
+        self._loop = loop
+        self._port = port
+        self._fd = port.fileno()
+        self._pending = bytearray()
+        self._drained = None
+
+    def write(self, data):
+        if not self._pending:
+            try:
+                data = data[os.write(self._fd, data):]
+            except BlockingIOError:
+                pass
+            if data:
+                self._loop.add_writer(self._fd, self._flush)
+        self._pending.extend(data)
+
+    def _flush(self):
+        try:
+            written = os.write(self._fd, self._pending)
+        except BlockingIOError:
+            return
+        except OSError as ex:
+            written = len(self._pending)
+            if self._drained is not None and not self._drained.done():
+                self._drained.set_exception(ex)
+        del self._pending[:written]
+        if not self._pending:
+            self._loop.remove_writer(self._fd)
+            if self._drained is not None and not self._drained.done():
+                self._drained.set_result(None)
+
+    async def drain(self):
+        while self._pending:
+            self._drained = self._loop.create_future()
+            await self._drained
+
+    def close(self):
+        self._loop.remove_reader(self._fd)
+        self._loop.remove_writer(self._fd)
+        self._port.close()
+
+
+async def open_serial(device, baudrate=115200):
+    """Open a serial port (or a pty) and return a (reader, writer) pair like
+    asyncio.open_connection does.  The event loop watches the port's file
+    descriptor, so this needs a POSIX system.
+    """
+    import serial
+
+    loop = asyncio.get_running_loop()
+    try:
+        port = serial.Serial(device, baudrate=baudrate, timeout=0)
+    except (OSError, IOError):  # Py2 and Py3 have different errors
+        raise PyboardError("failed to access " + device)
+    fd = port.fileno()
+    os.set_blocking(fd, False)
+    reader = asyncio.StreamReader()
+
+    def readable():
+        try:
+            data = os.read(fd, READ_SIZE)
+        except BlockingIOError:
+            return
+        except OSError as ex:
+            loop.remove_reader(fd)
+            reader.set_exception(ex)
+            return
+        if data:
+            reader.feed_data(data)
+        else:
+            loop.remove_reader(fd)
+            reader.feed_eof()
+
+    loop.add_reader(fd, readable)
+    return reader, _SerialWriter(loop, port)
+
+
+async def open_telnet(host, user, password, port=TELNET_PORT, timeout=10):
+    """Connect to a board's telnet REPL and log in, returning a (reader,
+    writer) pair like asyncio.open_connection does.
+    """
+    loop = asyncio.get_running_loop()
+    reader = asyncio.StreamReader()
+    error = PyboardError("Failed to establish a telnet connection with the board")
+    try:
+        transport, protocol = await asyncio.wait_for(
+            loop.create_connection(lambda: _TelnetProtocol(reader), host, port), 15
+        )
+    except (OSError, asyncio.TimeoutError):
+        raise error
+    writer = asyncio.StreamWriter(transport, protocol, reader, loop)
+
+    async def expect(text):
+        try:
+            await asyncio.wait_for(reader.readuntil(text), timeout)
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError, asyncio.LimitOverrunError):
+            writer.close()
+            raise error
+
+    await expect(b"Login as:")
+    writer.write(bytes(user, "ascii") + b"\r\n")
+    await expect(b"Password:")
+    # needed because of internal implementation details of the telnet server
+    await asyncio.sleep(0.2)
+    writer.write(bytes(password, "ascii") + b"\r\n")
+    await expect(b'Type "help()" for more information.')
+    return reader, writer
+
+
+async def connect(device, baudrate=115200, user="micro", password="python", soft_reset=True):
+    """Return an AsyncPyboard for the board at device, a serial port or an IP
+    address for telnet, like Pyboard takes.
+    """
+    if device.startswith("ws://"):
+        raise PyboardError("WebREPL connections aren't supported by AsyncPyboard")
+    if device and device[0].isdigit() and device[-1].isdigit() and device.count(".") == 3:
+        # device looks like an IP address
+        reader, writer = await open_telnet(device, user, password)
+    else:
+        reader, writer = await open_serial(device, baudrate)
+    return AsyncPyboard(reader, writer, soft_reset)
+
+
+class AsyncPyboard(object):
+    """Pyboard's raw REPL protocol on asyncio streams.  The methods are
+    coroutines doing what the Pyboard methods of the same names do, waiting
+    on the event loop instead of blocking.  Reader and writer are any
+    asyncio stream pair (see connect, open_serial and open_telnet).
+    """
+
+    def __init__(self, reader, writer, soft_reset=True):
+        self.soft_reset = soft_reset
+        self.use_raw_paste = True
+        self._reader = reader
+        self._writer = writer
+        # Bytes read but not consumed yet, see Pyboard.
+        self._rx_buffer = bytearray()
+
+    def close(self):
+        self._writer.close()
+
+    async def write(self, data):
+        self._writer.write(data)
+        await self._writer.drain()
+
+    async def read_some(self, timeout=None):
+        """Read whatever is available in one go.  If nothing is available wait
+        up to timeout seconds (forever if None) for data to arrive and return
+        an empty byte string if none did.
+        """
+        if self._rx_buffer:
+            data = bytes(self._rx_buffer)
+            del self._rx_buffer[:]
+            return data
+        try:
+            data = await asyncio.wait_for(self._reader.read(READ_SIZE), timeout)
+        except asyncio.TimeoutError:
+            return b""
+        if not data:
+            raise PyboardError("connection closed")
+        return data
+
+    async def read(self, size, timeout=10):
+        """Read size bytes, or fewer if no more arrive for timeout seconds."""
+        data = bytearray()
+        while len(data) < size:
+            new_data = await self.read_some(timeout)
+            if not new_data:
+                break
+            data.extend(new_data)
+        self._rx_buffer[0:0] = data[size:]
+        return bytes(data[:size])
+
+    async def read_until(
+        self, min_num_bytes, ending, timeout=10, data_consumer=None, max_time=None
+    ):
+        # See Pyboard.read_until.
+        data = await self.read(min_num_bytes, timeout)
+        until = ReadUntil(ending, data, data_consumer, max_time)
+        while not until.done() and not until.expired():
+            new_data = await self.read_some(until.wait(timeout))
+            if not new_data:
+                # timeout without receiving anything
+                break
+            self._rx_buffer[0:0] = until.feed(new_data)
+        return bytes(until.data)
+
+    async def enter_raw_repl(self, soft_reset=None):
+        if soft_reset is None:
+            soft_reset = self.soft_reset
+        # ctrl-C twice: interrupt any running program
+        await self.write(b"\r\x03\x03")
+        del self._rx_buffer[:]
+        # Output of the interrupted program may still arrive before the
+        # banner, read_until skips it.
+        ending = RAW_REPL_BANNER + b">" if soft_reset else RAW_REPL_BANNER
+        for retry in range(0, 5):
+            await self.write(b"\r\x01")  # ctrl-A: enter raw REPL
+            data = await self.read_until(1, ending)
+            if data.endswith(ending):
+                break
+            if retry >= 4:
+                raise PyboardError("could not enter raw repl")
+            # Try interrupting again.
+            await self.write(b"\r\x03\x03")
+        if not soft_reset:
+            return
+        await self.write(b"\x04")  # ctrl-D: soft reset
+        data = await self.read_until(1, b"soft reboot\r\n")
+        if not data.endswith(b"soft reboot\r\n"):
+            raise PyboardError("could not enter raw repl")
+        # Interrupt main.py if the raw REPL doesn't show up promptly, which
+        # it may do without printing anything.
+        data = await self.read_until(0, RAW_REPL_BANNER, max_time=MAIN_WAIT)
+        if not data.endswith(RAW_REPL_BANNER):
+            await self.write(b"\x03\x03")
+            data = await self.read_until(1, RAW_REPL_BANNER)
+        if not data.endswith(RAW_REPL_BANNER):
+            raise PyboardError("could not enter raw repl")
+
+    async def exit_raw_repl(self):
+        await self.write(b"\r\x02")  # ctrl-B: enter friendly REPL
+
+    async def follow(self, timeout, data_consumer=None):
+        # wait for normal output
+        data = await self.read_until(1, b"\x04", timeout=timeout, data_consumer=data_consumer)
+        if not data.endswith(b"\x04"):
+            raise PyboardError("timeout waiting for first EOF reception")
+        # wait for error output
+        data_err = await self.read_until(1, b"\x04", timeout=timeout)
+        if not data_err.endswith(b"\x04"):
+            raise PyboardError("timeout waiting for second EOF reception")
+        return data[:-1], data_err[:-1]
+
+    async def raw_paste_write(self, command_bytes):
+        # Read initial header, with window size.
+        window_size = raw_paste_window(await self.read(2))
+        window_remain = window_size
+        i = 0
+        while i < len(command_bytes):
+            while window_remain == 0:
+                more = raw_paste_flow(await self.read(1), window_size)
+                if more is None:
+                    # Acknowledge the abrupt end and finish.
+                    await self.write(b"\x04")
+                    return
+                window_remain += more
+            b = command_bytes[i:min(i + window_remain, len(command_bytes))]
+            await self.write(b)
+            window_remain -= len(b)
+            i += len(b)
+        # Indicate end of data.
+        await self.write(b"\x04")
+        data = await self.read_until(1, b"\x04")
+        if not data.endswith(b"\x04"):
+            raise PyboardError("could not complete raw paste: {}".format(data))
+
+    async def exec_raw_no_follow(self, command):
+        if isinstance(command, bytes):
+            command_bytes = command
+        else:
+            command_bytes = bytes(command, encoding="utf8")
+        # check we have a prompt
+        data = await self.read_until(1, b">")
+        if not data.endswith(b">"):
+            raise PyboardError("could not enter raw repl")
+        if self.use_raw_paste:
+            await self.write(b"\x05A\x01")
+            supported = raw_paste_reply(await self.read(2))
+            if supported:
+                # Device supports raw-paste mode, write out the command using this mode.
+                return await self.raw_paste_write(command_bytes)
+            if supported is None:
+                # Device doesn't support raw-paste, fall back to normal raw REPL.
+                data = await self.read_until(1, b"w REPL; CTRL-B to exit\r\n>")
+                if not data.endswith(b"w REPL; CTRL-B to exit\r\n>"):
+                    raise PyboardError("could not enter raw repl")
+            # Don't try to use raw-paste mode again for this connection.
+            self.use_raw_paste = False
+        for i in range(0, len(command_bytes), 256):
+            await self.write(command_bytes[i:min(i + 256, len(command_bytes))])
+            await asyncio.sleep(0.01)
+        await self.write(b"\x04")
+        # check if we could exec command
+        check_exec_ok(await self.read(2))
+
+    async def exec_raw(self, command, timeout=10, data_consumer=None):
+        await self.exec_raw_no_follow(command)
+        return await self.follow(timeout, data_consumer)
+
+    async def wait_ack(self, timeout=10):
+        # See Pyboard.wait_ack.
+        data = await self.read_some(timeout)
+        if not data:
+            raise PyboardError("timeout waiting for the board to ask for input")
+        self._rx_buffer[0:0] = data[1:]
+        if data[:1] == b"\x06":
+            return
+        self._rx_buffer[0:0] = data[:1]
+        ret, ret_err = await self.follow(timeout)
+        raise PyboardError("exception", ret, ret_err)
+
+    async def exec_with_input(self, command, chunks, timeout=10, data_consumer=None):
+        # See Pyboard.exec_with_input.
+        await self.exec_raw_no_follow(command)
+        for chunk in chunks:
+            await self.wait_ack(timeout)
+            await self.write(chunk)
+        ret, ret_err = await self.follow(timeout, data_consumer)
+        if ret_err:
+            raise PyboardError("exception", ret, ret_err)
+        return ret
+
+    async def exec_(self, command, stream_output=False, data_consumer=None, timeout=10):
+        if stream_output:
+            data_consumer = stdout_write_bytes
+        ret, ret_err = await self.exec_raw(command, timeout, data_consumer)
+        if ret_err:
+            raise PyboardError("exception", ret, ret_err)
+        return ret
+
+    async def eval(self, expression):
+        ret = await self.exec_("print({})".format(expression))
+        return ret.strip()
+
+    async def execfile(self, filename, stream_output=False):
+        with open(filename, "rb") as f:
+            pyfile = f.read()
+        return await self.exec_(pyfile, stream_output=stream_output)
+
+
+class AsyncFiles(object):
+    """Files for an AsyncPyboard, using the same helpers on the board.  Each
+    method is a coroutine returning what the Files method of the same name
+    returns.  Failed transfers aren't retried.
+    """
+
+    def __init__(self, pyboard, block_size=BLOCK_SIZE, compress=True):
+        self._pyboard = pyboard
+        self._session_depth = 0
+        self._block_size = block_size
+        self._compress = compress
+        self._probes = {}
+        # Names of the HELPERS defined on the board in this raw REPL session.
+        self._helpers = set()
+
+    @contextlib.asynccontextmanager
+    async def session(self):
+        """Keep the board in raw REPL mode for every operation inside the
+        async with block, like Files.session.
+        """
+        if self._session_depth == 0:
+            await self._pyboard.enter_raw_repl()
+            if getattr(self._pyboard, "soft_reset", True):
+                self._helpers = set()
+        self._session_depth += 1
+        try:
+            yield self
+        finally:
+            self._session_depth -= 1
+            if self._session_depth == 0:
+                await self._pyboard.exit_raw_repl()
+
+    async def _probe(self, name, expression, setup=""):
+        if name not in self._probes:
+            command = probe_command(expression, setup)
+            async with self.session():
+                try:
+                    out = await self._pyboard.exec_(command)
+                except PyboardError:
+                    out = b""
+            self._probes[name] = out.strip() == b"True"
+        return self._probes[name]
+
+    async def _exec(self, call, helpers, data_consumer=None, chunks=None):
+        command, needed = helper_command(call, helpers, self._helpers)
+        if chunks is None:
+            out = await self._pyboard.exec_(command, data_consumer=data_consumer)
+        else:
+            out = await self._pyboard.exec_with_input(command, chunks)
+        self._helpers.update(needed)
+        return out
+
+    async def _has_base64(self):
+        return await self._probe(
+            "base64",
+            "hasattr(binascii, 'a2b_base64') and hasattr(binascii, 'b2a_base64')",
+            setup=IMPORT_BINASCII,
+        )
+
+    async def _has_decompressor(self):
+        return await self._probe(
+            "decompressor",
+            "zlib is None or hasattr(zlib, 'DecompIO')",
+            setup=DEFINE_DECOMPRESSOR,
+        )
+
+    async def get(self, filename, sink=None):
+        out = sink
+        if sink is None:
+            out = io.BytesIO()
+        async with self.session():
+            base64 = await self._has_base64()
+            decoder = _StreamDecoder(out, base64)
+            call = "_ampy.send('{0}', {1}, {2:d})".format(
+                filename, self._block_size if base64 else BUFFER_SIZE, base64
+            )
+            try:
+                await self._exec(call, ["send"], data_consumer=decoder.write)
+            except PyboardError as ex:
+                if _os_error(ex, 2):
+                    raise RuntimeError("No such file: {0}".format(filename))
+                raise ex
+        decoder.close()
+        if sink is None:
+            return out.getvalue()
+
+    async def ls(self, directory="/", long_format=True, recursive=False):
+        if not directory.startswith("/"):
+            directory = "/" + directory
+        call = "_ampy.ls('{0}', {1:d})".format(directory, recursive)
+        async with self.session():
+            try:
+                out = await self._exec(call, ["ls"])
+            except PyboardError as ex:
+                if _os_error(ex, 2):
+                    raise RuntimeError("No such directory: {0}".format(directory))
+                raise ex
+        entries = []
+        for line in out.decode("utf-8").splitlines():
+            kind, size, path = line.split(" ", 2)
+            entries.append(DirEntry(path, kind == "d", int(size)))
+        return listing(entries, long_format, recursive)
+
+    async def stat(self, path):
+        async with self.session():
+            try:
+                out = await self._exec("_ampy.stat('{0}')".format(path), ["stat"])
+            except PyboardError as ex:
+                if _os_error(ex, 2):
+                    raise RuntimeError("No such file/directory: {0}".format(path))
+                raise ex
+        return ast.literal_eval(out.decode("utf-8").strip())
+
+    async def mkdir(self, directory, exists_okay=False, parents=False):
+        directories = [directory] if isinstance(directory, str) else list(directory)
+        if not directories:
+            return
+        call = "_ampy.mkdir({0}, {1:d}, {2:d})".format(
+            _list_literal(directories), parents, exists_okay
+        )
+        async with self.session():
+            try:
+                await self._exec(call, ["mkdir"])
+            except PyboardError as ex:
+                if _os_error(ex, 17):
+                    failed = ex.args[1].decode("utf-8").strip().splitlines()
+                    raise DirectoryExistsError(
+                        "Directory already exists: {0}".format(
+                            failed[-1] if failed else directories[-1]
+                        )
+                    )
+                raise ex
+
+    async def put(self, filename, data, progress_cb=None, verify=False):
+        async with self.session():
+            if await self._has_base64():
+                await self._send_file(filename, data, progress_cb)
+            else:
+                await self._write_file(filename, data, progress_cb)
+            if verify:
+                await self.verify({filename: file_digest(data, await self.hash_algorithm())})
+
+    async def _send_file(self, filename, data, progress_cb):
+        # See Files._send_file.
+        kind, payload = "f", data
+        if self._compress and await self._has_decompressor():
+            compressed = compress(data)
+            if len(compressed) <= len(data) * COMPRESSION_THRESHOLD:
+                kind, payload = "z", compressed
+        receiver = "recv_compressed" if kind == "z" else "recv"
+        call = "_ampy.{0}('{1}', {2}, {3})".format(
+            receiver, filename, len(payload), self._block_size
+        )
+
+        def blocks():
+            reported = 0
+            for i in range(0, len(payload), self._block_size):
+                block = payload[i : i + self._block_size]
+                yield binascii.b2a_base64(block).rstrip(b"\n")
+                done = len(data) * (i + len(block)) // len(payload)
+                if hasattr(progress_cb, '__call__'):
+                    progress_cb(done - reported)
+                reported = done
+
+        await self._exec(call, [receiver], chunks=blocks())
+
+    async def _write_file(self, filename, data, progress_cb):
+        # Fall back to one exec per small chunk for boards without base64,
+        # to a .part file replacing the file once complete like Files does.
+        await self._pyboard.exec_("_ampy_f = open('{0}.part', 'wb')".format(filename))
+        for i in range(0, len(data), BUFFER_SIZE):
+            chunk_size = min(BUFFER_SIZE, len(data) - i)
+            chunk = repr(data[i : i + chunk_size])
+            # Make sure to send explicit byte strings.
+            if not chunk.startswith("b"):
+                chunk = "b" + chunk
+            await self._pyboard.exec_("_ampy_f.write({0})".format(chunk))
+            if hasattr(progress_cb, '__call__'):
+                progress_cb(chunk_size)
+        await self._pyboard.exec_("_ampy_f.close()\ndel _ampy_f")
+        await self._exec("_ampy.replace('{0}.part', '{0}')".format(filename), ["replace"])
+
+    async def rm(self, filename):
+        async with self.session():
+            try:
+                await self._exec("_ampy.os.remove('{0}')".format(filename), ["base"])
+            except PyboardError as ex:
+                if _os_error(ex, 2):
+                    raise RuntimeError("No such file/directory: {0}".format(filename))
+                if _os_error(ex, 13):
+                    raise RuntimeError("Directory is not empty: {0}".format(filename))
+                raise ex
+
+    async def rmdir(self, directory, missing_okay=False):
+        if isinstance(directory, str):
+            directory = [directory]
+        call = "_ampy.rmtree({0}, {1:d})".format(_list_literal(directory), missing_okay)
+        async with self.session():
+            out = (await self._exec(call, ["rmtree"])).decode("utf-8").strip()
+        if out.startswith("!"):
+            raise RuntimeError("No such directory: {0}".format(out[1:]))
+        return int(out)
+
+    async def file_hashes(self, paths):
+        paths = list(paths)
+        call = "_ampy.file_hashes({0}, {1})".format(_list_literal(paths), self._block_size)
+        async with self.session():
+            out = await self._exec(call, ["file_hashes"])
+        lines = out.decode("utf-8").splitlines()
+        algorithm = lines[0].strip()
+        self._probes["algorithm"] = algorithm
+        result = {}
+        for line in lines[1:]:
+            digest, path = line.split(" ", 1)
+            result[path] = None if digest == "-" else digest
+        return algorithm, result
+
+    async def hash_algorithm(self):
+        if "algorithm" not in self._probes:
+            async with self.session():
+                out = await self._exec("print(_ampy.ALGORITHM)", ["digest"])
+            self._probes["algorithm"] = out.decode("utf-8").strip()
+        return self._probes["algorithm"]
+
+    async def verify(self, digests):
+        if not digests:
+            return
+        algorithm, remote = await self.file_hashes(sorted(digests))
+        failed = [path for path in sorted(digests) if remote.get(path) != digests[path]]
+        if failed:
+            raise RuntimeError("Verification failed: {0}".format(", ".join(failed)))
+
+    async def run(self, filename, wait_output=True, stream_output=True):
+        async with self.session():
+            out = None
+            if stream_output:
+                await self._pyboard.execfile(filename, stream_output=True)
+            elif wait_output:
+                out = await self._pyboard.execfile(filename)
+            else:
+                with open(filename, "rb") as infile:
+                    await self._pyboard.exec_raw_no_follow(infile.read())
+        return out
@@ -0,0 +1,170 @@
+# Adafruit MicroPython Tool - Remote Filesystem Metadata Cache
+# Copyright (c) 2016 Adafruit Industries
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+import posixpath
+import time
+
+
+DEFAULT_TTL = 30  # Seconds a cached listing or stat result stays valid.
+# Anything else changing the board's files (like the running program) isn't
+# seen by the cache, so keep this short or call invalidate().
+
+# Stored in place of a stat result for paths known not to exist.
+MISSING = object()
+
+
+def _normalize(path):
+    # Cache keys are absolute, normalized paths.
+    return posixpath.normpath(posixpath.join("/", path))
+
+
+class CachedFiles(object):
+    """Wrap a Files instance and remember the directory listings and stat
+    results it returns, so repeated existence and size checks don't go to the
+    board.  The put, mkdir, rm and rmdir calls made through this object keep
+    the cache up to date, anything else changing the board's files needs an
+    explicit invalidate() call.  Every other Files method is passed through.
+
+    Results are kept for ttl seconds (forever if ttl is None).  The cache is
+    a dict keyed by board and path, which can be shared by the CachedFiles of
+    several boards, board being any hashable naming the board (the wrapped
+    Files instance by default).
+    """
+
+    def __init__(self, files, ttl=DEFAULT_TTL, cache=None, board=None):
+        self._files = files
+        self._ttl = ttl
+        self._cache = {} if cache is None else cache
+        self._board = files if board is None else board
+
+    def __getattr__(self, name):
+        return getattr(self._files, name)
+
+    def _lookup(self, path, kind):
+        entry = self._cache.get((self._board, path), {}).get(kind)
+        if entry is None:
+            return None
+        stored, value = entry
+        if self._ttl is not None and time.time() - stored > self._ttl:
+            return None
+        return value
+
+    def _store(self, path, kind, value):
+        self._cache.setdefault((self._board, path), {})[kind] = (time.time(), value)
+
+    def invalidate(self, path="/"):
+        """Forget everything cached about the specified path, everything
+        below it and the listings of the directories above it.  Without a
+        path the whole cache of this board is dropped.
+        """
+        path = _normalize(path)
+        prefix = path.rstrip("/") + "/"
+        for key in list(self._cache):
+            board, cached = key
+            if board != self._board:
+                continue
+            if cached == path or cached.startswith(prefix):
+                del self._cache[key]
+            elif path.startswith(cached.rstrip("/") + "/"):
+                # An ancestor, its listings may include the path and it may
+                # have just been created along with it.
+                self._cache[key] = dict(
+                    (kind, entry)
+                    for kind, entry in self._cache[key].items()
+                    if kind == "stat" and entry[1] is not MISSING
+                )
+
+    def stat(self, path):
+        """Return the stat tuple of the specified path like Files.stat, raising
+        RuntimeError if it doesn't exist.
+        """
+        path = _normalize(path)
+        result = self._lookup(path, "stat")
+        if result is None:
+            try:
+                result = self._files.stat(path)
+            except RuntimeError:
+                result = MISSING
+            self._store(path, "stat", result)
+        if result is MISSING:
+            raise RuntimeError("No such file/directory: {0}".format(path))
+        return result
+
+    def exists(self, path):
+        """Return True if the specified file or directory exists."""
+        try:
+            self.stat(path)
+        except RuntimeError:
+            return False
+        return True
+
+    def isdir(self, path):
+        """Return True if the specified path is an existing directory."""
+        return self.exists(path) and bool(self.stat(path)[0] & 0x4000)
+
+    def size(self, path):
+        """Return the size in bytes of the specified file."""
+        return self.stat(path)[6]
+
+    def ls(self, directory="/", long_format=True, recursive=False):
+        """List the specified directory like Files.ls."""
+        directory = _normalize(directory)
+        kind = ("ls", long_format, recursive)
+        result = self._lookup(directory, kind)
+        if result is None:
+            result = self._files.ls(directory, long_format, recursive)
+            self._store(directory, kind, result)
+        return list(result)
+
+    def put(self, filename, data, progress_cb=None, verify=False):
+        self.invalidate(filename)
+        self._files.put(filename, data, progress_cb, verify)
+
+    def put_delta(self, filename, data, progress_cb=None):
+        self.invalidate(filename)
+        return self._files.put_delta(filename, data, progress_cb)
+
+    def put_files(self, entries):
+        def invalidating():
+            for entry in entries:
+                self.invalidate(entry[0])
+                yield entry
+
+        self._files.put_files(invalidating())
+
+    def mkdir(self, directory, exists_okay=False, parents=False):
+        directories = [directory] if isinstance(directory, str) else list(directory)
+        for path in directories:
+            self.invalidate(path)
+        self._files.mkdir(directories, exists_okay, parents)
+
+    def rm(self, filename):
+        self.invalidate(filename)
+        self._files.rm(filename)
+        self._store(_normalize(filename), "stat", MISSING)
+
+    def rmdir(self, directory, missing_okay=False):
+        directories = [directory] if isinstance(directory, str) else list(directory)
+        for path in directories:
+            self.invalidate(path)
+        count = self._files.rmdir(directories, missing_okay)
+        for path in directories:
+            self._store(_normalize(path), "stat", MISSING)
+        return count
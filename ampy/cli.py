@@ -24,12 +24,14 @@ import os
 import platform
 import posixpath
 import re
+import sys
+import time
 import serial.serialutil
 
 import click
 import dotenv
-from progress_bar import PorgressBar
-from progress_bar import PorgressBarBath
+from ampy.progress_bar import PorgressBar
+from ampy.progress_bar import PorgressBarBath
 
 # Load AMPY_PORT et al from .ampy file
 # Performed here because we need to beat click's decorators.
@@ -37,11 +39,21 @@ config = dotenv.find_dotenv(filename=".ampy", usecwd=True)
 if config:
     dotenv.load_dotenv(dotenv_path=config)
 
+import ampy.compiler as compiler
 import ampy.files as files
+import ampy.fleet as fleet
+import ampy.pipeline as pipeline
 import ampy.pyboard as pyboard
 
 
 _board = None
+_retries = files.RETRIES
+# With several ports, the ports and the function opening one of them.
+_ports = None
+_open_board = None
+
+# Commands which can run on several boards at once.
+FLEET_COMMANDS = ("put", "sync", "run", "reset")
 
 
 def windows_full_port_name(portname):
@@ -63,8 +75,9 @@ def windows_full_port_name(portname):
     "-p",
     envvar="AMPY_PORT",
     required=True,
+    multiple=True,
     type=click.STRING,
-    help="Name of serial port for connected board.  Can optionally specify with AMPY_PORT environment variable.",
+    help="Name of serial port for connected board, or ws://IP:PORT for a board's WebREPL.  Repeat it, or use a pattern like /dev/ttyUSB*, to run put, sync, run or reset on several boards at once.  Can optionally specify with AMPY_PORT environment variable (several ports separated by spaces).",
     metavar="PORT",
 )
 @click.option(
@@ -85,26 +98,93 @@ def windows_full_port_name(portname):
     help="Delay in seconds before entering RAW MODE (default 0). Can optionally specify with AMPY_DELAY environment variable.",
     metavar="DELAY",
 )
+@click.option(
+    "--password",
+    envvar="AMPY_PASSWORD",
+    default="python",
+    type=click.STRING,
+    help="Password of a board connected through telnet or WebREPL (default python).  Can optionally specify with AMPY_PASSWORD environment variable.",
+    metavar="PASSWORD",
+)
+@click.option(
+    "--retries",
+    envvar="AMPY_RETRIES",
+    default=files.RETRIES,
+    type=click.INT,
+    help="Number of times a transfer is resumed after the connection failed (default {0}).  Can optionally specify with AMPY_RETRIES environment variable.".format(files.RETRIES),
+    metavar="RETRIES",
+)
+@click.option(
+    "--attach",
+    envvar="AMPY_ATTACH",
+    is_flag=True,
+    help="Don't soft reboot the board before each command, which is much faster and keeps its state (variables, imported modules).  Can optionally specify with AMPY_ATTACH environment variable.",
+)
 @click.version_option()
-def cli(port, baud, delay):
+@click.pass_context
+def cli(ctx, port, baud, delay, password, retries, attach):
     """ampy - Adafruit MicroPython Tool
 
     Ampy is a tool to control MicroPython boards over a serial connection.  Using
     ampy you can manipulate files on the board's internal filesystem and even run
     scripts.
     """
-    global _board
-    # On Windows fix the COM port path name for ports above 9 (see comment in
-    # windows_full_port_name function).
-    if platform.system() == "Windows":
-        port = windows_full_port_name(port)
-    _board = pyboard.Pyboard(port, baudrate=baud, rawdelay=delay)
+    global _board, _retries, _ports, _open_board
+    _retries = retries
+    try:
+        ports = fleet.expand_ports(port)
+    except RuntimeError as ex:
+        raise click.BadParameter(str(ex), param_hint="--port")
+
+    def open_board(port):
+        # On Windows fix the COM port path name for ports above 9 (see comment in
+        # windows_full_port_name function).
+        if platform.system() == "Windows" and not port.startswith("ws://"):
+            port = windows_full_port_name(port)
+        return pyboard.Pyboard(
+            port, baudrate=baud, password=password, rawdelay=delay, soft_reset=not attach
+        )
+
+    if len(ports) > 1:
+        if ctx.invoked_subcommand not in FLEET_COMMANDS:
+            raise click.UsageError(
+                "{0} only works with a single port, got {1}".format(
+                    ctx.invoked_subcommand, ", ".join(ports)
+                )
+            )
+        _ports = ports
+        _open_board = open_board
+        return
+    _board = open_board(ports[0])
+
+
+def run_fleet(operation):
+    # Run operation(board, echo) on every board at once, then print what each
+    # printed and a summary table, exiting with status 1 if any board failed.
+    results = fleet.run_all(_ports, _open_board, operation)
+    for result in results:
+        print("{0}:".format(result.port))
+        for line in result.output:
+            print("  " + line)
+        if result.error:
+            print("  Error: " + result.error)
+    print("")
+    for line in fleet.summary(results):
+        print(line)
+    if any(result.error for result in results):
+        sys.exit(1)
 
 
 @cli.command()
 @click.argument("remote_file")
-@click.argument("local_file", type=click.File("wb"), required=False)
-def get(remote_file, local_file):
+@click.argument("local_file", required=False)
+@click.option(
+    "--recursive",
+    "-r",
+    is_flag=True,
+    help="Download a folder and everything in it.",
+)
+def get(remote_file, local_file, recursive):
     """
     Retrieve a file from the board.
 
@@ -122,15 +202,46 @@ def get(remote_file, local_file):
     Or to get main.py and save it as main.py locally run:
 
       ampy --port /board/serial/port get main.py main.py
+
+    Add the -r or --recursive flag to download a folder and all of its child
+    files/folders into a local folder (by default one with the same name in
+    the current directory).  For example to back up everything on the board
+    to a local folder called backup run:
+
+      ampy --port /board/serial/port get -r / backup
     """
-    # Get the file contents.
-    board_files = files.Files(_board)
-    contents = board_files.get(remote_file)
-    # Print the file out if no local file was provided, otherwise save it.
+    board_files = files.Files(_board, retries=_retries)
+    if recursive:
+        if local_file is None:
+            local_file = posixpath.basename(remote_file.rstrip("/")) or "."
+        count = board_files.get_tree(remote_file, local_file)
+        print("Downloaded {0} files".format(count))
+        return
+    # Print the file out if no local file was provided, otherwise stream it
+    # straight into the local file.
     if local_file is None:
+        contents = board_files.get(remote_file)
         print(contents.decode("utf-8"))
+    elif local_file == "-":
+        with click.open_file(local_file, "wb") as outfile:
+            board_files.get(remote_file, outfile)
     else:
-        local_file.write(contents)
+        # Download to a .part file which only replaces the local file once
+        # the whole file arrived.
+        partial = local_file + ".part"
+        try:
+            with open(partial, "wb") as outfile:
+                board_files.get(remote_file, outfile)
+        except BaseException:
+            os.remove(partial)
+            raise
+        if hasattr(os, "replace"):
+            os.replace(partial, local_file)
+        else:
+            # Python 2 can't rename over an existing file on Windows.
+            if os.path.exists(local_file):
+                os.remove(local_file)
+            os.rename(partial, local_file)
 
 
 @cli.command()
@@ -140,37 +251,30 @@ def get(remote_file, local_file):
 @click.option(
     "--make-parents", is_flag=True, help="Create any missing parents."
 )
-@click.argument("directory")
+@click.argument("directory", nargs=-1, required=True)
 def mkdir(directory, exists_okay, make_parents):
     """
-    Create a directory on the board.
+    Create directories on the board.
 
-    Mkdir will create the specified directory on the board.  One argument is
-    required, the full path of the directory to create.
+    Mkdir will create the specified directories on the board, in order.  At
+    least one argument is required, the full path of the directory to create.
 
     By default you cannot recursively create a hierarchy of directories with one
-    mkdir command. You may create each parent directory with separate
-    mkdir command calls, or use the --make-parents option.
-    
+    mkdir command. You may create each parent directory first, or use the
+    --make-parents option.
+
     For example to make a directory under the root called 'code':
 
       ampy --port /board/serial/port mkdir /code
-      
+
     To make a directory under the root called 'code/for/ampy', along with all
     missing parents:
 
       ampy --port /board/serial/port mkdir --make-parents /code/for/ampy
     """
     # Run the mkdir command.
-    board_files = files.Files(_board)
-    if make_parents:
-        if directory[0] != '/':
-            directory = "/" + directory
-        dirpath = ""
-        for dir in directory.split("/")[1:-1]:
-            dirpath += "/" + dir
-            board_files.mkdir(dirpath, exists_okay=True)
-    board_files.mkdir(directory, exists_okay=exists_okay)
+    board_files = files.Files(_board, retries=_retries)
+    board_files.mkdir(list(directory), exists_okay=exists_okay, parents=make_parents)
 
 
 @cli.command()
@@ -207,15 +311,53 @@ def ls(directory, long_format, recursive):
       ampy --port /board/serial/port ls -l /foo/bar
     """
     # List each file/directory on a separate line.
-    board_files = files.Files(_board)
+    board_files = files.Files(_board, retries=_retries)
     for f in board_files.ls(directory, long_format=long_format, recursive=recursive):
         print(f)
 
 
+def verify_option(command):
+    # The --verify option shared by put and sync.
+    return click.option(
+        "--verify",
+        is_flag=True,
+        help="Check the uploaded files by hashing them on the board.",
+    )(command)
+
+
+def compile_options(command):
+    # The --compile and --mpy-cross options shared by put and sync.
+    command = click.option(
+        "--mpy-cross",
+        envvar="AMPY_MPY_CROSS",
+        default="mpy-cross",
+        help="Cross-compiler command used by --compile, with any flags (default mpy-cross).  Can optionally specify with AMPY_MPY_CROSS environment variable.",
+        metavar="COMMAND",
+    )(command)
+    return click.option(
+        "--compile",
+        "compile_",
+        is_flag=True,
+        help="Compile .py files (except boot.py and main.py) to .mpy files before uploading them.",
+    )(command)
+
+
 @cli.command()
 @click.argument("local", type=click.Path(exists=True))
 @click.argument("remote", required=False)
-def put(local, remote):
+@click.option(
+    "--delta",
+    is_flag=True,
+    help="Only send the blocks of each file which differ from the file already on the board.",
+)
+@click.option(
+    "--no-compress",
+    is_flag=True,
+    help="Never compress files, even if the board can decompress them.",
+)
+@verify_option
+@compile_options
+def put(local, remote, delta, no_compress, verify, compile_, mpy_cross):
     """Put a file or folder and its contents on the board.
 
     Put will upload a local file or folder  to the board.  If the file already
@@ -245,54 +387,348 @@ def put(local, remote):
     /lib/adafruit_library on the board run:
 
       ampy --port /board/serial/port put adafruit_library /lib/adafruit_library
+
+    Add the --delta flag to only send the parts of files that changed, which
+    is much faster when updating big files with small edits:
+
+      ampy --port /board/serial/port put --delta model.bin
+
+    Add the --compile flag to upload .py files as precompiled .mpy files,
+    which are smaller and don't use the board's time and memory to compile
+    at import.  Compiled files are cached so unchanged files are only
+    compiled once.  Note MicroPython imports a .py file before a .mpy file
+    of the same name, so remove any old .py files from the board:
+
+      ampy --port /board/serial/port put --compile adafruit_library /lib/adafruit_library
+
+    Add the --verify flag to have the board hash the uploaded files and check
+    them against the local ones, which is much faster than reading them back.
+
+    With several ports the same files are put on every board at once:
+
+      ampy --port /dev/ttyUSB0 --port /dev/ttyUSB1 put adafruit_library
     """
+    mpy_cross = compiler.MpyCross(mpy_cross) if compile_ else None
+    start = time.time()
     # Use the local filename if no remote filename is provided.
     if remote is None:
         remote = os.path.basename(os.path.abspath(local))
+    if _ports:
+        if os.path.isdir(local):
+            remote_dirs, paths = upload_paths(local, remote)
+        else:
+            remote_dirs, paths = [], [(local, remote)]
+        put_fleet(remote_dirs, paths, delta, no_compress, verify, mpy_cross)
+        return
+    board_files = files.Files(_board, compress=not no_compress, retries=_retries)
     # Check if path is a folder and do recursive copy of everything inside it.
     # Otherwise it's a file and should simply be copied over.
     if os.path.isdir(local):
-        # Create progress bar for each file
+        # Create progress bar for each file, and find the board filesystem
+        # absolute path of each directory.
         pb_bath =  PorgressBarBath('Overall progress')
-        for parent, child_dirs, child_files in os.walk(local, followlinks=True):
-            for filename in child_files:
-                path = os.path.join(parent, filename)
-                size = os.stat(path).st_size
-                pb_bath.add_subjob(PorgressBar(name=path,total=size ))
-
-        # Directory copy, create the directory and walk all children to copy
-        # over the files.
-        board_files = files.Files(_board)
-        for parent, child_dirs, child_files in os.walk(local, followlinks=True):
-            # Create board filesystem absolute path to parent directory.
-            remote_parent = posixpath.normpath(
-                posixpath.join(remote, os.path.relpath(parent, local))
-            )
-            try:
-                # Create remote parent directory.
-                board_files.mkdir(remote_parent)
-            except files.DirectoryExistsError:
-                # Ignore errors for directories that already exist.
-                pass
-            
-            # Loop through all the files and put them on the board too.
-            for filename in child_files:
-                local_path = os.path.join(parent, filename)
-                with open(local_path, "rb") as infile:
-                    remote_filename = posixpath.join(remote_parent, filename)
-                    data = infile.read()
-                    job = pb_bath.get_subjob(local_path)
-                    callback = job.on_progress_done
-                    board_files.put(remote_filename, data, callback)
+        remote_dirs, paths = upload_paths(local, remote)
+
+        def upload_size(path):
+            if mpy_cross:
+                # Compile now (the result is cached) to know the size.
+                return len(read_upload(path[0], path[1], mpy_cross)[1])
+            return os.stat(path[0]).st_size
+
+        for path, size in zip(paths, pipeline.prefetch(upload_size, paths)):
+            pb_bath.add_subjob(PorgressBar(name=path[0],total=size ))
+
+        with board_files.session():
+            algorithm = board_files.hash_algorithm() if verify else None
+            digests = {}
+
+            # Directory copy, read (and compile) the upcoming files, and hash
+            # them to verify them, in other threads while the current one is
+            # sent.
+            def prepare(path):
+                remote_filename, data = read_upload(path[0], path[1], mpy_cross)
+                if algorithm:
+                    digests[remote_filename] = files.file_digest(data, algorithm)
+                return remote_filename, data, pb_bath.get_subjob(path[0]).on_progress_done
+
+            entries = pipeline.prefetch(prepare, paths)
+            # Create the whole directory tree in one go first.
+            board_files.mkdir(remote_dirs, parents=True)
+            if delta:
+                for path, data, callback in entries:
+                    board_files.put_delta(path, data, callback)
+            else:
+                # Send all the files in one go.
+                board_files.put_files(entries)
+            if verify:
+                board_files.verify(digests)
     else:
-        # File copy, open the file and copy its contents to the board.
-        # Put the file on the board.
-        with open(local, "rb") as infile:
-            data = infile.read()
-            progress = PorgressBar(name=local, total=len(data))
-            board_files = files.Files(_board)
-            board_files.put(remote, data, progress.on_progress_done)
+        # File copy, read the file and copy its contents to the board.
+        remote, data = read_upload(local, remote, mpy_cross)
+        progress = PorgressBar(name=local, total=len(data))
+        with board_files.session():
+            if delta:
+                board_files.put_delta(remote, data, progress.on_progress_done)
+            else:
+                board_files.put(remote, data, progress.on_progress_done)
+            if verify:
+                algorithm = board_files.hash_algorithm()
+                digests = {remote: files.file_digest(data, algorithm)}
+                board_files.verify(digests)
     print('')
+    if verify:
+        print_verified(len(digests), algorithm)
+    print_transfer_stats(board_files, time.time() - start)
+
+
+def put_fleet(remote_dirs, paths, delta, no_compress, verify, mpy_cross):
+    # Put the same files on every board of the fleet.  They're read (and
+    # compiled) once, and compressed and hashed once for all the boards.
+    uploads = list(
+        pipeline.prefetch(lambda path: read_upload(path[0], path[1], mpy_cross), paths)
+    )
+    work = fleet.SharedWork()
+
+    def operation(board, echo):
+        board_files = files.Files(
+            board,
+            compress=not no_compress,
+            retries=_retries,
+            compress_cache=work.compressed,
+        )
+        with board_files.session():
+            board_files.mkdir(remote_dirs, parents=True)
+            if delta:
+                for path, data in uploads:
+                    board_files.put_delta(path, data)
+            else:
+                board_files.put_files((path, data, None) for path, data in uploads)
+            if verify:
+                algorithm = board_files.hash_algorithm()
+                board_files.verify(
+                    dict((path, work.digest(data, algorithm)) for path, data in uploads)
+                )
+                echo(verified_message(len(uploads), algorithm))
+        echo("{0} files uploaded".format(len(uploads)))
+
+    run_fleet(operation)
+
+
+def upload_paths(local, remote):
+    # The board directories to create and the (local path, remote path) of
+    # each file to put a local folder to remote on the board.
+    remote_dirs = []
+    paths = []
+    for parent, child_dirs, child_files in os.walk(local, followlinks=True):
+        remote_parent = posixpath.normpath(
+            posixpath.join(remote, os.path.relpath(parent, local))
+        )
+        remote_dirs.append(remote_parent)
+        for filename in child_files:
+            paths.append(
+                (os.path.join(parent, filename), posixpath.join(remote_parent, filename))
+            )
+    return remote_dirs, paths
+
+
+def read_upload(local_path, remote_path, mpy_cross=None):
+    # Read a local file to upload, returning the remote path and data to
+    # upload: compiled by mpy_cross if given and the file should be.
+    with open(local_path, "rb") as infile:
+        data = infile.read()
+    if mpy_cross:
+        return mpy_cross.convert(remote_path, data)
+    return remote_path, data
+
+
+def verified_message(count, algorithm):
+    if algorithm == "size":
+        return "Verified the size of {0} files, the board can't hash files".format(count)
+    return "Verified {0} files ({1})".format(count, algorithm)
+
+
+def print_verified(count, algorithm):
+    print(verified_message(count, algorithm))
+
+
+def print_transfer_stats(board_files, seconds):
+    # Tell the user how much compression or delta transfers saved, if anything.
+    if board_files.sent_bytes >= board_files.data_bytes or seconds <= 0:
+        return
+    print(
+        "Sent {0} bytes for {1} bytes of data ({2:.1f}x less), {3:.0f} bytes/s effective".format(
+            board_files.sent_bytes,
+            board_files.data_bytes,
+            board_files.data_bytes / float(max(board_files.sent_bytes, 1)),
+            board_files.data_bytes / seconds,
+        )
+    )
+
+@cli.command()
+@click.argument("local", type=click.Path(exists=True, file_okay=False))
+@click.argument("remote", default="/")
+@click.option(
+    "--delete",
+    is_flag=True,
+    help="Delete files on the board that don't exist locally.",
+)
+@click.option(
+    "--delta",
+    is_flag=True,
+    help="Only send the blocks of changed files which differ from the board's copy.",
+)
+@verify_option
+@compile_options
+def sync(local, remote, delete, delta, verify, compile_, mpy_cross):
+    """Upload only the changed files of a folder to the board.
+
+    Sync hashes every file under the remote folder on the board and compares
+    the hashes with the local files, then uploads just the new and changed
+    ones.  You must pass the local folder to sync, and can pass a second
+    argument with the folder on the board to sync it to (the root, /, by
+    default).
+
+    For example to sync the contents of a local build folder to the board's
+    root run:
+
+      ampy --port /board/serial/port sync build
+
+    Or to sync it to /lib and remove any files under /lib which are not in the
+    local folder run:
+
+      ampy --port /board/serial/port sync --delete build /lib
+
+    Add the --compile flag to upload .py files as precompiled .mpy files (see
+    put).  Combined with --delete this also removes the old .py files.  Add
+    the --verify flag to check the uploaded files (see put).
+
+    With several ports every board is synced at once, each getting the
+    files it's missing:
+
+      ampy --port "/dev/ttyUSB*" sync build
+    """
+    if not remote.startswith("/"):
+        remote = "/" + remote
+    remote = posixpath.normpath(remote)
+    mpy_cross = compiler.MpyCross(mpy_cross) if compile_ else None
+    start = time.time()
+    paths = []
+    for parent, child_dirs, child_files in os.walk(local, followlinks=True):
+        remote_parent = posixpath.normpath(
+            posixpath.join(remote, os.path.relpath(parent, local).replace(os.sep, "/"))
+        )
+        for filename in sorted(child_files):
+            paths.append(
+                (os.path.join(parent, filename), posixpath.join(remote_parent, filename))
+            )
+    if _ports:
+        # Read (and compile) the files once for all the boards, and hash them
+        # once for each algorithm the boards use.
+        loaded = list(
+            pipeline.prefetch(lambda path: read_upload(path[0], path[1], mpy_cross), paths)
+        )
+        work = fleet.SharedWork()
+
+        def operation(board, echo):
+            board_files = files.Files(board, retries=_retries, compress_cache=work.compressed)
+            sync_board(
+                board_files,
+                remote,
+                lambda algorithm: (
+                    (path, data, work.digest(data, algorithm)) for path, data in loaded
+                ),
+                delete,
+                delta,
+                verify,
+                echo,
+            )
+
+        run_fleet(operation)
+        return
+
+    # Read, compile and hash the local files in other threads.
+    def prepare(path, algorithm):
+        remote_filename, data = read_upload(path[0], path[1], mpy_cross)
+        return remote_filename, data, files.file_digest(data, algorithm)
+
+    board_files = files.Files(_board, retries=_retries)
+    sync_board(
+        board_files,
+        remote,
+        lambda algorithm: pipeline.prefetch(lambda path: prepare(path, algorithm), paths),
+        delete,
+        delta,
+        verify,
+        print,
+    )
+    print_transfer_stats(board_files, time.time() - start)
+
+
+def sync_board(board_files, remote, prepared, delete, delta, verify, echo):
+    # Sync one board's remote folder, prepared(algorithm) giving the remote
+    # path, data and digest of each local file.  Echo prints a line.
+    with board_files.session():
+        algorithm, remote_hashes = board_files.hashes(remote, missing_okay=True)
+        if algorithm is None:
+            # The folder doesn't exist, there's nothing to compare.
+            algorithm = board_files.hash_algorithm() if verify else "size"
+        # Folders which hold files on the board already exist.
+        remote_dirs = set(["/"])
+        for path in remote_hashes:
+            while path != "/":
+                path = posixpath.dirname(path)
+                remote_dirs.add(path)
+
+        local_paths = set()
+        uploads = []
+        digests = {}
+        for remote_filename, data, digest in prepared(algorithm):
+            local_paths.add(remote_filename)
+            if remote_hashes.get(remote_filename) == digest:
+                continue
+            uploads.append((remote_filename, data))
+            digests[remote_filename] = digest
+
+        # Create the folders which are missing on the board, and any missing
+        # parents, in one go.
+        board_files.mkdir(
+            sorted(
+                set(posixpath.dirname(path) for path, data in uploads) - remote_dirs
+            ),
+            parents=True,
+        )
+
+        def entries():
+            for remote_filename, data in uploads:
+                echo(remote_filename)
+                yield remote_filename, data, None
+
+        if delta:
+            for path, data, callback in entries():
+                if path in remote_hashes:
+                    board_files.put_delta(path, data)
+                else:
+                    board_files.put(path, data)
+        else:
+            # Send all the changes in one go.
+            board_files.put_files(entries())
+        if verify:
+            board_files.verify(digests)
+        uploaded = len(uploads)
+        deleted = 0
+        if delete:
+            for remote_filename in sorted(set(remote_hashes) - local_paths):
+                echo("Deleting {0}".format(remote_filename))
+                board_files.rm(remote_filename)
+                deleted += 1
+    echo(
+        "{0} uploaded, {1} unchanged, {2} deleted".format(
+            uploaded, len(local_paths) - uploaded, deleted
+        )
+    )
+    if verify:
+        echo(verified_message(uploaded, algorithm))
+
 
 @cli.command()
 @click.argument("remote_file")
@@ -309,7 +745,7 @@ def rm(remote_file):
       ampy --port /board/serial/port rm main.py
     """
     # Delete the provided file/directory on the board.
-    board_files = files.Files(_board)
+    board_files = files.Files(_board, retries=_retries)
     board_files.rm(remote_file)
 
 
@@ -317,22 +753,54 @@ def rm(remote_file):
 @click.option(
     "--missing-okay", is_flag=True, help="Ignore if the directory does not exist."
 )
-@click.argument("remote_folder")
+@click.argument("remote_folder", nargs=-1, required=True)
 def rmdir(remote_folder, missing_okay):
-    """Forcefully remove a folder and all its children from the board.
+    """Forcefully remove folders and all their children from the board.
 
-    Remove the specified folder from the board's filesystem.  Must specify one
-    argument which is the path to the folder to delete.  This will delete the
-    directory and ALL of its children recursively, use with caution!
+    Remove the specified folders from the board's filesystem.  Must specify at
+    least one argument which is the path to a folder to delete.  This will
+    delete the directories and ALL of their children recursively, use with
+    caution!  The number of files deleted is printed.
 
     For example to delete everything under /adafruit_library from the root of a
     board run:
 
       ampy --port /board/serial/port rmdir adafruit_library
+
+    Several folders can be removed at once, which is faster than one at a
+    time:
+
+      ampy --port /board/serial/port rmdir /lib /data
     """
-    # Delete the provided file/directory on the board.
-    board_files = files.Files(_board)
-    board_files.rmdir(remote_folder, missing_okay=missing_okay)
+    # Delete the provided directories on the board.
+    board_files = files.Files(_board, retries=_retries)
+    count = board_files.rmdir(list(remote_folder), missing_okay=missing_okay)
+    print("{0} files deleted".format(count))
+
+
+@cli.command("hash")
+@click.argument("remote_file", nargs=-1, required=True)
+def hash_(remote_file):
+    """Print checksums of files on the board.
+
+    Hash has the board compute a checksum of each file, reading it in small
+    chunks, and prints just the checksums, so big files can be checked
+    without downloading them.  The checksum is a SHA-256 hash like sha256sum
+    prints, or on boards without hashlib the size and CRC32 of the file (or
+    just the size if the board doesn't have that either).
+
+    For example to check the main.py and boot.py on the board run:
+
+      ampy --port /board/serial/port hash main.py boot.py
+    """
+    board_files = files.Files(_board, retries=_retries)
+    algorithm, digests = board_files.file_hashes(remote_file)
+    if algorithm != "sha256":
+        click.echo("The board can't compute SHA-256, showing {0}".format(algorithm), err=True)
+    for path in remote_file:
+        if digests[path] is None:
+            raise RuntimeError("No such file: {0}".format(path))
+        print("{0}  {1}".format(digests[path], path))
 
 
 @cli.command()
@@ -361,9 +829,28 @@ def run(local_file, no_output):
     Or to run test.py and not wait for it to finish:
 
       ampy --port /board/serial/port run --no-output test.py
+
+    With several ports the script runs on every board at once, and each
+    board's output is printed once they're all done.
     """
+    if _ports:
+        if not os.path.isfile(local_file):
+            click.echo(
+                "Failed to find or read input file: {0}".format(local_file), err=True
+            )
+            sys.exit(1)
+
+        def operation(board, echo):
+            board_files = files.Files(board, retries=_retries)
+            output = board_files.run(local_file, not no_output, False)
+            if output is not None:
+                for line in output.decode("utf-8", "replace").splitlines():
+                    echo(line)
+
+        run_fleet(operation)
+        return
     # Run the provided file and print its output.
-    board_files = files.Files(_board)
+    board_files = files.Files(_board, retries=_retries)
     try:
         output = board_files.run(local_file, not no_output, not no_output)
         if output is not None:
@@ -404,13 +891,33 @@ def reset(mode):
     and firmware, several different types of reset may be supported.
 
       ampy --port /board/serial/port reset
+
+    With several ports every board is reset at once.
     """
-    _board.enter_raw_repl()
-    if mode == "SOFT":
-        _board.exit_raw_repl()
+    if _ports:
+
+        def operation(board, echo):
+            message = reset_board(board, mode)
+            if message:
+                raise RuntimeError(message)
+            echo("Reset")
+
+        run_fleet(operation)
         return
+    message = reset_board(_board, mode)
+    if message:
+        click.echo(message, err=True)
+
 
-    _board.exec_(
+def reset_board(board, mode):
+    # Reset a board in the given mode (see reset), returning the reason it
+    # can't be done if the board says so.
+    board.enter_raw_repl(soft_reset=True)
+    if mode == "SOFT":
+        board.exit_raw_repl()
+        return ""
+
+    board.exec_(
         """if 1:
         def on_next_reset(x):
             try:
@@ -431,18 +938,17 @@ def reset(mode):
             microcontroller.reset()
     """
     )
-    r = _board.eval("on_next_reset({})".format(repr(mode)))
-    print("here we are", repr(r))
+    r = board.eval("on_next_reset({})".format(repr(mode)))
     if r:
-        click.echo(r, err=True)
-        return
+        return r.decode("utf-8")
 
     try:
-        _board.exec_raw_no_follow("reset()")
+        board.exec_raw_no_follow("reset()")
     except serial.serialutil.SerialException as e:
         # An error is expected to occur, as the board should disconnect from
         # serial when restarted via microcontroller.reset()
         pass
+    return ""
 
 
 if __name__ == "__main__":
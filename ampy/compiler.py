@@ -0,0 +1,151 @@
+# Adafruit MicroPython Tool - Cross-compiling Python Sources to .mpy
+# Copyright (c) 2016 Adafruit Industries
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+import hashlib
+import os
+import posixpath
+import shlex
+import shutil
+import subprocess
+import tempfile
+
+
+# Files MicroPython only runs as source, which must never be compiled.
+SOURCE_ONLY = ("boot.py", "main.py")
+
+
+def default_cache_dir():
+    """Return the folder compiled files are cached in by default."""
+    base = os.environ.get("XDG_CACHE_HOME") or os.path.join(
+        os.path.expanduser("~"), ".cache"
+    )
+    return os.path.join(base, "ampy", "mpy")
+
+
+class MpyCross(object):
+    """Compile Python sources to .mpy files with mpy-cross (or any program
+    taking the same arguments) so the board doesn't have to compile them at
+    import time.  Compiled files are cached in cache_dir, keyed by a hash of
+    the source, its name, the compiler's version and the full command line
+    (flags included), so an unchanged file is never compiled twice.
+
+    The command is a string split like a shell would, or a list of arguments,
+    and may include flags like -march.
+    """
+
+    def __init__(self, command="mpy-cross", cache_dir=None):
+        if isinstance(command, str):
+            command = shlex.split(command)
+        self._command = list(command)
+        self._cache_dir = cache_dir or default_cache_dir()
+        self._version = None
+        # Number of files actually compiled, i.e. not found in the cache.
+        self.compiled = 0
+
+    def _run(self, arguments):
+        try:
+            process = subprocess.Popen(
+                self._command + arguments,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+            )
+        except OSError as ex:
+            raise RuntimeError(
+                "Could not run the cross-compiler {0}: {1}".format(self._command[0], ex)
+            )
+        out, err = process.communicate()
+        return process.returncode, out, err
+
+    def version(self):
+        """Return the version string the compiler reports."""
+        if self._version is None:
+            returncode, out, err = self._run(["--version"])
+            if returncode != 0:
+                raise RuntimeError(
+                    "Could not get the version of the cross-compiler {0}: {1}".format(
+                        self._command[0], err.decode("utf-8", "replace").strip()
+                    )
+                )
+            self._version = out.decode("utf-8", "replace").strip()
+        return self._version
+
+    def should_compile(self, path):
+        """Return True if the file with the specified path is compiled."""
+        name = posixpath.basename(path)
+        return name.endswith(".py") and name not in SOURCE_ONLY
+
+    def compile(self, source, name):
+        """Return the .mpy data compiled from the provided source, name being
+        the file's name (like foo.py) as shown in tracebacks.
+        """
+        key = hashlib.sha256()
+        for part in [self.version(), name] + self._command:
+            key.update(part.encode("utf-8") + b"\0")
+        key.update(source)
+        key = key.hexdigest()
+        path = os.path.join(self._cache_dir, key[:2], key + ".mpy")
+        if os.path.exists(path):
+            with open(path, "rb") as infile:
+                return infile.read()
+        workdir = tempfile.mkdtemp()
+        try:
+            source_path = os.path.join(workdir, name)
+            output_path = os.path.join(workdir, "out.mpy")
+            with open(source_path, "wb") as outfile:
+                outfile.write(source)
+            returncode, out, err = self._run(
+                ["-s", name, "-o", output_path, source_path]
+            )
+            if returncode != 0:
+                raise RuntimeError(
+                    "Failed to compile {0}: {1}".format(
+                        name, err.decode("utf-8", "replace").strip()
+                    )
+                )
+            with open(output_path, "rb") as infile:
+                data = infile.read()
+        finally:
+            shutil.rmtree(workdir)
+        self.compiled += 1
+        # Write the cache entry under a temporary name and rename it in
+        # place, so an interrupted run never leaves a truncated entry.
+        try:
+            os.makedirs(os.path.dirname(path))
+        except OSError:
+            # It exists already.
+            pass
+        handle, temporary = tempfile.mkstemp(dir=os.path.dirname(path))
+        with os.fdopen(handle, "wb") as outfile:
+            outfile.write(data)
+        try:
+            os.rename(temporary, path)
+        except OSError:
+            # Another run cached the same file meanwhile.
+            os.remove(temporary)
+        return data
+
+    def convert(self, path, data):
+        """Return the remote path and data to upload for the file with the
+        specified remote path and contents: the compiled .mpy file if it
+        should be compiled, otherwise the file itself.
+        """
+        if not self.should_compile(path):
+            return path, data
+        return path[:-3] + ".mpy", self.compile(data, posixpath.basename(path))
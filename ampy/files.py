@@ -20,288 +20,1473 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 import ast
+import collections
+import contextlib
+import hashlib
+import io
+import os
+import posixpath
+import re
 import textwrap
+import zlib
 import binascii
 
-from ampy.pyboard import PyboardError
+from ampy.pipeline import prefetch
+from ampy.pyboard import PyboardError, WebreplToSerial
+
+try:
+    from serial import SerialException
+except ImportError:
+    # No pyserial, only telnet connections then.
+    SerialException = IOError
 
 
 BUFFER_SIZE = 32  # Amount of data to read or write to the serial port at a time.
 # This is kept small because small chips and USB to serial
 # bridges usually have very small buffers.
 
+BLOCK_SIZE = 1024  # Amount of data sent per block by the base64 transfers.
+# These are paced by the board asking for every block, so they can be much
+# bigger than BUFFER_SIZE, but each block has to fit in the board's RAM.
+
+
+COMPRESSION_WBITS = 10  # Window size (as a power of 2) for compressed uploads.
+# The board has to hold the whole window in RAM while inflating.
+
+COMPRESSION_THRESHOLD = 0.9  # Only send compressed data if it is at most this
+# fraction of the original size.
+
+RETRIES = 3  # Number of times a transfer is resumed after the connection
+# failed (a timeout or serial error) before giving up.
+
+# Import binascii on the board, whatever it is called there.
+IMPORT_BINASCII = """
+            try:
+                import ubinascii as binascii
+            except ImportError:
+                import binascii
+"""
+
+# Define decompressor(stream) on the board, which returns a stream inflating
+# the zlib data read from the given stream, using whichever of the deflate,
+# zlib and uzlib modules the firmware has.
+DEFINE_DECOMPRESSOR = """
+            try:
+                import deflate
+                zlib = None
+                def decompressor(stream):
+                    return deflate.DeflateIO(stream, deflate.ZLIB, {0})
+            except ImportError:
+                try:
+                    import uzlib as zlib
+                except ImportError:
+                    import zlib
+                def decompressor(stream):
+                    return zlib.DecompIO(stream, {0})
+""".format(
+    COMPRESSION_WBITS
+)
+
+# Every helper but base is defined by running its source in this function,
+# with the modules of _ampy as locals.
+HELPER_FUNCTION = """
+def _ampy_define():
+    os, sys, binascii = _ampy.os, _ampy.sys, _ampy.binascii
+{0}
+_ampy_define()
+del _ampy_define
+"""
+
+# Command running the setup and printing the answer of a probe, whose source
+# replaces {0}.
+PROBE_FUNCTION = """
+def _ampy_probe():
+{0}
+try:
+    print(_ampy_probe())
+finally:
+    del _ampy_probe
+"""
+
+# Helper functions kept in the board's RAM.  Instead of sending a whole script
+# for every operation, the helpers an operation needs are defined on the board
+# the first time they're used in a raw REPL session and the operation itself
+# is then a one-line call like _ampy.ls('/lib', 0), see Files._exec.  Each
+# entry maps a helper's name to the names of the helpers it uses and to its
+# source, which adds the helper to the _ampy class.  The source runs inside a
+# function (see helper_command) so its names don't clobber the user's
+# globals, _ampy is the only global the helpers add.
+HELPERS = {
+    # The _ampy class, with the os, binascii and sys modules the helpers use
+    # as attributes.  Binascii is None on firmware without it, where only
+    # the helpers which don't need it can be used.
+    "base": (
+        (),
+        """
+            class _ampy:
+                try:
+                    import os
+                except ImportError:
+                    import uos as os
+                try:
+                    import ubinascii as binascii
+                except ImportError:
+                    try:
+                        import binascii
+                    except ImportError:
+                        binascii = None
+                import sys
+""",
+    ),
+    # Print the stat tuple of a path.
+    "stat": (
+        ("base",),
+        """
+            def stat(path):
+                print(tuple(os.stat(path)))
+            _ampy.stat = stat
+""",
+    ),
+    # Iterate over the entries of a directory like os.ilistdir, which gives
+    # each entry's type and size without a stat call, on firmware without it
+    # too.
+    "ilistdir": (
+        ("base",),
+        """
+            def ilistdir(directory):
+                if hasattr(os, 'ilistdir'):
+                    for entry in os.ilistdir(directory):
+                        yield entry
+                    return
+                for name in os.listdir(directory):
+                    st = os.stat(directory.rstrip('/') + '/' + name)
+                    yield name, st[0] & 0xf000, 0, st[6]
+            _ampy.ilistdir = ilistdir
+""",
+    ),
+    # Print a line for each entry of a directory, or for everything below it
+    # when recursive, as it goes: 'd' or 'f', the size and the path.  Only the
+    # directories still to list are kept in memory.
+    "ls": (
+        ("ilistdir",),
+        """
+            def ls(directory, recursive):
+                stack = [directory]
+                while stack:
+                    parent = stack.pop()
+                    for entry in _ampy.ilistdir(parent):
+                        path = parent.rstrip('/') + '/' + entry[0]
+                        if len(entry) > 3:
+                            size = entry[3]
+                        else:
+                            size = os.stat(path)[6]
+                        if entry[1] == 0x4000:
+                            print('d', size, path)
+                            if recursive:
+                                stack.append(path)
+                        else:
+                            print('f', size, path)
+            _ampy.ls = ls
+""",
+    ),
+    # Create directories in order, and their missing parents too if parents
+    # is set.  Directories which already exist are fine if parents or
+    # exists_okay is set, otherwise (and on any other error) the path which
+    # failed is printed before the error is raised.
+    "mkdir": (
+        ("base",),
+        """
+            def mkdir(directories, parents, exists_okay):
+                for directory in directories:
+                    paths = [directory]
+                    if parents:
+                        paths = []
+                        path = '/' if directory.startswith('/') else ''
+                        for part in directory.split('/'):
+                            if part:
+                                path += part
+                                paths.append(path)
+                                path += '/'
+                    for path in paths:
+                        try:
+                            os.mkdir(path)
+                        except OSError as e:
+                            if e.args[0] != 17 or not (parents or exists_okay):
+                                print(path)
+                                raise
+            _ampy.mkdir = mkdir
+""",
+    ),
+    # Remove directories and everything in them, then print the number of
+    # files deleted.  The tree is walked with an explicit stack rather than
+    # recursion, which could overflow the board's small stack, and every
+    # directory is pushed a second time to be removed once it's empty.  Each
+    # directory's entries are listed before deleting any of them since not
+    # every filesystem copes with changes while listing.  If a directory
+    # doesn't exist nothing is deleted and '!' and its path are printed
+    # instead, unless missing_okay is set.
+    "rmtree": (
+        ("ilistdir",),
+        """
+            def rmtree(directories, missing_okay):
+                stack = []
+                for directory in directories:
+                    try:
+                        os.stat(directory)
+                    except OSError:
+                        if not missing_okay:
+                            print('!' + directory)
+                            return
+                        continue
+                    stack.append((directory, False))
+                count = 0
+                while stack:
+                    directory, emptied = stack.pop()
+                    if emptied:
+                        os.rmdir(directory)
+                        continue
+                    stack.append((directory, True))
+                    entries = [(e[0], e[1]) for e in _ampy.ilistdir(directory)]
+                    for name, kind in entries:
+                        path = directory.rstrip('/') + '/' + name
+                        if kind == 0x4000:
+                            stack.append((path, False))
+                        else:
+                            os.remove(path)
+                            count += 1
+                print(count)
+            _ampy.rmtree = rmtree
+""",
+    ),
+    # Print a file's contents a block at a time, as one base64 line per block
+    # or as hex digits.
+    "send": (
+        ("base",),
+        """
+            def send(path, block_size, base64, offset=0):
+                with open(path, 'rb') as f:
+                    f.seek(offset)
+                    while True:
+                        block = f.read(block_size)
+                        if not block:
+                            break
+                        if base64:
+                            sys.stdout.write(binascii.b2a_base64(block))
+                        else:
+                            sys.stdout.write(binascii.hexlify(block))
+            _ampy.send = send
+""",
+    ),
+    # Print every directory and file below a directory, a '>d path' or
+    # '>f path' line each, every file followed by its blocks on their own
+    # lines (see _TreeDecoder).
+    "send_tree": (
+        ("base",),
+        """
+            def send_tree(directory, block_size, base64):
+                stack = [directory]
+                while stack:
+                    directory = stack.pop()
+                    print('>d ' + directory)
+                    for name in os.listdir(directory):
+                        path = directory.rstrip('/') + '/' + name
+                        if os.stat(path)[0] & 0x4000:
+                            stack.append(path)
+                            continue
+                        print('>f ' + path)
+                        with open(path, 'rb') as f:
+                            while True:
+                                block = f.read(block_size)
+                                if not block:
+                                    break
+                                if base64:
+                                    sys.stdout.write(binascii.b2a_base64(block))
+                                else:
+                                    sys.stdout.write(binascii.hexlify(block) + b'\\n')
+            _ampy.send_tree = send_tree
+""",
+    ),
+    # Hash a file or a block of data with the best algorithm available, kept
+    # in _ampy.ALGORITHM.  file_digest computes the same thing on the host.
+    "digest": (
+        ("base",),
+        """
+            try:
+                import uhashlib as hashlib
+            except ImportError:
+                try:
+                    import hashlib
+                except ImportError:
+                    hashlib = None
+            if hasattr(hashlib, 'sha256'):
+                _ampy.ALGORITHM = 'sha256'
+            elif hasattr(binascii, 'crc32'):
+                _ampy.ALGORITHM = 'crc32'
+            else:
+                _ampy.ALGORITHM = 'size'
+            def digest(path, block_size):
+                size = 0
+                crc = 0
+                h = hashlib.sha256() if _ampy.ALGORITHM == 'sha256' else None
+                with open(path, 'rb') as f:
+                    while True:
+                        block = f.read(block_size)
+                        if not block:
+                            break
+                        size += len(block)
+                        if h:
+                            h.update(block)
+                        elif _ampy.ALGORITHM == 'crc32':
+                            crc = binascii.crc32(block, crc)
+                if h:
+                    return binascii.hexlify(h.digest()).decode()
+                if _ampy.ALGORITHM == 'crc32':
+                    return '%d:%08x' % (size, crc & 0xffffffff)
+                return str(size)
+            def digest_block(block):
+                if _ampy.ALGORITHM == 'sha256':
+                    return binascii.hexlify(hashlib.sha256(block).digest()).decode()
+                if _ampy.ALGORITHM == 'crc32':
+                    return '%d:%08x' % (len(block), binascii.crc32(block) & 0xffffffff)
+                return str(len(block))
+            _ampy.digest = digest
+            _ampy.digest_block = digest_block
+""",
+    ),
+    # Print the algorithm, then the digest and path of every file below a
+    # directory, the digest first since paths can contain spaces.
+    "hashes": (
+        ("digest",),
+        """
+            def hashes(directory, block_size):
+                print(_ampy.ALGORITHM)
+                stack = [directory]
+                while stack:
+                    directory = stack.pop()
+                    for name in os.listdir(directory):
+                        path = directory.rstrip('/') + '/' + name
+                        if os.stat(path)[0] & 0x4000:
+                            stack.append(path)
+                        else:
+                            print(_ampy.digest(path, block_size), path)
+            _ampy.hashes = hashes
+""",
+    ),
+    # Print the algorithm, then the digest and path of each of a list of
+    # files, with '-' as the digest of the ones that don't exist.
+    "file_hashes": (
+        ("digest",),
+        """
+            def file_hashes(paths, block_size):
+                print(_ampy.ALGORITHM)
+                for path in paths:
+                    try:
+                        print(_ampy.digest(path, block_size), path)
+                    except OSError:
+                        print('-', path)
+            _ampy.file_hashes = file_hashes
+""",
+    ),
+    # Print the algorithm, then the digest of each block of a file.
+    "block_hashes": (
+        ("digest",),
+        """
+            def block_hashes(path, block_size):
+                print(_ampy.ALGORITHM)
+                with open(path, 'rb') as f:
+                    while True:
+                        block = f.read(block_size)
+                        if not block:
+                            break
+                        print(_ampy.digest_block(block))
+            _ampy.block_hashes = block_hashes
+""",
+    ),
+    # Replace a file with another one.
+    "replace": (
+        ("base",),
+        """
+            def replace(src, dst):
+                try:
+                    os.rename(src, dst)
+                except OSError:
+                    # Some filesystems won't rename over an existing file.
+                    os.remove(dst)
+                    os.rename(src, dst)
+            _ampy.replace = replace
+""",
+    ),
+    # Print how many bytes of a file the partial upload (see recv) holds.
+    "part_size": (
+        ("base",),
+        """
+            def part_size(filename):
+                try:
+                    print(os.stat(filename + '.part')[6])
+                except OSError:
+                    print(0)
+            _ampy.part_size = part_size
+""",
+    ),
+    # Write size bytes sent by the host as base64 blocks to a file, asking
+    # for one block at a time.  The data goes to a .part file which only
+    # replaces the file once complete, and is appended to it when resuming
+    # an upload from offset (the size of the .part file).
+    "recv": (
+        ("replace",),
+        """
+            def recv(filename, size, block_size, offset=0):
+                with open(filename + '.part', 'ab' if offset else 'wb') as f:
+                    while size > 0:
+                        n = min(size, block_size)
+                        sys.stdout.write('\\x06')
+                        f.write(binascii.a2b_base64(sys.stdin.read((n + 2) // 3 * 4)))
+                        size -= n
+                _ampy.replace(filename + '.part', filename)
+            _ampy.recv = recv
+""",
+    ),
+    # A stream reading size bytes sent by the host as base64 blocks, asking
+    # for each block like recv does.
+    "block_stream": (
+        ("base",),
+        """
+            import io
+            class BlockStream(io.IOBase):
+                def __init__(self, size, block_size):
+                    self.size = size
+                    self.block_size = block_size
+                    self.block = b''
+                    self.pos = 0
+                def readinto(self, buf):
+                    if self.pos == len(self.block):
+                        if not self.size:
+                            return 0
+                        n = min(self.size, self.block_size)
+                        sys.stdout.write('\\x06')
+                        self.block = binascii.a2b_base64(sys.stdin.read((n + 2) // 3 * 4))
+                        self.pos = 0
+                        self.size -= n
+                    n = min(len(buf), len(self.block) - self.pos)
+                    buf[:n] = self.block[self.pos:self.pos + n]
+                    self.pos += n
+                    return n
+            _ampy.BlockStream = BlockStream
+""",
+    ),
+    "decompressor": (
+        ("base",),
+        DEFINE_DECOMPRESSOR
+        + """
+            _ampy.decompressor = decompressor
+""",
+    ),
+    # Same as recv for compressed data, inflating it while writing.
+    "recv_compressed": (
+        ("block_stream", "decompressor", "replace"),
+        """
+            def recv_compressed(filename, size, block_size, offset=0):
+                with open(filename + '.part', 'ab' if offset else 'wb') as f:
+                    stream = _ampy.decompressor(_ampy.BlockStream(size, block_size))
+                    while True:
+                        block = stream.read(block_size)
+                        if not block:
+                            break
+                        f.write(block)
+                _ampy.replace(filename + '.part', filename)
+            _ampy.recv_compressed = recv_compressed
+""",
+    ),
+    # Read a stream of framed records, each a header with the kind, size and
+    # path followed by the data blocks, and create the directories and files
+    # they describe, asking for each record once the previous one is written.
+    # Compressed records need the recv_compressed helper.
+    "recv_files": (
+        ("recv",),
+        """
+            def recv_files(block_size):
+                while True:
+                    sys.stdout.write('\\x06')
+                    n = int(sys.stdin.read(8), 16)
+                    if not n:
+                        break
+                    header = binascii.a2b_base64(sys.stdin.read(n)).decode()
+                    kind, size, path = header.split(':', 2)
+                    if kind == 'd':
+                        try:
+                            os.mkdir(path)
+                        except OSError as e:
+                            if e.args[0] != 17:
+                                raise
+                    elif kind == 'z':
+                        _ampy.recv_compressed(path, int(size), block_size)
+                    else:
+                        _ampy.recv(path, int(size), block_size)
+            _ampy.recv_files = recv_files
+""",
+    ),
+    # Rebuild a file from its unchanged blocks and the ones the host sends
+    # (need has a '1' for each of those) in a temporary file which then
+    # replaces it.
+    "patch": (
+        ("replace",),
+        """
+            def patch(path, size, block_size, need):
+                tmp = path + '.ampy'
+                src = open(path, 'rb')
+                with open(tmp, 'wb') as dst:
+                    for i in range(len(need)):
+                        n = min(block_size, size - i * block_size)
+                        if need[i] == '1':
+                            sys.stdout.write('\\x06')
+                            dst.write(binascii.a2b_base64(sys.stdin.read((n + 2) // 3 * 4)))
+                        else:
+                            src.seek(i * block_size)
+                            dst.write(src.read(n))
+                src.close()
+                _ampy.replace(tmp, path)
+            _ampy.patch = patch
+""",
+    ),
+}
+
+
+def compress(data):
+    """Compress data into a zlib stream the board can inflate with a small
+    window.
+    """
+    compressor = zlib.compressobj(9, zlib.DEFLATED, COMPRESSION_WBITS)
+    return compressor.compress(data) + compressor.flush()
+
+
+def file_digest(data, algorithm):
+    """Hash data the same way the board's digest() function does for the
+    given algorithm ('sha256', 'crc32' or 'size').
+    """
+    if algorithm == "sha256":
+        return hashlib.sha256(data).hexdigest()
+    if algorithm == "crc32":
+        return "{0}:{1:08x}".format(len(data), binascii.crc32(data) & 0xFFFFFFFF)
+    return str(len(data))
+
+
+# An item listed by Files.ilistdir: its full path, whether it's a directory
+# and its size in bytes.
+DirEntry = collections.namedtuple("DirEntry", ["path", "is_dir", "size"])
+
+
+def listing(entries, long_format, recursive):
+    """Return the sorted list of strings Files.ls gives for the DirEntry
+    items of a directory (everything below it if recursive).
+    """
+    entries = list(entries)
+    if recursive:
+        # Directories with something in them show up in its paths.
+        parents = set(posixpath.dirname(entry.path) for entry in entries)
+        entries = [e for e in entries if not (e.is_dir and e.path in parents)]
+    entries.sort(key=lambda entry: entry.path)
+    if long_format:
+        return ["{0} - {1} bytes".format(e.path, e.size) for e in entries]
+    return [entry.path for entry in entries]
+
+
+def helper_command(call, helpers, defined):
+    """Prefix a one-line call with the source of whichever of the named
+    HELPERS (and the helpers they use) aren't in defined, the helpers already
+    defined on the board.  Returns the command and the helpers it defines.
+    """
+    needed = []
+
+    def add(name):
+        if name in defined or name in needed:
+            return
+        for dependency in HELPERS[name][0]:
+            add(dependency)
+        needed.append(name)
+
+    for name in helpers:
+        add(name)
+    command = ""
+    for name in needed:
+        source = textwrap.dedent(HELPERS[name][1])
+        if name != "base":
+            source = HELPER_FUNCTION.format(_indented(source))
+        command += source
+    return command + call, needed
+
+
+def probe_command(expression, setup=""):
+    """Return a command printing whether a boolean expression is true on the
+    board, after running the setup code it needs.  Like the helpers, the
+    setup runs inside a function to leave the board's globals alone.
+    """
+    source = textwrap.dedent(setup) + "return bool({0})\n".format(expression)
+    return PROBE_FUNCTION.format(_indented(source))
+
+
+def _indented(source):
+    # Indent source code by one level, to make it the body of a block.
+    return "".join("    " + line if line.strip() else line for line in source.splitlines(True))
+
+
+def _list_literal(paths):
+    # Python source for a list of paths, to pass it to a helper.
+    return "[{0}]".format(", ".join("'{0}'".format(path) for path in paths))
+
+
+def _link_failed(ex):
+    # Whether an error is a failure of the connection, as opposed to an
+    # exception raised by the code running on the board.
+    if isinstance(ex, PyboardError):
+        return not (ex.args and ex.args[0] == "exception")
+    # The port's driver raises plain OS errors too, like when a USB serial
+    # bridge resets.
+    return isinstance(ex, (SerialException, EnvironmentError))
+
+
+def _os_error(ex, number):
+    # Whether an error is an OSError with the given errno raised by the code
+    # running on the board, whose traceback ends with a line like
+    # "OSError: [Errno 2] ENOENT" (or "OSError: 2" on older firmware).
+    if not (isinstance(ex, PyboardError) and len(ex.args) == 3 and ex.args[0] == "exception"):
+        return False
+    message = ex.args[2].decode("utf-8", "replace")
+    match = re.search(r"OSError: (?:\[Errno )?(\d+)", message)
+    return match is not None and int(match.group(1)) == number
+
 
 class DirectoryExistsError(Exception):
     pass
 
 
+class _Progress(object):
+    """Report the progress of an upload which may be resumed to a progress
+    callback, never reporting the same bytes twice.  Called with the size of
+    every block sent, and position is the number of bytes of the file sent.
+    Started is set once the board has begun writing the file, before that
+    there's nothing to resume.
+    """
+
+    def __init__(self, callback):
+        self._callback = callback
+        self._reported = 0
+        self.position = 0
+        self.started = False
+
+    def __call__(self, size):
+        self.position += size
+        if self.position > self._reported:
+            if hasattr(self._callback, '__call__'):
+                self._callback(self.position - self._reported)
+            self._reported = self.position
+
+    def restart(self, position):
+        # Continue from position, bytes the board already has.
+        self.position = 0
+        self(position)
+
+
+class _StreamDecoder(object):
+    """Decode the base64 lines (or hex digits) printed by the board as they
+    arrive and write the decoded bytes to a sink.  Used as the data_consumer
+    of an exec so a download never has to be held in memory.
+    """
+
+    def __init__(self, sink, base64):
+        self._sink = sink
+        self._base64 = base64
+        self._pending = bytearray()
+        # Number of bytes written to the sink.
+        self.size = 0
+
+    def restart(self):
+        # Drop the incomplete block of a transfer that failed, it is sent
+        # again when the transfer resumes from size.
+        del self._pending[:]
+
+    def _decoded(self, data):
+        self._sink.write(data)
+        self.size += len(data)
+
+    def write(self, data):
+        self._pending.extend(data.replace(b"\x04", b""))
+        if self._base64:
+            # Each line holds one encoded block, decode the complete ones.
+            end = self._pending.rfind(b"\n") + 1
+            lines = bytes(self._pending[:end]).split(b"\n")[:-1]
+            for line in lines:
+                self._decoded(binascii.a2b_base64(line))
+        else:
+            # Every two hex digits are a byte.
+            end = len(self._pending) - len(self._pending) % 2
+            self._decoded(binascii.unhexlify(bytes(self._pending[:end])))
+        del self._pending[:end]
+
+    def close(self):
+        # Anything left over is an incomplete block.
+        if self._pending.strip():
+            raise RuntimeError("truncated data received from the board")
+
+
+class _TreeDecoder(object):
+    """Write the files streamed by the board's send_tree script below a local
+    directory as they arrive.  The output is one record per line: '>d path'
+    starts a directory, '>f path' starts a file and every other line is an
+    encoded block of the current file's data.
+    """
+
+    def __init__(self, remote_directory, local_directory, base64):
+        self._remote = remote_directory
+        self._local = local_directory
+        self._base64 = base64
+        self._pending = bytearray()
+        self._file = None
+        self.count = 0
+
+    def _local_path(self, path):
+        relative = posixpath.relpath(path, self._remote)
+        if relative == ".." or relative.startswith("../") or posixpath.isabs(relative):
+            raise RuntimeError("unexpected path received from the board: " + path)
+        return os.path.normpath(os.path.join(self._local, relative))
+
+    def write(self, data):
+        self._pending.extend(data.replace(b"\x04", b""))
+        end = self._pending.rfind(b"\n") + 1
+        lines = bytes(self._pending[:end]).split(b"\n")[:-1]
+        del self._pending[:end]
+        for line in lines:
+            line = line.rstrip(b"\r")
+            if line.startswith(b">d "):
+                self._close_file()
+                path = self._local_path(line[3:].decode("utf-8"))
+                if not os.path.isdir(path):
+                    os.makedirs(path)
+            elif line.startswith(b">f "):
+                self._close_file()
+                self._file = open(self._local_path(line[3:].decode("utf-8")), "wb")
+                self.count += 1
+            elif line:
+                if self._base64:
+                    self._file.write(binascii.a2b_base64(line))
+                else:
+                    self._file.write(binascii.unhexlify(line))
+
+    def _close_file(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def close(self):
+        self._close_file()
+        if self._pending.strip():
+            raise RuntimeError("truncated data received from the board")
+
+
 class Files(object):
     """Class to interact with a MicroPython board files over a serial connection.
     Provides functions for listing, uploading, and downloading files from the
     board's filesystem.
     """
 
-    def __init__(self, pyboard):
+    def __init__(
+        self, pyboard, block_size=BLOCK_SIZE, compress=True, retries=RETRIES, compress_cache=None
+    ):
         """Initialize the MicroPython board files class using the provided pyboard
         instance.  In most cases you should create a Pyboard instance (from
         pyboard.py) which connects to a board over a serial connection and pass
-        it in, but you can pass in other objects for testing, etc.
+        it in, but you can pass in other objects for testing, etc.  The
+        block_size is the number of bytes sent at a time by the fast transfer
+        modes, lower it for boards with very little RAM.  Set compress to False
+        to never compress uploads.  If the connection fails during a get or
+        put, the board is reconnected and the transfer resumed where it
+        stopped, up to retries times.  Compress_cache is a dict, which can be
+        shared by the Files of several boards, remembering the compressed
+        data of each file uploaded so it is only compressed once.
         """
         self._pyboard = pyboard
+        self._session_depth = 0
+        self._block_size = block_size
+        self._compress = compress
+        self._retries = retries
+        self._compress_cache = compress_cache
+        self._probes = {}
+        # Names of the HELPERS defined on the board in this raw REPL session.
+        self._helpers = set()
+        # Whether ilistdir is in the middle of a listing, which any other
+        # command sent to the board would garble.
+        self._listing = False
+        # Bytes of file data uploaded, and the bytes that took on the wire
+        # (before base64 encoding) after compression and delta transfers.
+        self.data_bytes = 0
+        self.sent_bytes = 0
 
-    def get(self, filename):
-        """Retrieve the contents of the specified file and return its contents
-        as a byte string.
-        """
-        # Open the file and read it a few bytes at a time and print out the
-        # raw bytes.  Be careful not to overload the UART buffer so only write
-        # a few bytes at a time, and don't use print since it adds newlines and
-        # expects string data.
-        command = """
-            import sys
-            import ubinascii
-            with open('{0}', 'rb') as infile:
-                while True:
-                    result = infile.read({1})
-                    if result == b'':
-                        break
-                    len = sys.stdout.write(ubinascii.hexlify(result))
-        """.format(
-            filename, BUFFER_SIZE
-        )
+    @contextlib.contextmanager
+    def session(self):
+        """Keep the board in raw REPL mode for every operation inside the with
+        block.  Entering the raw REPL interrupts the running program and soft
+        reboots the board (unless the Pyboard's soft_reset is False), which is
+        slow, so when running many operations in a row wrap them in a session
+        to only pay that cost once:
+
+            with board_files.session():
+                board_files.mkdir('/lib')
+                board_files.put('/lib/foo.py', data)
+
+        Sessions can be nested, only the outermost one enters and exits the
+        raw REPL.
+        """
+        if self._listing:
+            raise RuntimeError(
+                "The board is still listing a directory, finish iterating over ilistdir first"
+            )
+        if self._session_depth == 0:
+            self._pyboard.enter_raw_repl()
+            if getattr(self._pyboard, "soft_reset", True):
+                # The soft reboot cleared the board's RAM, otherwise the
+                # helpers defined by earlier sessions are still there.
+                self._helpers = set()
+        self._session_depth += 1
+        try:
+            yield self
+        finally:
+            self._session_depth -= 1
+            if self._session_depth == 0:
+                self._pyboard.exit_raw_repl()
+
+    def _probe(self, name, expression, setup=""):
+        """Evaluate a boolean expression on the board to find out whether it
+        supports a feature.  The answer is cached for the lifetime of this
+        object, and any error while evaluating counts as unsupported.
+        """
+        if name not in self._probes:
+            command = probe_command(expression, setup)
+            with self.session():
+                try:
+                    out = self._pyboard.exec_(command)
+                except PyboardError:
+                    out = b""
+            self._probes[name] = out.strip() == b"True"
+        return self._probes[name]
+
+    def _command(self, call, helpers):
+        return helper_command(call, helpers, self._helpers)
+
+    def _exec(self, call, helpers, data_consumer=None, chunks=None):
+        """Execute a one-line call on the board, first defining the named
+        HELPERS if needed (see _command).  If chunks is given they're sent as
+        the input of the call (see Pyboard.exec_with_input).  Must be called
+        in a session.
+        """
+        command, needed = self._command(call, helpers)
+        if chunks is None:
+            out = self._pyboard.exec_(command, data_consumer=data_consumer)
+        else:
+            out = self._pyboard.exec_with_input(command, chunks)
+        # Only count the helpers as defined once the exec went through, if
+        # it failed they are simply sent again next time.
+        self._helpers.update(needed)
+        return out
+
+    def _exec_iter(self, call, helpers):
+        # Like _exec, yielding the output as it arrives.
+        command, needed = self._command(call, helpers)
+        with contextlib.closing(self._pyboard.exec_iter(command)) as output:
+            for data in output:
+                yield data
+        self._helpers.update(needed)
+
+    def _reconnect(self):
+        # Open the connection again after it failed and get back in the raw
+        # REPL, interrupting whatever the board was still running.
+        if hasattr(self._pyboard, "reconnect"):
+            self._pyboard.reconnect()
         self._pyboard.enter_raw_repl()
+        # The board may have been reset along with the connection.
+        self._helpers = set()
+
+    def _retrying(self, transfer):
+        """Call transfer(resume) until it doesn't fail because of the
+        connection, reconnecting before every new attempt (with resume True,
+        so it can continue where the failed one stopped).  Gives up after the
+        retries set for this object.  Must be called in a session.
+        """
+        attempt = 0
+        while True:
+            try:
+                if attempt:
+                    self._reconnect()
+                return transfer(attempt > 0)
+            except (PyboardError, SerialException, EnvironmentError) as ex:
+                if attempt >= self._retries or not _link_failed(ex):
+                    raise
+            attempt += 1
+
+    def _part_size(self, filename):
+        # Number of bytes the board has of an interrupted upload.
+        out = self._exec("_ampy.part_size('{0}')".format(filename), ["part_size"])
+        return int(out.decode("utf-8").strip())
+
+    def _has_decompressor(self):
+        return self._probe(
+            "decompressor",
+            "zlib is None or hasattr(zlib, 'DecompIO')",
+            setup=DEFINE_DECOMPRESSOR,
+        )
+
+    def _has_base64(self):
+        return self._probe(
+            "base64",
+            "hasattr(binascii, 'a2b_base64') and hasattr(binascii, 'b2a_base64')",
+            setup=IMPORT_BINASCII,
+        )
+
+    def _webrepl(self):
+        # The WebREPL connection of the board, None if it isn't connected
+        # through one.
+        connection = getattr(self._pyboard, "serial", None)
+        if isinstance(connection, WebreplToSerial):
+            return connection
+        return None
+
+    def get(self, filename, sink=None):
+        """Retrieve the contents of the specified file.  If sink is None the
+        contents are returned as a byte string, otherwise they are written to
+        sink (any object with a write method, like a file opened in binary
+        mode) as they arrive so memory use stays constant however big the file.
+        Over a WebREPL connection the file is read with a WebREPL get file
+        request, which sends it in binary without going through the REPL.
+        """
+        out = sink
+        if sink is None:
+            out = io.BytesIO()
+        webrepl = self._webrepl()
+        if webrepl is not None:
+            if not webrepl.get_file(filename, out):
+                raise RuntimeError("No such file: {0}".format(filename))
+            if sink is None:
+                return out.getvalue()
+            return
+        with self.session():
+            base64 = self._has_base64()
+            decoder = _StreamDecoder(out, base64)
+            self._retrying(lambda resume: self._get(filename, decoder, base64))
+        decoder.close()
+        if sink is None:
+            return out.getvalue()
+
+    def _get(self, filename, decoder, base64):
+        # Have the board read the file a block at a time and print out the
+        # encoded bytes.  Base64 is used when the board supports it since it
+        # is denser than hex, and each block is written on its own line so the
+        # host can decode it as soon as the line is complete.  Hex is sent a
+        # few bytes at a time to not overload the UART buffer.  The board
+        # starts at the bytes the decoder hasn't received yet, to resume.
+        call = "_ampy.send('{0}', {1}, {2:d}, {3})".format(
+            filename, self._block_size if base64 else BUFFER_SIZE, base64, decoder.size
+        )
+        decoder.restart()
         try:
-            out = self._pyboard.exec_(textwrap.dedent(command))
+            self._exec(call, ["send"], data_consumer=decoder.write)
         except PyboardError as ex:
             # Check if this is an OSError #2, i.e. file doesn't exist and
             # rethrow it as something more descriptive.
+            if _os_error(ex, 2):
+                raise RuntimeError("No such file: {0}".format(filename))
+            raise ex
+
+    def get_tree(self, directory, local_directory):
+        """Download the specified directory and everything in it to a local
+        directory (created if needed) with a single exec, writing each file as
+        it arrives.  Returns the number of files downloaded.
+        """
+        with self.session():
+            base64 = self._has_base64()
+            call = "_ampy.send_tree('{0}', {1}, {2:d})".format(
+                directory, self._block_size if base64 else BUFFER_SIZE, base64
+            )
+            decoder = _TreeDecoder(directory, local_directory, base64)
             try:
-                message = ex.args[2].decode("utf-8")
-                if message.find("OSError") != -1 and message.find("2") != -1:
-                    raise RuntimeError("No such file: {0}".format(filename))
-                else:
-                    raise ex
-            except UnicodeDecodeError:
+                self._exec(call, ["send_tree"], data_consumer=decoder.write)
+            except PyboardError as ex:
+                # Check if this is an OSError #2, i.e. directory doesn't exist and
+                # rethrow it as something more descriptive.
+                if _os_error(ex, 2):
+                    raise RuntimeError("No such directory: {0}".format(directory))
                 raise ex
-        self._pyboard.exit_raw_repl()
-        return binascii.unhexlify(out)
+            finally:
+                decoder._close_file()
+        decoder.close()
+        return decoder.count
 
-    def ls(self, directory="/", long_format=True, recursive=False):
-        """List the contents of the specified directory (or root if none is
-        specified).  Returns a list of strings with the names of files in the
-        specified directory.  If long_format is True then a list of 2-tuples
-        with the name and size (in bytes) of the item is returned.  Note that
-        it appears the size of directories is not supported by MicroPython and
-        will always return 0 (i.e. no recursive size computation).
+    def ilistdir(self, directory="/", recursive=False):
+        """Iterate over the contents of the specified directory (or root if
+        none is specified), and everything below it if recursive is True.
+        Yields a DirEntry for each file and directory, in no particular order,
+        as the board lists them, so even huge directories are never held in
+        memory on the board or the host.  The board is busy listing until the
+        iteration is over, so other methods of this object (like stat on an
+        entry) raise a RuntimeError until then; use ls to get the whole
+        listing first.
         """
-
-        # Disabling for now, see https://github.com/adafruit/ampy/issues/55.
-        # # Make sure directory ends in a slash.
-        # if not directory.endswith("/"):
-        #     directory += "/"
-
         # Make sure directory starts with slash, for consistency.
         if not directory.startswith("/"):
             directory = "/" + directory
+        call = "_ampy.ls('{0}', {1:d})".format(directory, recursive)
+        pending = b""
+        with self.session():
+            output = self._exec_iter(call, ["ls"])
+            self._listing = True
+            try:
+                with contextlib.closing(output):
+                    for data in output:
+                        lines = (pending + data).split(b"\n")
+                        pending = lines.pop()
+                        for line in lines:
+                            line = line.rstrip(b"\r").decode("utf-8")
+                            kind, size, path = line.split(" ", 2)
+                            yield DirEntry(path, kind == "d", int(size))
+            except PyboardError as ex:
+                # Check if this is an OSError #2, i.e. directory doesn't exist and
+                # rethrow it as something more descriptive.
+                if _os_error(ex, 2):
+                    raise RuntimeError("No such directory: {0}".format(directory))
+                else:
+                    raise ex
+            finally:
+                self._listing = False
+        if pending.strip():
+            raise RuntimeError("truncated data received from the board")
 
-        command = """\
-                try:        
-                    import os
-                except ImportError:
-                    import uos as os\n"""
-
-        if recursive:
-            command += """\
-                def listdir(directory):
-                    result = set()
+    def ls(self, directory="/", long_format=True, recursive=False):
+        """List the contents of the specified directory (or root if none is
+        specified).  Returns a sorted list of strings with the paths of the
+        items in the specified directory, or of every file and empty directory
+        below it if recursive is True.  If long_format is True then each string
+        also has the size (in bytes) of the item.  Note that it appears the
+        size of directories is not supported by MicroPython and will always
+        return 0 (i.e. no recursive size computation).  See ilistdir to go
+        through big directories without building a list.
+        """
+        return listing(self.ilistdir(directory, recursive), long_format, recursive)
 
-                    def _listdir(dir_or_file):
-                        try:
-                            # if its a directory, then it should provide some children.
-                            children = os.listdir(dir_or_file)
-                        except OSError:                        
-                            # probably a file. run stat() to confirm.
-                            os.stat(dir_or_file)
-                            result.add(dir_or_file) 
-                        else:
-                            # probably a directory, add to result if empty.
-                            if children:
-                                # queue the children to be dealt with in next iteration.
-                                for child in children:
-                                    # create the full path.
-                                    if dir_or_file == '/':
-                                        next = dir_or_file + child
-                                    else:
-                                        next = dir_or_file + '/' + child
-                                    
-                                    _listdir(next)
-                            else:
-                                result.add(dir_or_file)                     
-
-                    _listdir(directory)
-                    return sorted(result)\n"""
-        else:
-            command += """\
-                def listdir(directory):
-                    if directory == '/':                
-                        return sorted([directory + f for f in os.listdir(directory)])
-                    else:
-                        return sorted([directory + '/' + f for f in os.listdir(directory)])\n"""
-
-        # Execute os.listdir() command on the board.
-        if long_format:
-            command += """
-                r = []
-                for f in listdir('{0}'):
-                    size = os.stat(f)[6]                    
-                    r.append('{{0}} - {{1}} bytes'.format(f, size))
-                print(r)
-            """.format(
-                directory
-            )
-        else:
-            command += """
-                print(listdir('{0}'))
-            """.format(
-                directory
-            )
-        self._pyboard.enter_raw_repl()
-        try:
-            out = self._pyboard.exec_(textwrap.dedent(command))
-        except PyboardError as ex:
-            # Check if this is an OSError #2, i.e. directory doesn't exist and
-            # rethrow it as something more descriptive.
-            message = ex.args[2].decode("utf-8")
-            if message.find("OSError") != -1 and message.find("2") != 1:
-                raise RuntimeError("No such directory: {0}".format(directory))
-            else:
+    def stat(self, path):
+        """Return the stat tuple of the specified file or directory, as the
+        board's os.stat returns it (the mode is the first item and the size
+        the seventh).
+        """
+        with self.session():
+            try:
+                out = self._exec("_ampy.stat('{0}')".format(path), ["stat"])
+            except PyboardError as ex:
+                # Check if this is an OSError #2, i.e. the path doesn't exist and
+                # rethrow it as something more descriptive.
+                if _os_error(ex, 2):
+                    raise RuntimeError("No such file/directory: {0}".format(path))
                 raise ex
-        self._pyboard.exit_raw_repl()
-        # Parse the result list and return it.
-        return ast.literal_eval(out.decode("utf-8"))
+        return ast.literal_eval(out.decode("utf-8").strip())
 
-    def mkdir(self, directory, exists_okay=False):
-        """Create the specified directory.  Note this cannot create a recursive
-        hierarchy of directories, instead each one should be created separately.
+    def mkdir(self, directory, exists_okay=False, parents=False):
+        """Create the specified directory.  Directory can also be a list of
+        directories, which are all created in order with a single exec.  If
+        parents is True any missing parent directories are created too and
+        directories which already exist are fine, like mkdir -p.
         """
-        # Execute os.mkdir command on the board.
-        command = """
-            try:
-                import os
-            except ImportError:
-                import uos as os
-            os.mkdir('{0}')
-        """.format(
-            directory
+        directories = [directory] if isinstance(directory, str) else list(directory)
+        if not directories:
+            return
+        call = "_ampy.mkdir({0}, {1:d}, {2:d})".format(
+            _list_literal(directories), parents, exists_okay
         )
-        self._pyboard.enter_raw_repl()
-        try:
-            out = self._pyboard.exec_(textwrap.dedent(command))
-        except PyboardError as ex:
-            # Check if this is an OSError #17, i.e. directory already exists.
-            message = ex.args[2].decode("utf-8")
-            if message.find("OSError") != -1 and message.find("17") != -1:
-                if not exists_okay:
+        with self.session():
+            try:
+                self._exec(call, ["mkdir"])
+            except PyboardError as ex:
+                # Check if this is an OSError #17, i.e. directory already exists.
+                # The board prints the path it failed on first.
+                if _os_error(ex, 17):
+                    failed = ex.args[1].decode("utf-8").strip().splitlines()
                     raise DirectoryExistsError(
-                        "Directory already exists: {0}".format(directory)
+                        "Directory already exists: {0}".format(
+                            failed[-1] if failed else directories[-1]
+                        )
                     )
-            else:
-                raise ex
-        self._pyboard.exit_raw_repl()
+                else:
+                    raise ex
 
-    def put(self, filename, data, progress_cb=None):
-        """Create or update the specified file with the provided data.
+    def put(self, filename, data, progress_cb=None, verify=False):
+        """Create or update the specified file with the provided data.  When
+        the board can decompress zlib streams and compression makes the data
+        noticeably smaller it is sent compressed and inflated on the board.
+        The data is written to filename.part on the board, which replaces the
+        file once complete, and if the connection fails the upload resumes
+        from the bytes in there (see the retries of Files).  If verify is True
+        the board then hashes the file to check it (see verify).  Over a
+        WebREPL connection the data is sent with a WebREPL put file request
+        instead, in binary and uncompressed.
         """
-        # Open the file for writing on the board and write chunks of data.
-        self._pyboard.enter_raw_repl()
-        self._pyboard.exec_("f = open('{0}', 'wb')".format(filename))
+        progress = _Progress(progress_cb)
+        with self.session():
+            if self._webrepl() is not None:
+                send = self._send_webrepl
+            elif self._has_base64():
+                send = self._send_file
+            else:
+                send = self._write_file
+            self._retrying(
+                lambda resume: send(filename, data, progress, self._offset(filename, progress))
+            )
+            if verify:
+                self.verify({filename: file_digest(data, self.hash_algorithm())})
+
+    def _offset(self, filename, progress):
+        # Where to (re)start the upload of a file, the bytes the board has of
+        # it if it began writing them in this upload.
+        if not progress.started:
+            return 0
+        return self._part_size(filename)
+
+    def _write_file(self, filename, data, progress, offset):
+        # Fall back to writing small chunks of data with one exec each for
+        # boards that can't decode base64.  The execs are pipelined (see
+        # Pyboard.exec_pipelined) so the link doesn't sit idle between them.
         size = len(data)
-        # Loop through and write a buffer size chunk of data at a time.
-        for i in range(0, size, BUFFER_SIZE):
-            chunk_size = min(BUFFER_SIZE, size - i)
-            chunk = repr(data[i : i + chunk_size])
-            # Make sure to send explicit byte strings (handles python 2 compatibility).
-            if not chunk.startswith("b"):
-                chunk = "b" + chunk
-            self._pyboard.exec_("f.write({0})".format(chunk))
-            # notify caller how much has already been written
-            if hasattr(progress_cb, '__call__'):
-                progress_cb(chunk_size)
-
-        self._pyboard.exec_("f.close()")
-        self._pyboard.exit_raw_repl()
+        # Bytes of data written by each command sent, in order.
+        sizes = collections.deque()
+
+        def commands():
+            # Open the file for writing on the board and write chunks of data.
+            sizes.append(0)
+            yield "_ampy_f = open('{0}.part', '{1}')".format(filename, "ab" if offset else "wb")
+            # Loop through and write a buffer size chunk of data at a time.
+            for i in range(offset, size, BUFFER_SIZE):
+                chunk_size = min(BUFFER_SIZE, size - i)
+                chunk = repr(data[i : i + chunk_size])
+                # Make sure to send explicit byte strings (handles python 2 compatibility).
+                if not chunk.startswith("b"):
+                    chunk = "b" + chunk
+                sizes.append(chunk_size)
+                yield "_ampy_f.write({0})".format(chunk)
+            sizes.append(0)
+            yield "_ampy_f.close()\ndel _ampy_f"
+
+        progress.restart(offset)
+        with contextlib.closing(self._pyboard.exec_pipelined(commands())) as outputs:
+            for out in outputs:
+                # The file is open once the first command went through.
+                progress.started = True
+                # notify caller how much has already been written
+                progress(sizes.popleft())
+        self._exec("_ampy.replace('{0}.part', '{0}')".format(filename), ["replace"])
+        self._count_sent(size - offset, size - offset)
+
+    def _send_webrepl(self, filename, data, progress, offset):
+        # Send the file in binary with a WebREPL put file request.  Those
+        # can't append to a file, so a resumed upload starts over.
+        progress.restart(0)
+        if not self._webrepl().put_file(filename + ".part", data, progress):
+            raise RuntimeError("Could not write file: {0}".format(filename))
+        self._exec("_ampy.replace('{0}.part', '{0}')".format(filename), ["replace"])
+        self._count_sent(len(data), len(data))
+
+    def _count_sent(self, data_bytes, sent_bytes):
+        self.data_bytes += data_bytes
+        self.sent_bytes += sent_bytes
+
+    def _encode(self, data):
+        # Pick how to send a file's data: returns 'z' and the compressed data
+        # if the board can inflate it and that is worth it, else 'f' and the
+        # data itself.
+        if self._compress and self._has_decompressor():
+            if self._compress_cache is None:
+                payload = compress(data)
+            else:
+                # Keyed by the data itself, Python caches the hash of bytes.
+                payload = self._compress_cache.get(data)
+                if payload is None:
+                    payload = self._compress_cache[data] = compress(data)
+            if len(payload) <= len(data) * COMPRESSION_THRESHOLD:
+                return "z", payload
+        return "f", data
+
+    def _receivers(self):
+        # The receiver helpers this board can run.
+        if self._compress and self._has_decompressor():
+            return ["recv", "recv_compressed"]
+        return ["recv"]
+
+    def _blocks(self, data, payload, progress):
+        # Yield payload as base64 blocks for the receivers, reporting progress
+        # in bytes of the original data.
+        reported = 0
+        for i in range(0, len(payload), self._block_size):
+            block = payload[i : i + self._block_size]
+            yield binascii.b2a_base64(block).rstrip(b"\n")
+            # The board asked for this block, so it opened the file.
+            progress.started = True
+            # notify caller how much of the original data has already been
+            # written
+            done = len(data) * (i + len(block)) // len(payload)
+            progress(done - reported)
+            reported = done
+        self._count_sent(len(data), len(payload))
+
+    def _send_file(self, filename, data, progress, offset):
+        # Run a small receiver loop on the board which asks for one base64
+        # encoded block of data at a time and writes it out, so each block
+        # costs a single round trip instead of one exec per 32 bytes.  If
+        # compression pays off the receiver inflates the data while writing.
+        # Sends the data from offset on, appending it to the board's .part
+        # file when resuming.
+        progress.restart(offset)
+        data = data[offset:]
+        kind, payload = self._encode(data)
+        receiver = "recv_compressed" if kind == "z" else "recv"
+        call = "_ampy.{0}('{1}', {2}, {3}, {4})".format(
+            receiver, filename, len(payload), self._block_size, offset
+        )
+        self._exec(call, [receiver], chunks=self._blocks(data, payload, progress))
+
+    def put_files(self, entries):
+        """Upload many files and directories with a single exec.  Entries is
+        an iterable of (remote path, data, progress callback) tuples, data
+        being None for a directory to create (it's fine if it exists).  Put
+        directories before their contents.  Entries are consumed lazily, so
+        the data can be read as the upload goes, and the next few files are
+        compressed and framed in other threads while one is being sent.
+
+        A receiver running on the board reads a stream of framed records, each
+        a header with the kind, size and path followed by the data blocks, and
+        only asks for the next record once the previous one is written.  If
+        the connection fails, the files the board hadn't finished are resumed
+        like put does and the receiver started again for the remaining
+        entries.
+        """
+        with self.session():
+            if self._webrepl() is not None or not self._has_base64():
+                # Fall back to one exec per file and directory, or WebREPL
+                # put file requests.
+                for path, data, progress_cb in entries:
+                    if data is None:
+                        self.mkdir(path, exists_okay=True)
+                    else:
+                        self.put(path, data, progress_cb)
+                return
+            receivers = self._receivers()
+            call = "_ampy.recv_files({0})".format(self._block_size)
+
+            def prepare(entry):
+                # Runs in the prefetch threads, which is fine since the probe
+                # _encode needs was already made by _receivers above.
+                path, data, progress_cb = entry
+                if data is None:
+                    kind, payload = "d", b""
+                else:
+                    kind, payload = self._encode(data)
+                header = "{0}:{1}:{2}".format(kind, len(payload), path)
+                header = binascii.b2a_base64(header.encode("utf-8")).rstrip(b"\n")
+                header = "{0:08x}".format(len(header)).encode("ascii") + header
+                return entry, payload, header, _Progress(progress_cb)
+
+            # The entries sent which the board may not have finished, and
+            # their progress.  An entry is only done once the board asks for
+            # the next record (it writes the file and renames its .part file
+            # first), which the host knows when it's asked for the chunk
+            # after that record's header.
+            current = []
+
+            def records(prepared):
+                for entry, payload, header, progress in prepared:
+                    current.append((entry, progress))
+                    path, data, progress_cb = entry
+                    yield header
+                    del current[:-1]
+                    if data is not None:
+                        for block in self._blocks(data, payload, progress):
+                            yield block
+                yield b"00000000"
+
+            def transfer(prepared, resume):
+                if resume:
+                    # Finish the entries the connection failed on first.
+                    while current:
+                        (path, data, progress_cb), progress = current[0]
+                        if data is None:
+                            self.mkdir(path, exists_okay=True)
+                        else:
+                            offset = self._offset(path, progress)
+                            self._send_file(path, data, progress, offset)
+                        del current[0]
+                self._exec(call, ["recv_files"] + receivers, chunks=records(prepared))
+
+            with contextlib.closing(prefetch(prepare, entries)) as prepared:
+                self._retrying(lambda resume: transfer(prepared, resume))
+
+    def put_delta(self, filename, data, progress_cb=None):
+        """Update the specified file with the provided data, only sending the
+        blocks which differ from the file already on the board.  The board
+        hashes each block of the existing file, the host compares them to the
+        same blocks of data, and the new file is then assembled from the old
+        file's unchanged blocks and the sent ones in a temporary file which
+        replaces the old one.  Returns the number of bytes sent, which is
+        len(data) when the file didn't exist or the board can't hash blocks.
+        """
+        block_size = self._block_size
+        call = "_ampy.block_hashes('{0}', {1})".format(filename, block_size)
+        with self.session():
+            if not self._has_base64():
+                self.put(filename, data, progress_cb)
+                return len(data)
+            try:
+                out = self._exec(call, ["block_hashes"])
+            except PyboardError as ex:
+                # Check if this is an OSError #2, i.e. there is no file to
+                # patch, and send everything.
+                if not _os_error(ex, 2):
+                    raise ex
+                self.put(filename, data, progress_cb)
+                return len(data)
+            lines = out.decode("utf-8").split()
+            algorithm, remote = lines[0], lines[1:]
+            if algorithm == "size":
+                # Sizes alone can't tell which blocks changed.
+                self.put(filename, data, progress_cb)
+                return len(data)
+            need = []
+            for i in range(0, len(data), block_size):
+                block = data[i : i + block_size]
+                index = i // block_size
+                same = index < len(remote) and remote[index] == file_digest(
+                    block, algorithm
+                )
+                need.append(not same)
+                if same and hasattr(progress_cb, '__call__'):
+                    progress_cb(len(block))
+            if not any(need) and len(remote) == len(need):
+                self._count_sent(len(data), 0)
+                return 0
+            call = "_ampy.patch('{0}', {1}, {2}, '{3}')".format(
+                filename,
+                len(data),
+                block_size,
+                "".join("1" if n else "0" for n in need),
+            )
+            sent = [0]
+
+            def blocks():
+                for index, needed in enumerate(need):
+                    if not needed:
+                        continue
+                    block = data[index * block_size : (index + 1) * block_size]
+                    yield binascii.b2a_base64(block).rstrip(b"\n")
+                    sent[0] += len(block)
+                    if hasattr(progress_cb, '__call__'):
+                        progress_cb(len(block))
+
+            self._exec(call, ["patch"], chunks=blocks())
+        self._count_sent(len(data), sent[0])
+        return sent[0]
 
     def rm(self, filename):
         """Remove the specified file or directory."""
-        command = """
+        with self.session():
             try:
-                import os
-            except ImportError:
-                import uos as os
-            os.remove('{0}')
-        """.format(
-            filename
-        )
-        self._pyboard.enter_raw_repl()
-        try:
-            out = self._pyboard.exec_(textwrap.dedent(command))
-        except PyboardError as ex:
-            message = ex.args[2].decode("utf-8")
-            # Check if this is an OSError #2, i.e. file/directory doesn't exist
-            # and rethrow it as something more descriptive.
-            if message.find("OSError") != -1 and message.find("2") != 1:
-                raise RuntimeError("No such file/directory: {0}".format(filename))
-            # Check for OSError #13, the directory isn't empty.
-            if message.find("OSError") != -1 and message.find("13") != 1:
-                raise RuntimeError("Directory is not empty: {0}".format(filename))
-            else:
-                raise ex
-        self._pyboard.exit_raw_repl()
+                self._exec("_ampy.os.remove('{0}')".format(filename), ["base"])
+            except PyboardError as ex:
+                # Check if this is an OSError #2, i.e. file/directory doesn't exist
+                # and rethrow it as something more descriptive.
+                if _os_error(ex, 2):
+                    raise RuntimeError("No such file/directory: {0}".format(filename))
+                # Check for OSError #13, the directory isn't empty.
+                if _os_error(ex, 13):
+                    raise RuntimeError("Directory is not empty: {0}".format(filename))
+                else:
+                    raise ex
 
     def rmdir(self, directory, missing_okay=False):
-        """Forcefully remove the specified directory and all its children."""
-        # Build a script to walk an entire directory structure and delete every
-        # file and subfolder.  This is tricky because MicroPython has no os.walk
-        # or similar function to walk folders, so this code does it manually
-        # with recursion and changing directories.  For each directory it lists
-        # the files and deletes everything it can, i.e. all the files.  Then
-        # it lists the files again and assumes they are directories (since they
-        # couldn't be deleted in the first pass) and recursively clears those
-        # subdirectories.  Finally when finished clearing all the children the
-        # parent directory is deleted.
-        command = """
+        """Forcefully remove the specified directory and all its children.
+        Directory can also be a list of directories to remove with a single
+        exec.  If any of them doesn't exist nothing is removed, unless
+        missing_okay is True in which case the missing ones are skipped.
+        Returns the number of files deleted.
+        """
+        if isinstance(directory, str):
+            directory = [directory]
+        call = "_ampy.rmtree({0}, {1:d})".format(_list_literal(directory), missing_okay)
+        with self.session():
+            out = self._exec(call, ["rmtree"]).decode("utf-8").strip()
+        if out.startswith("!"):
+            raise RuntimeError("No such directory: {0}".format(out[1:]))
+        return int(out)
+
+    def hashes(self, directory, missing_okay=False):
+        """Hash every file under the specified directory (recursively) on the
+        board.  Returns a 2-tuple of the algorithm used (see file_digest) and a
+        dict mapping each file's full path to its digest, all from a single
+        exec.  If missing_okay is True a directory that doesn't exist gives an
+        empty dict instead of an error.
+        """
+        call = "_ampy.hashes('{0}', {1})".format(directory, self._block_size)
+        with self.session():
             try:
-                import os
-            except ImportError:
-                import uos as os
-            def rmdir(directory):
-                os.chdir(directory)
-                for f in os.listdir():
-                    try:
-                        os.remove(f)
-                    except OSError:
-                        pass
-                for f in os.listdir():
-                    rmdir(f)
-                os.chdir('..')
-                os.rmdir(directory)
-            rmdir('{0}')
-        """.format(
-            directory
-        )
-        self._pyboard.enter_raw_repl()
-        try:
-            out = self._pyboard.exec_(textwrap.dedent(command))
-        except PyboardError as ex:
-            message = ex.args[2].decode("utf-8")
-            # Check if this is an OSError #2, i.e. directory doesn't exist
-            # and rethrow it as something more descriptive.
-            if message.find("OSError") != -1 and message.find("2") != 1:
-                if not missing_okay:
-                    raise RuntimeError("No such directory: {0}".format(directory))
-            else:
+                out = self._exec(call, ["hashes"])
+            except PyboardError as ex:
+                # Check if this is an OSError #2, i.e. directory doesn't exist.
+                if _os_error(ex, 2):
+                    if not missing_okay:
+                        raise RuntimeError("No such directory: {0}".format(directory))
+                    return None, {}
                 raise ex
-        self._pyboard.exit_raw_repl()
+        lines = out.decode("utf-8").splitlines()
+        result = {}
+        for line in lines[1:]:
+            digest, path = line.split(" ", 1)
+            result[path] = digest
+        return lines[0].strip(), result
+
+    def file_hashes(self, paths):
+        """Hash the specified files on the board, reading each in blocks so
+        files of any size can be hashed.  Returns a 2-tuple of the algorithm
+        used (see file_digest) and a dict mapping each path to its digest, or
+        to None if the file doesn't exist, all from a single exec.
+        """
+        paths = list(paths)
+        call = "_ampy.file_hashes({0}, {1})".format(_list_literal(paths), self._block_size)
+        with self.session():
+            out = self._exec(call, ["file_hashes"])
+        lines = out.decode("utf-8").splitlines()
+        algorithm = lines[0].strip()
+        self._probes["algorithm"] = algorithm
+        result = {}
+        for line in lines[1:]:
+            digest, path = line.split(" ", 1)
+            result[path] = None if digest == "-" else digest
+        return algorithm, result
+
+    def hash_algorithm(self):
+        """Return the algorithm the board hashes files with: 'sha256' if it
+        has hashlib, else 'crc32' if its binascii has crc32, else 'size' (the
+        digest is just the size).  Use file_digest to hash data the same way
+        on the host.
+        """
+        if "algorithm" not in self._probes:
+            with self.session():
+                out = self._exec("print(_ampy.ALGORITHM)", ["digest"])
+            self._probes["algorithm"] = out.decode("utf-8").strip()
+        return self._probes["algorithm"]
+
+    def verify(self, digests):
+        """Check files written to the board against what was sent, without
+        reading them back.  Digests maps each file's path to the digest of the
+        data it should hold, computed by file_digest with hash_algorithm().
+        The board hashes the files and sends back just the digests.  Raises
+        RuntimeError naming the files which don't match.
+        """
+        if not digests:
+            return
+        algorithm, remote = self.file_hashes(sorted(digests))
+        failed = [path for path in sorted(digests) if remote.get(path) != digests[path]]
+        if failed:
+            raise RuntimeError("Verification failed: {0}".format(", ".join(failed)))
 
     def run(self, filename, wait_output=True, stream_output=True):
         """Run the provided script and return its output.  If wait_output is True
@@ -310,17 +1495,16 @@ class Files(object):
         If stream_output is True(default) then return None and print outputs to
         stdout without buffering.
         """
-        self._pyboard.enter_raw_repl()
-        out = None
-        if stream_output:
-            self._pyboard.execfile(filename, stream_output=True)
-        elif wait_output:
-            # Run the file and wait for output to return.
-            out = self._pyboard.execfile(filename)
-        else:
-            # Read the file and run it using lower level pyboard functions that
-            # won't wait for it to finish or return output.
-            with open(filename, "rb") as infile:
-                self._pyboard.exec_raw_no_follow(infile.read())
-        self._pyboard.exit_raw_repl()
+        with self.session():
+            out = None
+            if stream_output:
+                self._pyboard.execfile(filename, stream_output=True)
+            elif wait_output:
+                # Run the file and wait for output to return.
+                out = self._pyboard.execfile(filename)
+            else:
+                # Read the file and run it using lower level pyboard functions that
+                # won't wait for it to finish or return output.
+                with open(filename, "rb") as infile:
+                    self._pyboard.exec_raw_no_follow(infile.read())
         return out
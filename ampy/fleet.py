@@ -0,0 +1,135 @@
+# Adafruit MicroPython Tool - Running Commands on Many Boards
+# Copyright (c) 2016 Adafruit Industries
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+import collections
+import glob
+import time
+
+from ampy.files import file_digest
+from ampy.pipeline import ThreadPoolExecutor
+from ampy.pyboard import PyboardError
+
+
+# What happened on one board: its port, the error message if it failed (None
+# if it didn't), the seconds it took and the lines it printed.
+Result = collections.namedtuple("Result", ["port", "error", "seconds", "output"])
+
+
+def expand_ports(patterns):
+    """Return the ports named by patterns, in order and without duplicates.
+    Patterns with wildcards (like /dev/ttyUSB*) are expanded to the matching
+    devices, sorted, and must match at least one.
+    """
+    ports = []
+    for pattern in patterns:
+        if any(c in pattern for c in "*?["):
+            matches = sorted(glob.glob(pattern))
+            if not matches:
+                raise RuntimeError("No port matches {0}".format(pattern))
+        else:
+            matches = [pattern]
+        for port in matches:
+            if port not in ports:
+                ports.append(port)
+    return ports
+
+
+def describe(ex):
+    # A one-line message for an error, the last line of the traceback for
+    # an exception raised on the board.
+    if isinstance(ex, PyboardError) and len(ex.args) == 3 and ex.args[0] == "exception":
+        lines = ex.args[2].decode("utf-8", "replace").strip().splitlines()
+        if lines:
+            return lines[-1]
+    return str(ex) or type(ex).__name__
+
+
+def run_all(ports, connect, operation):
+    """Run operation(board, echo) on every port at the same time, a thread
+    each, board being connect(port) and echo a function collecting the lines
+    the operation prints.  A board failing doesn't stop the others.  Returns
+    a Result for each port, in the same order.
+    """
+
+    def run_one(port):
+        output = []
+        start = time.time()
+        error = None
+        board = None
+        try:
+            board = connect(port)
+            operation(board, output.append)
+        except (Exception, PyboardError) as ex:
+            error = describe(ex)
+        finally:
+            if board is not None:
+                try:
+                    board.close()
+                except Exception:
+                    # Best effort, the board may be gone.
+                    pass
+        return Result(port, error, time.time() - start, output)
+
+    if ThreadPoolExecutor is None:
+        return [run_one(port) for port in ports]
+    executor = ThreadPoolExecutor(len(ports))
+    try:
+        return list(executor.map(run_one, ports))
+    finally:
+        executor.shutdown(wait=True)
+
+
+def summary(results):
+    """Return the lines of a table with the outcome of each board."""
+    rows = [("PORT", "STATUS", "TIME", "DETAIL")]
+    for result in results:
+        rows.append(
+            (
+                result.port,
+                "FAILED" if result.error else "ok",
+                "{0:.1f}s".format(result.seconds),
+                result.error or (result.output[-1] if result.output else ""),
+            )
+        )
+    widths = [max(len(row[i]) for row in rows) for i in range(3)]
+    return [
+        ("  ".join(row[i].ljust(widths[i]) for i in range(3)) + "  " + row[3]).rstrip()
+        for row in rows
+    ]
+
+
+class SharedWork(object):
+    """Host-side results shared by the boards of a fleet, so each file is
+    compressed (see the compress_cache of Files) and hashed only once
+    however many boards it goes to.  Safe to use from several threads, at
+    worst two of them compute the same result.
+    """
+
+    def __init__(self):
+        self.compressed = {}
+        self._digests = {}
+
+    def digest(self, data, algorithm):
+        """Return file_digest(data, algorithm)."""
+        key = (algorithm, data)
+        result = self._digests.get(key)
+        if result is None:
+            result = self._digests[key] = file_digest(data, algorithm)
+        return result
@@ -0,0 +1,64 @@
+# Adafruit MicroPython Tool - Host-side Work Pipeline
+# Copyright (c) 2016 Adafruit Industries
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+import collections
+
+try:
+    from concurrent.futures import ThreadPoolExecutor
+except ImportError:
+    # Python 2 without the futures backport, work sequentially.
+    ThreadPoolExecutor = None
+
+
+WORKERS = 4  # Number of threads preparing items.
+
+DEPTH = 4  # Number of prepared items kept ready ahead of the one being used.
+# Each can hold a whole file in memory, so keep this small.
+
+
+def prefetch(function, items, workers=WORKERS, depth=DEPTH):
+    """Yield function(item) for each item, in order, while a thread pool
+    already computes the results for the next few items.  Used to read,
+    compile, hash and compress upcoming files while the current one is sent
+    to the board, so the serial link never waits on the host.  Items are
+    taken from the iterable by the calling thread only, and at most depth
+    results are computed ahead.  An exception raised by function is raised
+    when its result is reached.
+
+    Function runs in other threads, so it must not talk to the board.
+    """
+    if ThreadPoolExecutor is None or workers < 1:
+        for item in items:
+            yield function(item)
+        return
+    pending = collections.deque()
+    executor = ThreadPoolExecutor(workers)
+    try:
+        for item in items:
+            pending.append(executor.submit(function, item))
+            if len(pending) > depth:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+    finally:
+        # Don't compute results nobody will use if the caller stopped early.
+        for future in pending:
+            future.cancel()
+        executor.shutdown(wait=True)
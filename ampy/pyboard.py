@@ -37,11 +37,50 @@ Or:
 
 """
 
+import base64
+import os
+import select
+import socket
+import struct
 import sys
 import time
 
+try:
+    from termios import error as TermiosError
+except ImportError:
+    # Not a POSIX system, pyserial doesn't use termios there.
+    TermiosError = OSError
+
 _rawdelay = None
 
+RAW_REPL_BANNER = b'raw REPL; CTRL-B to exit\r\n'
+
+MAIN_WAIT = 0.5  # Seconds to wait for the raw REPL after a soft reboot before
+# interrupting main.py, which some boards (like CircuitPython ones) run.
+
+EXEC_WINDOW = 4  # Number of commands exec_pipelined sends ahead.
+# They wait in the board's input buffer, which is only a few hundred bytes on
+# some boards behind a plain UART.
+
+EXEC_WINDOW_BYTES = 256  # Bytes of commands exec_pipelined sends ahead, for
+# the same reason.  A single command bigger than this is still sent.
+
+WEBREPL_PORT = 8266  # Port of ws:// devices without one.
+
+WEBREPL_TIMEOUT = 10  # Seconds to wait for a websocket frame to arrive in
+# full, or for the answer to a WebREPL file transfer request.
+
+WEBREPL_BLOCK_SIZE = 1024  # Bytes of file data sent per websocket frame.
+
+# WebREPL binary request: signature, request type, flags, reserved, file
+# size, file name length and file name.
+WEBREPL_REQUEST = '<2sBBQLH64s'
+WEBREPL_PUT_FILE = 1
+WEBREPL_GET_FILE = 2
+
+RECONNECT_WAIT = 5  # Seconds to wait for the device to come back when
+# reconnecting, a USB serial bridge which reset takes a moment to show up again.
+
 try:
     stdout = sys.stdout.buffer
 except AttributeError:
@@ -56,11 +95,108 @@ def stdout_write_bytes(b):
 class PyboardError(BaseException):
     pass
 
+# The parsing of the raw REPL protocol, without any I/O, shared by Pyboard
+# and the asyncio AsyncPyboard (see ampy.aio) which only differ in how they
+# read and write.
+
+class ReadUntil(object):
+    """The state of a read_until: fed the data as it is read, it collects
+    it up to and including the ending, or hands it to data_consumer as it
+    arrives if given (keeping just enough to spot the ending).  Max_time
+    limits the whole read, see expired.
+    """
+
+    def __init__(self, ending, data=b'', data_consumer=None, max_time=None):
+        self.ending = ending
+        self.data = bytearray(data)
+        self.data_consumer = data_consumer
+        self.deadline = None if max_time is None else time.time() + max_time
+        if data_consumer:
+            data_consumer(bytes(data))
+
+    def done(self):
+        return self.data.endswith(self.ending)
+
+    def expired(self):
+        return self.deadline is not None and time.time() >= self.deadline
+
+    def wait(self, timeout):
+        """Return how long to wait for more data, at most timeout seconds
+        (forever if None) and no later than max_time.
+        """
+        if self.deadline is None:
+            return timeout
+        left = max(0, self.deadline - time.time())
+        return left if timeout is None else min(timeout, left)
+
+    def feed(self, new_data):
+        """Add data read and return whatever came after the ending, which
+        belongs to the next read.
+        """
+        data = self.data
+        ending = self.ending
+        # Only search the new tail (plus enough of the old data to catch
+        # an ending split across reads) for the ending.
+        start = max(0, len(data) - len(ending) + 1)
+        consumed = len(data)
+        data.extend(new_data)
+        rest = b''
+        end = data.find(ending, start)
+        if end != -1:
+            end += len(ending)
+            rest = bytes(data[end:])
+            del data[end:]
+        if self.data_consumer:
+            self.data_consumer(bytes(data[consumed:]))
+            del data[:max(0, len(data) - len(ending))]
+        return rest
+
+def raw_paste_reply(data):
+    """Return whether the 2 bytes answering the request to enter raw-paste
+    mode say it is supported (True), not supported (False) or weren't
+    understood (None), the board then prints the raw REPL banner again.
+    """
+    if data == b'R\x01':
+        return True
+    if data == b'R\x00':
+        return False
+    return None
+
+def raw_paste_window(header):
+    """Return the window size from the 2 byte header of a raw paste."""
+    if len(header) != 2:
+        raise PyboardError('timeout waiting for the raw paste window size')
+    return struct.unpack('<H', header)[0]
+
+def raw_paste_flow(data, window_size):
+    """Return the number of bytes more the flow control byte read during a
+    raw paste lets the host send, None if the board ended the paste.
+    """
+    if data == b'\x01':
+        # Device indicated that a new window of data can be sent.
+        return window_size
+    if data == b'\x04':
+        # Device indicated abrupt end.
+        return None
+    if not data:
+        raise PyboardError('timeout during raw paste')
+    # Unexpected data from device.
+    raise PyboardError('unexpected read during raw paste: {}'.format(data))
+
+def check_exec_ok(data):
+    """Raise a PyboardError unless the board accepted a command, answering
+    with the 2 bytes OK.
+    """
+    if data != b'OK':
+        raise PyboardError('could not exec command')
+
 class TelnetToSerial:
     def __init__(self, ip, user, password, read_timeout=None):
         import telnetlib
         self.tn = telnetlib.Telnet(ip, timeout=15)
         self.read_timeout = read_timeout
+        # Same meaning as serial.Serial.timeout, used by read()
+        self.timeout = read_timeout
         if b'Login as:' in self.tn.read_until(b'Login as:', timeout=read_timeout):
             self.tn.write(bytes(user, 'ascii') + b"\r\n")
 
@@ -71,8 +207,10 @@ class TelnetToSerial:
 
                 if b'for more information.' in self.tn.read_until(b'Type "help()" for more information.', timeout=read_timeout):
                     # login succesful
-                    from collections import deque
-                    self.fifo = deque()
+                    # Received data lives in one contiguous buffer, fifo_start
+                    # is the offset of the first byte not handed out yet.
+                    self.fifo = bytearray()
+                    self.fifo_start = 0
                     return
 
         raise PyboardError('Failed to establish a telnet connection with the board')
@@ -87,22 +225,43 @@ class TelnetToSerial:
             # the telnet object might not exist yet, so ignore this one
             pass
 
+    def _fill(self, timeout=0):
+        # Append everything telnetlib can give us without blocking.  If there
+        # is nothing, wait up to timeout seconds (forever if None) for the
+        # socket to become readable and try again.
+        data = self.tn.read_very_eager()
+        if not data and timeout != 0:
+            if select.select([self.tn], [], [], timeout)[0]:
+                data = self.tn.read_very_eager()
+        if data:
+            self.fifo.extend(data)
+        return len(data)
+
+    def _available(self):
+        return len(self.fifo) - self.fifo_start
+
     def read(self, size=1):
-        while len(self.fifo) < size:
-            timeout_count = 0
-            data = self.tn.read_eager()
-            if len(data):
-                self.fifo.extend(data)
-                timeout_count = 0
+        if self.timeout is not None:
+            deadline = time.time() + self.timeout
+        while self._available() < size:
+            if self.timeout is None:
+                self._fill(None)
             else:
-                time.sleep(0.25)
-                if self.read_timeout is not None and timeout_count > 4 * self.read_timeout:
+                remaining = deadline - time.time()
+                if remaining <= 0:
                     break
-                timeout_count += 1
-
-        data = b''
-        while len(data) < size and len(self.fifo) > 0:
-            data += bytes([self.fifo.popleft()])
+                self._fill(remaining)
+
+        start = self.fifo_start
+        end = min(start + size, len(self.fifo))
+        with memoryview(self.fifo) as view:
+            data = bytes(view[start:end])
+        self.fifo_start = end
+        # Drop consumed bytes once they make up most of the buffer, so the
+        # buffer doesn't grow forever but we don't shift it on every read.
+        if self.fifo_start * 2 >= len(self.fifo):
+            del self.fifo[:self.fifo_start]
+            self.fifo_start = 0
         return data
 
     def write(self, data):
@@ -110,27 +269,273 @@ class TelnetToSerial:
         return len(data)
 
     def inWaiting(self):
-        n_waiting = len(self.fifo)
-        if not n_waiting:
-            data = self.tn.read_eager()
-            self.fifo.extend(data)
-            return len(data)
+        if not self._available():
+            self._fill()
+        return self._available()
+
+def _websocket_mask(data, key):
+    # XOR data with the 4 byte key repeated, as clients mask what they send.
+    if not data:
+        return b''
+    key = (key * (len(data) // 4 + 1))[:len(data)]
+    masked = int.from_bytes(data, 'big') ^ int.from_bytes(key, 'big')
+    return masked.to_bytes(len(data), 'big')
+
+class WebreplToSerial:
+    """Connection to a board's WebREPL (the REPL over a websocket) which
+    reads and writes like a serial port.  The REPL's text goes in websocket
+    text frames, and get_file/put_file use WebREPL's binary file transfer
+    requests, which bypass the REPL.  The url is like ws://192.168.4.1:8266/,
+    a password in it (ws://:secret@192.168.4.1) is used instead of password.
+    """
+
+    def __init__(self, url, password, read_timeout=None):
+        try:
+            from urllib.parse import urlparse
+        except ImportError:
+            from urlparse import urlparse
+        parsed = urlparse(url)
+        if parsed.password:
+            password = parsed.password
+        # Same meaning as serial.Serial.timeout, used by read()
+        self.timeout = read_timeout
+        # REPL output, and file transfer data, received but not read yet.
+        self.text = bytearray()
+        self.binary = bytearray()
+        self._opcode = 1
+        host = parsed.hostname
+        port = parsed.port or WEBREPL_PORT
+        try:
+            self.sock = socket.create_connection((host, port), timeout=15)
+            self.sock.settimeout(WEBREPL_TIMEOUT)
+            key = base64.b64encode(os.urandom(16))
+            self.sock.sendall(
+                b'GET ' + (parsed.path or '/').encode('ascii') + b' HTTP/1.1\r\n'
+                b'Host: ' + '{0}:{1}'.format(host, port).encode('ascii') + b'\r\n'
+                b'Connection: Upgrade\r\nUpgrade: websocket\r\n'
+                b'Sec-WebSocket-Key: ' + key + b'\r\n'
+                b'Sec-WebSocket-Version: 13\r\n\r\n'
+            )
+            response = b''
+            while not response.endswith(b'\r\n\r\n'):
+                data = self.sock.recv(1)
+                if not data:
+                    break
+                response += data
+        except (socket.error, socket.timeout) as ex:
+            raise PyboardError('Failed to connect to the WebREPL at {0}: {1}'.format(url, ex))
+        if response.split(b' ')[1:2] == [b'101']:
+            if self._read_text_until(b'Password: '):
+                self.write(bytes(password, 'utf-8') + b'\r')
+                if self._read_text_until(b'WebREPL connected\r\n'):
+                    # login succesful
+                    return
+        self.close()
+        raise PyboardError('Failed to establish a WebREPL connection with the board')
+
+    def __del__(self):
+        self.close()
+
+    def close(self):
+        try:
+            self.sock.close()
+        except:
+            # the socket might not exist yet, so ignore this one
+            pass
+
+    def _read_text_until(self, ending):
+        # Read REPL text up to and including ending, returning False if it
+        # didn't arrive.
+        try:
+            while ending not in self.text:
+                if not self._fill(self.timeout):
+                    return False
+        except PyboardError:
+            return False
+        end = self.text.index(ending) + len(ending)
+        del self.text[:end]
+        return True
+
+    def _recv(self, size):
+        data = bytearray()
+        while len(data) < size:
+            try:
+                chunk = self.sock.recv(size - len(data))
+            except socket.timeout:
+                raise PyboardError('timeout waiting for the WebREPL')
+            if not chunk:
+                raise PyboardError('WebREPL connection closed')
+            data.extend(chunk)
+        return bytes(data)
+
+    def _recv_frame(self):
+        # Read a frame and add its payload to the text or binary data.
+        header = bytearray(self._recv(2))
+        opcode = header[0] & 0x0F
+        size = header[1] & 0x7F
+        if size == 126:
+            size = struct.unpack('>H', self._recv(2))[0]
+        elif size == 127:
+            size = struct.unpack('>Q', self._recv(8))[0]
+        key = self._recv(4) if header[1] & 0x80 else None
+        payload = self._recv(size)
+        if key:
+            payload = _websocket_mask(payload, key)
+        if opcode == 0x8:
+            raise PyboardError('WebREPL connection closed')
+        if opcode == 0x9:
+            # ping
+            self._send_frame(0xA, payload)
+            return
+        if opcode in (0x1, 0x2):
+            self._opcode = opcode
+        elif opcode != 0x0:
+            # pong or unknown, ignore it
+            return
+        # Continuation frames belong to the previous frame's message.
+        if self._opcode == 0x2:
+            self.binary.extend(payload)
+        else:
+            self.text.extend(payload)
+
+    def _send_frame(self, opcode, data):
+        header = bytearray([0x80 | opcode])
+        if len(data) < 126:
+            header.append(0x80 | len(data))
+        elif len(data) < 0x10000:
+            header.append(0x80 | 126)
+            header.extend(struct.pack('>H', len(data)))
         else:
-            return n_waiting
+            header.append(0x80 | 127)
+            header.extend(struct.pack('>Q', len(data)))
+        key = os.urandom(4)
+        try:
+            self.sock.sendall(bytes(header) + key + _websocket_mask(data, key))
+        except socket.error as ex:
+            raise PyboardError('WebREPL connection failed: {0}'.format(ex))
+
+    def _fill(self, timeout=0):
+        # Read every frame that arrived.  If there is none, wait up to
+        # timeout seconds (forever if None) for one.  Returns the number of
+        # bytes of text received.
+        before = len(self.text)
+        while select.select([self.sock], [], [], timeout)[0]:
+            self._recv_frame()
+            timeout = 0
+        return len(self.text) - before
+
+    def read(self, size=1):
+        if self.timeout is not None:
+            deadline = time.time() + self.timeout
+        while len(self.text) < size:
+            if self.timeout is None:
+                self._fill(None)
+            else:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                self._fill(remaining)
+        data = bytes(self.text[:size])
+        del self.text[:size]
+        return data
+
+    def write(self, data):
+        self._send_frame(0x1, data)
+        return len(data)
+
+    def inWaiting(self):
+        if not self.text:
+            self._fill()
+        return len(self.text)
+
+    def _read_binary(self, size):
+        while len(self.binary) < size:
+            if not select.select([self.sock], [], [], WEBREPL_TIMEOUT)[0]:
+                raise PyboardError('timeout waiting for the WebREPL')
+            self._recv_frame()
+        data = bytes(self.binary[:size])
+        del self.binary[:size]
+        return data
+
+    def _request(self, kind, filename, size):
+        # Send a file transfer request, returning True if the board accepted
+        # it.  The request is sent in two frames like webrepl_cli.py does.
+        name = filename.encode('utf-8')
+        if len(name) > 64:
+            raise PyboardError('file name too long for the WebREPL: ' + filename)
+        request = struct.pack(WEBREPL_REQUEST, b'WA', kind, 0, 0, size, len(name), name)
+        self._send_frame(0x2, request[:10])
+        self._send_frame(0x2, request[10:])
+        return self._status()
+
+    def _status(self):
+        signature, code = struct.unpack('<2sH', self._read_binary(4))
+        if signature != b'WB':
+            raise PyboardError('unexpected WebREPL response')
+        return code == 0
+
+    def put_file(self, filename, data, progress_cb=None):
+        """Write data to a file on the board with a WebREPL put file request.
+        Returns False if the board couldn't write the file.
+        """
+        if not self._request(WEBREPL_PUT_FILE, filename, len(data)):
+            return False
+        for i in range(0, len(data), WEBREPL_BLOCK_SIZE):
+            block = data[i:i + WEBREPL_BLOCK_SIZE]
+            self._send_frame(0x2, block)
+            if hasattr(progress_cb, '__call__'):
+                progress_cb(len(block))
+        return self._status()
+
+    def get_file(self, filename, sink):
+        """Write the contents of a file on the board to sink (any object with
+        a write method) with a WebREPL get file request, one block at a time
+        as the board sends them.  Returns False if the board couldn't read
+        the file.
+        """
+        if not self._request(WEBREPL_GET_FILE, filename, 0):
+            return False
+        while True:
+            # Ask for the next block, which comes with its size.
+            self._send_frame(0x2, b'\0')
+            size = struct.unpack('<H', self._read_binary(2))[0]
+            if size == 0:
+                break
+            sink.write(self._read_binary(size))
+        return self._status()
 
 class Pyboard:
-    def __init__(self, device, baudrate=115200, user='micro', password='python', wait=0, rawdelay=0):
+    def __init__(self, device, baudrate=115200, user='micro', password='python', wait=0, rawdelay=0, soft_reset=True):
         global _rawdelay
         _rawdelay = rawdelay
-        if device and device[0].isdigit() and device[-1].isdigit() and device.count('.') == 3:
+        # Whether enter_raw_repl soft reboots the board by default.  Without
+        # it the board's RAM (variables, imported modules) is left alone.
+        self.soft_reset = soft_reset
+        # Assume the board understands raw-paste mode until it tells us
+        # otherwise, see exec_raw_no_follow.
+        self.use_raw_paste = True
+        # Bytes read from the board in bulk but not consumed yet, because
+        # they came after the ending read_until was waiting for.
+        self._rx_buffer = bytearray()
+        self._device = device
+        self._baudrate = baudrate
+        self._user = user
+        self._password = password
+        self._open(wait)
+
+    def _open(self, wait):
+        device = self._device
+        if device and device.startswith('ws://'):
+            self.serial = WebreplToSerial(device, self._password, read_timeout=10)
+        elif device and device[0].isdigit() and device[-1].isdigit() and device.count('.') == 3:
             # device looks like an IP address
-            self.serial = TelnetToSerial(device, user, password, read_timeout=10)
+            self.serial = TelnetToSerial(device, self._user, self._password, read_timeout=10)
         else:
             import serial
             delayed = False
             for attempt in range(wait + 1):
                 try:
-                    self.serial = serial.Serial(device, baudrate=baudrate, interCharTimeout=1)
+                    self.serial = serial.Serial(device, baudrate=self._baudrate, interCharTimeout=1)
                     break
                 except (OSError, IOError): # Py2 and Py3 have different errors
                     if wait == 0:
@@ -151,54 +556,118 @@ class Pyboard:
     def close(self):
         self.serial.close()
 
-    def read_until(self, min_num_bytes, ending, timeout=10, data_consumer=None):
-        data = self.serial.read(min_num_bytes)
-        if data_consumer:
-            data_consumer(data)
-        timeout_count = 0
-        while True:
-            if data.endswith(ending):
-                break
-            elif self.serial.inWaiting() > 0:
-                new_data = self.serial.read(1)
-                data = data + new_data
-                if data_consumer:
-                    data_consumer(new_data)
-                timeout_count = 0
-            else:
-                timeout_count += 1
-                if timeout is not None and timeout_count >= 100 * timeout:
-                    break
-                time.sleep(0.01)
+    def reconnect(self, wait=RECONNECT_WAIT):
+        """Close the connection and open it again, waiting up to wait seconds
+        for the device to be back.  Used to recover from a failed link, so
+        errors closing it are ignored and anything received but not read yet
+        is dropped.  The board is left as it was, enter the raw REPL again to
+        use it.
+        """
+        try:
+            self.serial.close()
+        except (OSError, IOError):
+            pass
+        del self._rx_buffer[:]
+        self._open(wait)
+
+    def read(self, size):
+        """Read exactly size bytes, blocking until they arrive."""
+        data = bytes(self._rx_buffer[:size])
+        del self._rx_buffer[:size]
+        if len(data) < size:
+            data += self.serial.read(size - len(data))
         return data
 
-    def enter_raw_repl(self):
+    def in_waiting(self):
+        """Return the number of bytes that can be read without blocking."""
+        return len(self._rx_buffer) + self.serial.inWaiting()
+
+    def read_some(self, timeout=None):
+        """Read whatever is available in one go.  If nothing is available wait
+        up to timeout seconds (forever if None) for data to arrive and return
+        an empty byte string if none did.
+        """
+        if self._rx_buffer:
+            data = bytes(self._rx_buffer)
+            del self._rx_buffer[:]
+            return data
+        n = self.serial.inWaiting()
+        if n > 0:
+            return self.serial.read(n)
+        # Block in the serial driver instead of polling, so we wake up as soon
+        # as the first byte arrives.
+        previous_timeout = self.serial.timeout
+        try:
+            self.serial.timeout = timeout
+            try:
+                data = self.serial.read(1)
+            finally:
+                self.serial.timeout = previous_timeout
+        except TermiosError as ex:
+            # Setting the timeout failed, the port went away.
+            raise PyboardError('could not configure the port: {0}'.format(ex))
+        if data:
+            n = self.serial.inWaiting()
+            if n > 0:
+                data += self.serial.read(n)
+        return data
+
+    def read_until(self, min_num_bytes, ending, timeout=10, data_consumer=None, max_time=None):
+        # If a data_consumer is given the data is handed to it as it arrives
+        # and not accumulated, so arbitrarily large output can be streamed in
+        # constant memory.  The returned data is then just the ending.
+        # timeout limits the wait for each piece of data, max_time (if given)
+        # the whole read even if data keeps arriving.
+        until = ReadUntil(ending, self.read(min_num_bytes), data_consumer, max_time)
+        while not until.done() and not until.expired():
+            new_data = self.read_some(until.wait(timeout))
+            if not new_data:
+                # timeout without receiving anything
+                break
+            # Keep anything past the ending for the next read.
+            self._rx_buffer[0:0] = until.feed(new_data)
+        return bytes(until.data)
+
+    def enter_raw_repl(self, soft_reset=None):
+        """Interrupt the running program and enter the raw REPL, soft
+        rebooting the board if soft_reset is True (self.soft_reset if None).
+        Waits for the board's prompts rather than fixed delays, so attaching
+        without a reboot takes a few milliseconds.
+        """
+        if soft_reset is None:
+            soft_reset = self.soft_reset
         # Brief delay before sending RAW MODE char if requests
         if _rawdelay > 0:
             time.sleep(_rawdelay)
 
         # ctrl-C twice: interrupt any running program
-        self.serial.write(b'\r\x03')
-        time.sleep(0.1)
-        self.serial.write(b'\x03')
-        time.sleep(0.1)
+        self.serial.write(b'\r\x03\x03')
 
         # flush input (without relying on serial.flushInput())
+        del self._rx_buffer[:]
         n = self.serial.inWaiting()
         while n > 0:
             self.serial.read(n)
             n = self.serial.inWaiting()
 
-        for retry in range(0, 5): 
+        # Output of the interrupted program may still arrive before the
+        # banner, read_until skips it.  Without a soft reboot the prompt
+        # after the banner is left for exec_raw_no_follow.
+        ending = RAW_REPL_BANNER + b'>' if soft_reset else RAW_REPL_BANNER
+        for retry in range(0, 5):
             self.serial.write(b'\r\x01') # ctrl-A: enter raw REPL
-            data = self.read_until(1, b'raw REPL; CTRL-B to exit\r\n>')
-            if data.endswith(b'raw REPL; CTRL-B to exit\r\n>'):
+            data = self.read_until(1, ending)
+            if data.endswith(ending):
                 break
             else:
                 if retry >= 4:
                     print(data)
                     raise PyboardError('could not enter raw repl')
-                time.sleep(0.2)
+                # Try interrupting again.
+                self.serial.write(b'\r\x03\x03')
+
+        if not soft_reset:
+            return
 
         self.serial.write(b'\x04') # ctrl-D: soft reset
         data = self.read_until(1, b'soft reboot\r\n')
@@ -208,15 +677,15 @@ class Pyboard:
         # By splitting this into 2 reads, it allows boot.py to print stuff,
         # which will show up after the soft reboot and before the raw REPL.
         # Modification from original pyboard.py below:
-        #   Add a small delay and send Ctrl-C twice after soft reboot to ensure
-        #   any main program loop in main.py is interrupted.
-        time.sleep(0.5)
-        self.serial.write(b'\x03')
-        time.sleep(0.1)           # (slight delay before second interrupt
-        self.serial.write(b'\x03')
+        #   Send Ctrl-C twice if the raw REPL doesn't show up promptly after
+        #   the soft reboot, to interrupt any main program loop in main.py.
+        #   Nothing may arrive at all, so don't block on a first byte.
+        data = self.read_until(0, RAW_REPL_BANNER, max_time=MAIN_WAIT)
+        if not data.endswith(RAW_REPL_BANNER):
+            self.serial.write(b'\x03\x03')
+            data = self.read_until(1, RAW_REPL_BANNER)
         # End modification above.
-        data = self.read_until(1, b'raw REPL; CTRL-B to exit\r\n')
-        if not data.endswith(b'raw REPL; CTRL-B to exit\r\n'):
+        if not data.endswith(RAW_REPL_BANNER):
             print(data)
             raise PyboardError('could not enter raw repl')
 
@@ -239,6 +708,35 @@ class Pyboard:
         # return normal and error output
         return data, data_err
 
+    def raw_paste_write(self, command_bytes):
+        # Read initial header, with window size.
+        window_size = raw_paste_window(self.read(2))
+        window_remain = window_size
+
+        # Write out the command_bytes data.
+        i = 0
+        while i < len(command_bytes):
+            while window_remain == 0 or self.in_waiting():
+                more = raw_paste_flow(self.read(1), window_size)
+                if more is None:
+                    # Acknowledge the abrupt end and finish.
+                    self.serial.write(b'\x04')
+                    return
+                window_remain += more
+            # Send out as much data as possible that fits within the allowed window.
+            b = command_bytes[i:min(i + window_remain, len(command_bytes))]
+            self.serial.write(b)
+            window_remain -= len(b)
+            i += len(b)
+
+        # Indicate end of data.
+        self.serial.write(b'\x04')
+
+        # Wait for device to acknowledge end of data.
+        data = self.read_until(1, b'\x04')
+        if not data.endswith(b'\x04'):
+            raise PyboardError('could not complete raw paste: {}'.format(data))
+
     def exec_raw_no_follow(self, command):
         if isinstance(command, bytes):
             command_bytes = command
@@ -250,28 +748,179 @@ class Pyboard:
         if not data.endswith(b'>'):
             raise PyboardError('could not enter raw repl')
 
+        if self.use_raw_paste:
+            # Try to enter raw-paste mode, which lets the board throttle the
+            # upload with its own flow control instead of the fixed delays
+            # below.
+            self.serial.write(b'\x05A\x01')
+            supported = raw_paste_reply(self.read(2))
+            if supported:
+                # Device supports raw-paste mode, write out the command using this mode.
+                return self.raw_paste_write(command_bytes)
+            if supported is None:
+                # Device doesn't support raw-paste, fall back to normal raw REPL.
+                data = self.read_until(1, b'w REPL; CTRL-B to exit\r\n>')
+                if not data.endswith(b'w REPL; CTRL-B to exit\r\n>'):
+                    print(data)
+                    raise PyboardError('could not enter raw repl')
+            # Don't try to use raw-paste mode again for this connection.
+            self.use_raw_paste = False
+
         # write command
-        for i in range(0, len(command_bytes), 256):
-            self.serial.write(command_bytes[i:min(i + 256, len(command_bytes))])
-            time.sleep(0.01)
+        self.write_paced(command_bytes)
         self.serial.write(b'\x04')
 
         # check if we could exec command
-        data = self.serial.read(2)
-        if data != b'OK':
-            raise PyboardError('could not exec command')
+        check_exec_ok(self.read(2))
+
+    def write_paced(self, data):
+        """Write data a chunk at a time with a pause after each chunk, so a
+        board without raw-paste flow control can keep up.
+        """
+        for i in range(0, len(data), 256):
+            self.serial.write(data[i:min(i + 256, len(data))])
+            time.sleep(0.01)
 
     def exec_raw(self, command, timeout=10, data_consumer=None):
         self.exec_raw_no_follow(command);
         return self.follow(timeout, data_consumer)
 
+    def wait_ack(self, timeout=10):
+        """Wait for the running command to write an ACK (0x06) byte, which it
+        does when it is ready to read more input.  If anything else arrives the
+        command has finished early (usually with an exception), so collect
+        its output and raise it as a PyboardError like exec_ does.
+        """
+        data = self.read_some(timeout)
+        if not data:
+            raise PyboardError('timeout waiting for the board to ask for input')
+        self._rx_buffer[0:0] = data[1:]
+        if data[:1] == b'\x06':
+            return
+        self._rx_buffer[0:0] = data[:1]
+        ret, ret_err = self.follow(timeout)
+        raise PyboardError('exception', ret, ret_err)
+
+    def exec_with_input(self, command, chunks, timeout=10, data_consumer=None):
+        """Run command and stream chunks of data to its stdin.  The command
+        must write an ACK byte (see wait_ack) before reading each chunk, and
+        a chunk is only sent once it has been asked for, so the board's input
+        buffer is never overrun however fast the link is.  Returns the command
+        output like exec_.
+        """
+        self.exec_raw_no_follow(command)
+        for chunk in chunks:
+            self.wait_ack(timeout)
+            self.serial.write(chunk)
+        ret, ret_err = self.follow(timeout, data_consumer)
+        if ret_err:
+            raise PyboardError('exception', ret, ret_err)
+        return ret
+
+    def exec_iter(self, command, timeout=10):
+        """Run command and yield its output as it arrives, for commands which
+        print more than should be held in memory.  If the command raised an
+        exception a PyboardError is raised like exec_ does once its output
+        has been read.  Stopping the iteration early (closing the generator)
+        interrupts the command.
+        """
+        self.exec_raw_no_follow(command)
+        finished = False
+        try:
+            while True:
+                data = self.read_some(timeout)
+                if not data:
+                    raise PyboardError('timeout waiting for first EOF reception')
+                end = data.find(b'\x04')
+                if end == -1:
+                    yield data
+                    continue
+                # Keep the error output for follow below.
+                self._rx_buffer[0:0] = data[end:]
+                if end:
+                    yield data[:end]
+                break
+            finished = True
+        finally:
+            if not finished:
+                # Interrupt the command and skip whatever else it prints.
+                self.serial.write(b'\x03')
+                self.follow(timeout)
+        ret, ret_err = self.follow(timeout)
+        if ret_err:
+            raise PyboardError('exception', b'', ret_err)
+
+    def exec_pipelined(self, commands, window=EXEC_WINDOW, timeout=10, window_bytes=EXEC_WINDOW_BYTES):
+        """Run commands one after the other and yield the output of each as
+        it finishes, like exec_ would return it, but without waiting for a
+        command to finish before sending the next ones: up to window commands
+        and window_bytes bytes of them are sent ahead and queue in the board's
+        input buffer, so the link's latency is paid about once per window
+        instead of once per command.  The commands must not read stdin and
+        should be small (see EXEC_WINDOW).  They are sent in plain raw REPL
+        mode, paced like exec_raw_no_follow does.
+
+        If a command raises an exception the ones sent after it still run,
+        their output is read and dropped, and a PyboardError is raised for
+        the failing command like exec_ does.  No more commands are sent.
+        """
+        commands = iter(commands)
+        # check we have a prompt
+        data = self.read_until(1, b'>')
+        if not data.endswith(b'>'):
+            raise PyboardError('could not enter raw repl')
+        # Sizes of the commands sent which haven't finished, and the next
+        # command if it didn't fit in the window yet.
+        sent = []
+        command = None
+        first = True
+        error = None
+        closed = False
+        while True:
+            while error is None and not closed and len(sent) < window:
+                if command is None:
+                    command = next(commands, None)
+                    if command is None:
+                        break
+                    if not isinstance(command, bytes):
+                        command = bytes(command, encoding='utf8')
+                    command += b'\x04'
+                if sent and sum(sent) + len(command) > window_bytes:
+                    break
+                self.write_paced(command)
+                sent.append(len(command))
+                command = None
+            if not sent:
+                break
+            # Every command's output is followed by the prompt for the next
+            # one, the last prompt is left for the next exec.
+            if not first:
+                data = self.read_until(1, b'>', timeout=timeout)
+                if not data.endswith(b'>'):
+                    raise PyboardError('timeout waiting for the prompt')
+            first = False
+            check_exec_ok(self.read(2))
+            ret, ret_err = self.follow(timeout)
+            sent.pop(0)
+            if error is not None or closed:
+                continue
+            if ret_err:
+                error = PyboardError('exception', ret, ret_err)
+                continue
+            try:
+                yield ret
+            except GeneratorExit:
+                # Stopped early, still read the output of the commands sent.
+                closed = True
+        if error is not None:
+            raise error
+
     def eval(self, expression):
         ret = self.exec_('print({})'.format(expression))
         ret = ret.strip()
         return ret
 
-    def exec_(self, command, stream_output=False):
-        data_consumer = None
+    def exec_(self, command, stream_output=False, data_consumer=None):
         if stream_output:
             data_consumer = stdout_write_bytes
         ret, ret_err = self.exec_raw(command, data_consumer=data_consumer)
@@ -0,0 +1,260 @@
+# Adafruit MicroPython Tool - asyncio Board Connection Tests
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+import asyncio
+import os
+import sys
+import unittest
+
+import unittest.mock as mock
+
+from ampy import aio
+from ampy.pyboard import PyboardError
+
+
+class FakeWriter(object):
+    """Write side of a fake board connection, which records everything
+    written and feeds the reader the output of the replies, (trigger, output)
+    pairs like FakeSerial in test_pyboard.py takes.
+    """
+
+    def __init__(self, reader, replies=()):
+        self.reader = reader
+        self.replies = list(replies)
+        self.written = bytearray()
+
+    def write(self, data):
+        self.written.extend(data)
+        while self.replies and self.written.endswith(self.replies[0][0]):
+            self.reader.feed_data(self.replies.pop(0)[1])
+
+    async def drain(self):
+        pass
+
+    def close(self):
+        pass
+
+
+def make_pyboard(output=b"", replies=(), soft_reset=True):
+    reader = asyncio.StreamReader()
+    reader.feed_data(output)
+    writer = FakeWriter(reader, replies)
+    return aio.AsyncPyboard(reader, writer, soft_reset), writer
+
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+
+class TestAsyncPyboard(unittest.TestCase):
+    def test_exec_raw_paste(self):
+        async def test():
+            # A window of 4 bytes, the board asks for each next one.
+            pyboard, fake = make_pyboard(
+                b">R\x01\x04\x00",
+                replies=[
+                    (b"x = ", b"\x01"),
+                    (b"1\r\np", b"\x01"),
+                    (b"rint", b"\x01"),
+                    (b"(x)\x04", b"\x041\r\n\x04\x04>"),
+                ],
+            )
+            self.assertEqual(await pyboard.exec_("x = 1\r\nprint(x)"), b"1\r\n")
+            self.assertEqual(bytes(fake.written), b"\x05A\x01x = 1\r\nprint(x)\x04")
+
+        run(test())
+
+    def test_exec_raw_paste_short_header(self):
+        async def test():
+            # The window size never arrives in full.
+            pyboard, fake = make_pyboard(b">R\x01\x04")
+            read = pyboard.read
+            pyboard.read = lambda size, timeout=10: read(size, 0.05)
+            with self.assertRaises(PyboardError):
+                await pyboard.exec_("x = 1")
+
+        run(test())
+
+    def test_exec_error(self):
+        async def test():
+            pyboard, fake = make_pyboard(
+                b">R\x00OK", replies=[(b"\x04", b"\x04Traceback\x04>")]
+            )
+            with self.assertRaises(PyboardError) as context:
+                await pyboard.exec_("foo()")
+            self.assertEqual(context.exception.args, ("exception", b"", b"Traceback"))
+            self.assertFalse(pyboard.use_raw_paste)
+
+        run(test())
+
+    def test_exec_with_input(self):
+        async def test():
+            pyboard, fake = make_pyboard(
+                b">R\x00OK\x06",
+                replies=[(b"ab", b"\x06"), (b"cd", b"done\x04\x04>")],
+            )
+            out = await pyboard.exec_with_input("recv()", [b"ab", b"cd"])
+            self.assertEqual(out, b"done")
+
+        run(test())
+
+    def test_enter_raw_repl(self):
+        async def test():
+            pyboard, fake = make_pyboard(
+                replies=[
+                    (b"\r\x01", b"\r\n>>> raw REPL; CTRL-B to exit\r\n>"),
+                    (b"\x04", b"OK\r\nMPY: soft reboot\r\nraw REPL; CTRL-B to exit\r\n>"),
+                ]
+            )
+            await pyboard.enter_raw_repl()
+            self.assertEqual(bytes(fake.written), b"\r\x03\x03\r\x01\x04")
+            self.assertEqual(await pyboard.read_some(0.1), b">")
+
+        run(test())
+
+    def test_enter_raw_repl_without_soft_reset(self):
+        async def test():
+            pyboard, fake = make_pyboard(
+                replies=[(b"\r\x01", b"raw REPL; CTRL-B to exit\r\n>")], soft_reset=False
+            )
+            await pyboard.enter_raw_repl()
+            self.assertEqual(bytes(fake.written), b"\r\x03\x03\r\x01")
+
+        run(test())
+
+    def test_boards_share_the_event_loop(self):
+        async def test():
+            slow, slow_writer = make_pyboard(b">R\x00OK")
+            fast, fast_writer = make_pyboard(
+                b">R\x00OK", replies=[(b"\x04", b"fast\x04\x04>")]
+            )
+            pending = asyncio.ensure_future(slow.exec_("wait()"))
+            # The slow board's exec doesn't hold up the other one.
+            self.assertEqual(await fast.exec_("go()"), b"fast")
+            self.assertFalse(pending.done())
+            slow._reader.feed_data(b"slow\x04\x04>")
+            self.assertEqual(await pending, b"slow")
+
+        run(test())
+
+
+class TestConnections(unittest.TestCase):
+    @unittest.skipIf(sys.platform == "win32", "needs a pty")
+    def test_open_serial(self):
+        async def test():
+            master, slave = os.openpty()
+            try:
+                import tty
+
+                tty.setraw(slave)
+                reader, writer = await aio.open_serial(os.ttyname(slave))
+                os.write(master, b"hello")
+                self.assertEqual(await asyncio.wait_for(reader.read(100), 1), b"hello")
+                writer.write(b"x" * 10000)
+                received = b""
+                while len(received) < 10000:
+                    # Drain the pty while the writer flushes what it kept.
+                    await asyncio.sleep(0.001)
+                    received += os.read(master, 10000)
+                await asyncio.wait_for(writer.drain(), 1)
+                self.assertEqual(received, b"x" * 10000)
+                writer.close()
+            finally:
+                os.close(master)
+                os.close(slave)
+
+        run(test())
+
+    def test_open_telnet(self):
+        async def test():
+            async def serve(reader, writer):
+                # Telnet negotiation, split across writes like a board might.
+                writer.write(b"\xff\xfb\x01\xff")
+                await writer.drain()
+                await asyncio.sleep(0.01)
+                writer.write(b"\xfb\x03Login as:")
+                await reader.readuntil(b"micro\r\n")
+                writer.write(b"Password:")
+                await reader.readuntil(b"python\r\n")
+                writer.write(b'Type "help()" for more information.\r\n>>> \xff\xff')
+                await writer.drain()
+
+            server = await asyncio.start_server(serve, "127.0.0.1", 0)
+            port = server.sockets[0].getsockname()[1]
+            reader, writer = await aio.open_telnet("127.0.0.1", "micro", "python", port)
+            self.assertEqual(await reader.readexactly(7), b"\r\n>>> \xff")
+            writer.close()
+            server.close()
+            await server.wait_closed()
+
+        run(test())
+
+
+class TestAsyncFiles(unittest.TestCase):
+    def make_files(self, outputs):
+        pyboard = mock.Mock()
+        pyboard.enter_raw_repl = mock.AsyncMock()
+        pyboard.exit_raw_repl = mock.AsyncMock()
+        pyboard.exec_ = mock.AsyncMock(side_effect=outputs)
+        pyboard.exec_with_input = mock.AsyncMock(return_value=b"")
+        return pyboard, aio.AsyncFiles(pyboard)
+
+    def test_ls(self):
+        pyboard, board_files = self.make_files([b"f 11 /foo.txt\r\nd 0 /lib\r\n"])
+        result = run(board_files.ls())
+        self.assertEqual(result, ["/foo.txt - 11 bytes", "/lib - 0 bytes"])
+        self.assertIn("_ampy.ls('/', 0)", pyboard.exec_.call_args[0][0])
+
+    def test_get(self):
+        async def exec_(command, data_consumer=None):
+            data_consumer(b"aGVsbG8g\r\n")
+            data_consumer(b"d29ybGQ=\r\n")
+            return b""
+
+        pyboard, board_files = self.make_files([b"True\r\n"])
+        run(board_files._probe("base64", "True"))
+        pyboard.exec_ = exec_
+        self.assertEqual(run(board_files.get("foo.txt")), b"hello world")
+
+    def test_get_missing_file(self):
+        error = PyboardError("exception", b"", b"OSError: [Errno 2] ENOENT\r\n")
+        pyboard, board_files = self.make_files([b"True\r\n", error])
+        with self.assertRaises(RuntimeError):
+            run(board_files.get("foo.txt"))
+
+    def test_put(self):
+        pyboard, board_files = self.make_files([b"True\r\n", b"False\r\n"])
+        sizes = []
+        run(board_files.put("foo.txt", b"hello world", sizes.append))
+        command, chunks = pyboard.exec_with_input.call_args[0]
+        self.assertIn("_ampy.recv('foo.txt', 11, 1024)", command)
+        self.assertEqual(list(chunks), [b"aGVsbG8gd29ybGQ="])
+        self.assertEqual(sizes, [11])
+
+    def test_put_falls_back_without_base64(self):
+        pyboard, board_files = self.make_files([b"False\r\n", b"", b"", b"", b""])
+        run(board_files.put("foo.txt", b"hello world"))
+        commands = [call[0][0] for call in pyboard.exec_.call_args_list[1:]]
+        self.assertEqual(commands[0], "_ampy_f = open('foo.txt.part', 'wb')")
+        self.assertEqual(commands[1], "_ampy_f.write(b'hello world')")
+        self.assertIn("_ampy.replace('foo.txt.part', 'foo.txt')", commands[-1])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,101 @@
+# Adafruit MicroPython Tool - Metadata Cache Tests
+# Copyright (c) 2016 Adafruit Industries
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+import unittest
+
+# Try importing python 3 mock library, then fall back to python 2 (external module).
+try:
+    import unittest.mock as mock
+except ImportError:
+    import mock
+
+import ampy.cache as cache
+
+
+FILE_STAT = (0x8000, 0, 0, 0, 0, 0, 11, 0, 0, 0)
+
+
+class TestCachedFiles(unittest.TestCase):
+    def test_stat_is_cached(self):
+        board_files = mock.Mock()
+        board_files.stat = mock.Mock(return_value=FILE_STAT)
+        cached = cache.CachedFiles(board_files)
+        self.assertTrue(cached.exists("/foo.txt"))
+        self.assertEqual(cached.size("foo.txt"), 11)
+        self.assertFalse(cached.isdir("/foo.txt"))
+        board_files.stat.assert_called_once_with("/foo.txt")
+
+    def test_missing_path_is_cached(self):
+        board_files = mock.Mock()
+        board_files.stat = mock.Mock(side_effect=RuntimeError("No such file"))
+        cached = cache.CachedFiles(board_files)
+        self.assertFalse(cached.exists("/foo.txt"))
+        self.assertFalse(cached.exists("/foo.txt"))
+        self.assertEqual(board_files.stat.call_count, 1)
+
+    def test_ttl(self):
+        board_files = mock.Mock()
+        board_files.ls = mock.Mock(return_value=["/foo.txt"])
+        cached = cache.CachedFiles(board_files, ttl=10)
+        with mock.patch("time.time", return_value=100):
+            cached.ls("/")
+            cached.ls("/")
+        with mock.patch("time.time", return_value=111):
+            cached.ls("/")
+        self.assertEqual(board_files.ls.call_count, 2)
+
+    def test_put_invalidates_parent_listing(self):
+        board_files = mock.Mock()
+        board_files.ls = mock.Mock(return_value=[])
+        board_files.stat = mock.Mock(side_effect=RuntimeError("No such file"))
+        cached = cache.CachedFiles(board_files)
+        cached.ls("/lib")
+        self.assertFalse(cached.exists("/lib/foo.py"))
+        cached.put("/lib/foo.py", b"hello")
+        board_files.stat = mock.Mock(return_value=FILE_STAT)
+        self.assertTrue(cached.exists("/lib/foo.py"))
+        cached.ls("/lib")
+        self.assertEqual(board_files.ls.call_count, 2)
+
+    def test_rmdir_forgets_children(self):
+        board_files = mock.Mock()
+        board_files.stat = mock.Mock(return_value=FILE_STAT)
+        cached = cache.CachedFiles(board_files)
+        self.assertTrue(cached.exists("/lib/foo.py"))
+        cached.rmdir("/lib")
+        board_files.stat = mock.Mock(side_effect=RuntimeError("No such file"))
+        self.assertFalse(cached.exists("/lib"))
+        self.assertFalse(cached.exists("/lib/foo.py"))
+        board_files.stat.assert_called_once_with("/lib/foo.py")
+
+    def test_shared_cache_is_keyed_per_board(self):
+        shared = {}
+        first, second = mock.Mock(), mock.Mock()
+        first.stat = mock.Mock(return_value=FILE_STAT)
+        second.stat = mock.Mock(side_effect=RuntimeError("No such file"))
+        self.assertTrue(cache.CachedFiles(first, cache=shared).exists("/foo.txt"))
+        self.assertFalse(cache.CachedFiles(second, cache=shared).exists("/foo.txt"))
+        cache.CachedFiles(second, cache=shared).invalidate()
+        self.assertTrue(cache.CachedFiles(first, cache=shared).exists("/foo.txt"))
+        first.stat.assert_called_once_with("/foo.txt")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,103 @@
+# Adafruit MicroPython Tool - Cross-compiler Tests
+# Copyright (c) 2016 Adafruit Industries
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+import ampy.compiler as compiler
+
+
+# A stand-in for mpy-cross which "compiles" by upper-casing the source and
+# prefixing the flags it got.
+FAKE_MPY_CROSS = """
+import sys
+args = sys.argv[1:]
+if '--version' in args:
+    print('fake-mpy-cross 1.0')
+    sys.exit(0)
+source = args[-1]
+output = args[args.index('-o') + 1]
+flags = [a for a in args[:args.index('-s')]]
+data = open(source, 'rb').read()
+if b'syntax error' in data:
+    sys.stderr.write('SyntaxError: invalid syntax\\n')
+    sys.exit(1)
+with open(output, 'wb') as f:
+    f.write(' '.join(flags).encode() + b':' + data.upper())
+"""
+
+
+class TestMpyCross(unittest.TestCase):
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.workdir)
+        self.script = os.path.join(self.workdir, "mpy_cross.py")
+        with open(self.script, "w") as outfile:
+            outfile.write(FAKE_MPY_CROSS)
+        self.cache_dir = os.path.join(self.workdir, "cache")
+
+    def make_compiler(self, *flags):
+        return compiler.MpyCross(
+            [sys.executable, self.script] + list(flags), cache_dir=self.cache_dir
+        )
+
+    def test_convert(self):
+        mpy_cross = self.make_compiler("-O2")
+        self.assertEqual(
+            mpy_cross.convert("/lib/foo.py", b"x = 1"), ("/lib/foo.mpy", b"-O2:X = 1")
+        )
+        self.assertEqual(mpy_cross.convert("/main.py", b"x = 1"), ("/main.py", b"x = 1"))
+        self.assertEqual(mpy_cross.convert("/data.txt", b"x"), ("/data.txt", b"x"))
+
+    def test_cache(self):
+        first = self.make_compiler()
+        first.compile(b"x = 1", "foo.py")
+        first.compile(b"x = 1", "foo.py")
+        self.assertEqual(first.compiled, 1)
+        # Another compiler with the same command shares the cache.
+        second = self.make_compiler()
+        self.assertEqual(second.compile(b"x = 1", "foo.py"), b":X = 1")
+        self.assertEqual(second.compiled, 0)
+        # Different sources, names or flags are compiled again.
+        second.compile(b"x = 2", "foo.py")
+        second.compile(b"x = 1", "bar.py")
+        self.assertEqual(second.compiled, 2)
+        third = self.make_compiler("-O1")
+        self.assertEqual(third.compile(b"x = 1", "foo.py"), b"-O1:X = 1")
+        self.assertEqual(third.compiled, 1)
+
+    def test_compile_error(self):
+        mpy_cross = self.make_compiler()
+        with self.assertRaisesRegex(RuntimeError, "Failed to compile foo.py: SyntaxError"):
+            mpy_cross.compile(b"syntax error", "foo.py")
+
+    def test_missing_compiler(self):
+        mpy_cross = compiler.MpyCross(
+            "no-such-mpy-cross-command", cache_dir=self.cache_dir
+        )
+        with self.assertRaisesRegex(RuntimeError, "Could not run the cross-compiler"):
+            mpy_cross.compile(b"x = 1", "foo.py")
+
+
+if __name__ == "__main__":
+    unittest.main()
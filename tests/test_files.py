@@ -19,9 +19,14 @@
 # LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
+import binascii
+import io
+import os
+import shutil
 import tempfile
 import sys
 import unittest
+import zlib
 
 # Try importing python 3 mock library, then fall back to python 2 (external module).
 try:
@@ -30,7 +35,7 @@ except ImportError:
     import mock
 
 import ampy.files as files
-from ampy.pyboard import PyboardError
+from ampy.pyboard import PyboardError, WebreplToSerial
 
 
 class TestFiles(unittest.TestCase):
@@ -42,23 +47,113 @@ class TestFiles(unittest.TestCase):
         else:
             return self.assertRaisesRegexp(*args, **kwargs)
 
+    def test_get_tree(self):
+        pyboard = mock.Mock()
+        pyboard.exec_ = self.board_output(
+            b"True\r\n",
+            [
+                b">d /lib\r\n>f /lib/foo.txt\r\naGVsbG8g",
+                b"d29ybGQ=\n>f /lib/empty\r\n>d /lib/sub\r\n",
+                b">f /lib/sub/bar.txt\r\nYmFy\n\x04",
+            ],
+        )
+        board_files = files.Files(pyboard)
+        local = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, local)
+        self.assertEqual(board_files.get_tree("/lib", local), 3)
+        with open(os.path.join(local, "foo.txt"), "rb") as infile:
+            self.assertEqual(infile.read(), b"hello world")
+        with open(os.path.join(local, "sub", "bar.txt"), "rb") as infile:
+            self.assertEqual(infile.read(), b"bar")
+        self.assertEqual(os.path.getsize(os.path.join(local, "empty")), 0)
+
+    def test_get_tree_rejects_paths_outside_directory(self):
+        pyboard = mock.Mock()
+        pyboard.exec_ = self.board_output(b"True\r\n", [b">f /etc/passwd\r\n\x04"])
+        board_files = files.Files(pyboard)
+        local = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, local)
+        with self.raisesRegex(RuntimeError, "unexpected path"):
+            board_files.get_tree("/lib", local)
+
+    def test_get_tree_errors(self):
+        missing = PyboardError(
+            "exception", b"", b"Traceback (most recent call last):\r\nOSError: [Errno 2] ENOENT\r\n"
+        )
+        full = PyboardError(
+            "exception", b"", b"Traceback (most recent call last):\r\nOSError: [Errno 28] ENOSPC\r\n"
+        )
+        timeout = PyboardError("timeout waiting for first EOF reception")
+        local = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, local)
+        pyboard = mock.Mock()
+        pyboard.exec_ = mock.Mock(side_effect=[b"True\r\n", missing, full, timeout])
+        board_files = files.Files(pyboard)
+        with self.raisesRegex(RuntimeError, "No such directory: /lib"):
+            board_files.get_tree("/lib", local)
+        # Only errno 2 means the directory is missing, and errors which
+        # aren't exceptions on the board are raised as they are.
+        for error in (full, timeout):
+            with self.assertRaises(PyboardError) as context:
+                board_files.get_tree("/lib", local)
+            self.assertIs(context.exception, error)
+
     def test_ls_multiple_files(self):
         pyboard = mock.Mock()
-        pyboard.exec_ = mock.Mock(return_value=b"['boot.py', 'main.py', 'foo.txt']")
+        pyboard.exec_iter = mock.Mock(
+            return_value=(
+                data for data in [b"f 12 /main.py\r\nf 9 /bo", b"ot.py\r\nd 0 /lib\r\n"]
+            )
+        )
         board_files = files.Files(pyboard)
         result = board_files.ls()
-        self.assertListEqual(result, ["boot.py", "main.py", "foo.txt"])
+        self.assertListEqual(
+            result, ["/boot.py - 9 bytes", "/lib - 0 bytes", "/main.py - 12 bytes"]
+        )
+
+    def test_ilistdir_rejects_other_commands(self):
+        pyboard = mock.Mock()
+        pyboard.exec_iter = mock.Mock(return_value=(data for data in [b"f 12 /main.py\r\n"]))
+        board_files = files.Files(pyboard)
+        for entry in board_files.ilistdir("/"):
+            with self.raisesRegex(RuntimeError, "finish iterating over ilistdir"):
+                board_files.stat(entry.path)
+        pyboard.exec_.assert_not_called()
+        # The board can be used again once the listing is over.
+        pyboard.exec_ = mock.Mock(return_value=b"(32768, 0, 0, 0, 0, 0, 12, 0, 0, 0)\r\n")
+        self.assertEqual(board_files.stat("/main.py")[6], 12)
 
     def test_ls_no_files(self):
         pyboard = mock.Mock()
-        pyboard.exec_ = mock.Mock(return_value=b"[]")
+        pyboard.exec_iter = mock.Mock(return_value=(data for data in []))
         board_files = files.Files(pyboard)
         result = board_files.ls()
         self.assertListEqual(result, [])
 
+    def test_ls_recursive_skips_directories_with_contents(self):
+        pyboard = mock.Mock()
+        pyboard.exec_iter = mock.Mock(
+            return_value=(
+                data for data in [b"d 0 /lib\r\nd 0 /empty\r\nf 3 /lib/foo bar.py\r\n"]
+            )
+        )
+        board_files = files.Files(pyboard)
+        result = board_files.ls(long_format=False, recursive=True)
+        self.assertListEqual(result, ["/empty", "/lib/foo bar.py"])
+        self.assertIn("_ampy.ls('/', 1)", pyboard.exec_iter.call_args[0][0])
+
+    def test_ilistdir(self):
+        pyboard = mock.Mock()
+        pyboard.exec_iter = mock.Mock(return_value=(data for data in [b"d 0 /lib\r\nf 3 /a.py\r\n"]))
+        board_files = files.Files(pyboard)
+        entries = list(board_files.ilistdir("/"))
+        self.assertEqual(
+            entries, [files.DirEntry("/lib", True, 0), files.DirEntry("/a.py", False, 3)]
+        )
+
     def test_ls_bad_directory(self):
         pyboard = mock.Mock()
-        pyboard.exec_ = mock.Mock(
+        pyboard.exec_iter = mock.Mock(
             side_effect=PyboardError(
                 "exception",
                 b"",
@@ -69,13 +164,59 @@ class TestFiles(unittest.TestCase):
             board_files = files.Files(pyboard)
             result = board_files.ls("/foo")
 
+    def test_ls_errors(self):
+        # Only errno 2 means the directory is missing.
+        for error in (
+            PyboardError("exception", b"", b"OSError: [Errno 32] EPIPE\r\n"),
+            PyboardError("timeout waiting for first EOF reception"),
+        ):
+            pyboard = mock.Mock()
+            pyboard.exec_iter = mock.Mock(side_effect=error)
+            board_files = files.Files(pyboard)
+            with self.assertRaises(PyboardError) as context:
+                board_files.ls("/foo")
+            self.assertIs(context.exception, error)
+
+    def board_output(self, probe, output):
+        # Mock exec_ which answers the feature probe and then streams output
+        # to the data_consumer like the real Pyboard does.
+        def exec_(command, data_consumer=None):
+            if data_consumer is None:
+                return probe
+            for chunk in output:
+                data_consumer(chunk)
+            return b""
+
+        return mock.Mock(side_effect=exec_)
+
+    def pipelined(self, sent):
+        # Stand-in for Pyboard.exec_pipelined running every command, which
+        # are added to sent.
+        def exec_pipelined(commands):
+            for command in commands:
+                sent.append(command)
+                yield b""
+
+        return mock.Mock(side_effect=exec_pipelined)
+
     def test_get_with_data(self):
         pyboard = mock.Mock()
-        pyboard.exec_ = mock.Mock(return_value=b"hello world")
+        pyboard.exec_ = self.board_output(
+            b"True\r\n", [b"aGVsbG8g", b"d29y\nbGQ=\n", b"\x04"]
+        )
         board_files = files.Files(pyboard)
         result = board_files.get("foo.txt")
         self.assertEqual(result, b"hello world")
 
+    def test_get_hex_to_sink(self):
+        pyboard = mock.Mock()
+        pyboard.exec_ = self.board_output(b"False\r\n", [b"68656c6", b"c6f\x04"])
+        board_files = files.Files(pyboard)
+        sink = io.BytesIO()
+        result = board_files.get("foo.txt", sink)
+        self.assertIsNone(result)
+        self.assertEqual(sink.getvalue(), b"hello")
+
     def test_get_bad_file(self):
         pyboard = mock.Mock()
         pyboard.exec_ = mock.Mock(
@@ -89,11 +230,285 @@ class TestFiles(unittest.TestCase):
             board_files = files.Files(pyboard)
             result = board_files.get("foo.txt")
 
+    def test_get_resumes_after_timeout(self):
+        pyboard = mock.Mock()
+        outputs = [[b"aGVsbA==\nbyB3"], [b"byB3b3JsZA==\n\x04"]]
+
+        def exec_(command, data_consumer=None):
+            if data_consumer is None:
+                return b"True\r\n"
+            for chunk in outputs.pop(0):
+                data_consumer(chunk)
+            if outputs:
+                raise PyboardError("timeout waiting for first EOF reception")
+            return b""
+
+        pyboard.exec_ = mock.Mock(side_effect=exec_)
+        board_files = files.Files(pyboard)
+        self.assertEqual(board_files.get("foo.txt"), b"hello world")
+        pyboard.reconnect.assert_called_once_with()
+        self.assertIn("send('foo.txt', 1024, 1, 4)", pyboard.exec_.call_args[0][0])
+
     def test_put(self):
         pyboard = mock.Mock()
         pyboard.exec_ = mock.Mock(return_value=b"")
+        sent = []
+        pyboard.exec_pipelined = self.pipelined(sent)
         board_files = files.Files(pyboard)
         board_files.put("foo.txt", "hello world")
+        self.assertEqual(
+            sent,
+            [
+                "_ampy_f = open('foo.txt.part', 'wb')",
+                "_ampy_f.write(b'hello world')",
+                "_ampy_f.close()\ndel _ampy_f",
+            ],
+        )
+        self.assertIn("_ampy.replace('foo.txt.part', 'foo.txt')", pyboard.exec_.call_args[0][0])
+
+    def test_put_pipelined_error(self):
+        pyboard = mock.Mock()
+        pyboard.exec_ = mock.Mock(return_value=b"")
+        error = PyboardError(
+            "exception",
+            b"",
+            b'Traceback (most recent call last):\r\n  File "<stdin>", line 1, in <module>\r\nOSError: [Errno 28] ENOSPC\r\n',
+        )
+
+        def exec_pipelined(commands):
+            next(commands)
+            yield b""
+            raise error
+
+        pyboard.exec_pipelined = mock.Mock(side_effect=exec_pipelined)
+        progress = mock.Mock()
+        board_files = files.Files(pyboard)
+        with self.assertRaises(PyboardError):
+            board_files.put("foo.txt", b"hello world", progress)
+        progress.assert_not_called()
+        pyboard.reconnect.assert_not_called()
+
+    def test_put_base64(self):
+        pyboard = mock.Mock()
+        pyboard.exec_ = mock.Mock(return_value=b"True\r\n")
+        sent = []
+        pyboard.exec_with_input = mock.Mock(
+            side_effect=lambda command, chunks: sent.extend(chunks)
+        )
+        progress = mock.Mock()
+        board_files = files.Files(pyboard, block_size=4)
+        board_files.put("foo.txt", b"hello world", progress)
+        self.assertEqual(sent, [b"aGVsbA==", b"byB3bw==", b"cmxk"])
+        self.assertEqual(progress.call_count, 3)
+        command = pyboard.exec_with_input.call_args[0][0]
+        self.assertIn("recv('foo.txt', 11, 4, 0)", command)
+
+    def test_put_compressed(self):
+        pyboard = mock.Mock()
+        pyboard.exec_ = mock.Mock(return_value=b"True\r\n")
+        sent = []
+        pyboard.exec_with_input = mock.Mock(
+            side_effect=lambda command, chunks: sent.extend(chunks)
+        )
+        progress = mock.Mock()
+        data = b"hello world\n" * 1000
+        board_files = files.Files(pyboard)
+        board_files.put("foo.txt", data, progress)
+        payload = b"".join(binascii.a2b_base64(chunk) for chunk in sent)
+        self.assertEqual(zlib.decompress(payload), data)
+        command = pyboard.exec_with_input.call_args[0][0]
+        self.assertIn("recv_compressed('foo.txt', {0}, 1024, 0)".format(len(payload)), command)
+        self.assertEqual(sum(c[0][0] for c in progress.call_args_list), len(data))
+        self.assertEqual(board_files.data_bytes, len(data))
+        self.assertEqual(board_files.sent_bytes, len(payload))
+
+    def test_put_shared_compress_cache(self):
+        pyboard = mock.Mock()
+        pyboard.exec_ = mock.Mock(return_value=b"True\r\n")
+        pyboard.exec_with_input = mock.Mock(side_effect=lambda command, chunks: list(chunks))
+        data = b"hello world\n" * 1000
+        cache = {}
+        with mock.patch("ampy.files.compress", wraps=files.compress) as compress:
+            for i in range(2):
+                board_files = files.Files(pyboard, compress_cache=cache)
+                board_files.put("foo.txt", data)
+        self.assertEqual(compress.call_count, 1)
+        self.assertEqual(zlib.decompress(cache[data]), data)
+
+    def test_put_resumes_after_timeout(self):
+        pyboard = mock.Mock()
+        pyboard.exec_ = mock.Mock(side_effect=[b"True\r\n", b"4\r\n"])
+        sent = []
+
+        def exec_with_input(command, chunks):
+            for chunk in chunks:
+                sent.append(chunk)
+                if len(sent) == 2:
+                    raise PyboardError("timeout waiting for the board to ask for input")
+
+        pyboard.exec_with_input = mock.Mock(side_effect=exec_with_input)
+        progress = mock.Mock()
+        board_files = files.Files(pyboard, block_size=4, compress=False)
+        board_files.put("foo.txt", b"hello world", progress)
+        pyboard.reconnect.assert_called_once_with()
+        self.assertEqual(pyboard.enter_raw_repl.call_count, 2)
+        self.assertIn("part_size('foo.txt')", pyboard.exec_.call_args[0][0])
+        command = pyboard.exec_with_input.call_args[0][0]
+        self.assertIn("recv('foo.txt', 7, 4, 4)", command)
+        self.assertEqual(sent[2:], [b"byB3bw==", b"cmxk"])
+        self.assertEqual(sum(c[0][0] for c in progress.call_args_list), 11)
+
+    def test_put_gives_up_after_retries(self):
+        pyboard = mock.Mock()
+        pyboard.exec_ = mock.Mock(return_value=b"True\r\n")
+        pyboard.exec_with_input = mock.Mock(
+            side_effect=PyboardError("timeout waiting for the board to ask for input")
+        )
+        board_files = files.Files(pyboard, retries=2)
+        with self.assertRaises(PyboardError):
+            board_files.put("foo.txt", b"hello world")
+        self.assertEqual(pyboard.reconnect.call_count, 2)
+        self.assertEqual(pyboard.exec_with_input.call_count, 3)
+
+    def test_put_does_not_retry_board_exceptions(self):
+        pyboard = mock.Mock()
+        pyboard.exec_ = mock.Mock(return_value=b"True\r\n")
+        pyboard.exec_with_input = mock.Mock(
+            side_effect=PyboardError(
+                "exception",
+                b"",
+                b'Traceback (most recent call last):\r\n  File "<stdin>", line 3, in <module>\r\nOSError: [Errno 28] ENOSPC\r\n',
+            )
+        )
+        board_files = files.Files(pyboard)
+        with self.assertRaises(PyboardError):
+            board_files.put("foo.txt", b"hello world")
+        pyboard.reconnect.assert_not_called()
+
+    def test_put_resumes_after_os_error(self):
+        # pyserial raises a plain OSError when the USB serial bridge resets.
+        pyboard = mock.Mock()
+        pyboard.exec_ = mock.Mock(side_effect=[b"True\r\n", b"0\r\n"])
+        pyboard.exec_with_input = mock.Mock(
+            side_effect=[OSError(5, "Input/output error"), b""]
+        )
+        board_files = files.Files(pyboard, compress=False)
+        board_files.put("foo.txt", b"hello world")
+        pyboard.reconnect.assert_called_once_with()
+        self.assertEqual(pyboard.exec_with_input.call_count, 2)
+
+    def test_put_files(self):
+        pyboard = mock.Mock()
+        pyboard.exec_ = mock.Mock(side_effect=[b"True\r\n", b"False\r\n"])
+        sent = []
+        pyboard.exec_with_input = mock.Mock(
+            side_effect=lambda command, chunks: sent.extend(chunks)
+        )
+        progress = mock.Mock()
+        board_files = files.Files(pyboard)
+        board_files.put_files(
+            [("/lib", None, None), ("/lib/foo.txt", b"hello world", progress)]
+        )
+        headers = [binascii.a2b_base64(sent[0][8:]), binascii.a2b_base64(sent[1][8:])]
+        self.assertEqual(headers, [b"d:0:/lib", b"f:11:/lib/foo.txt"])
+        self.assertEqual(int(sent[1][:8], 16), len(sent[1]) - 8)
+        self.assertEqual(sent[2:], [b"aGVsbG8gd29ybGQ=", b"00000000"])
+        progress.assert_called_once_with(11)
+        self.assertEqual(pyboard.exec_with_input.call_count, 1)
+        pyboard.enter_raw_repl.assert_called_once_with()
+
+    def test_put_files_resumes_unfinished_file(self):
+        # The link fails after /a.txt's last block, before the board asked
+        # for the next record, so /a.txt may not be in place yet.
+        pyboard = mock.Mock()
+        pyboard.exec_ = mock.Mock(side_effect=[b"True\r\n", b"False\r\n", b"5\r\n"])
+        calls = []
+
+        def exec_with_input(command, chunks):
+            calls.append(command)
+            for chunk in chunks:
+                if len(calls) == 1 and binascii.a2b_base64(chunk[8:]) == b"f:5:/b.txt":
+                    raise PyboardError("timeout waiting for the board to ask for input")
+            return b""
+
+        pyboard.exec_with_input = mock.Mock(side_effect=exec_with_input)
+        board_files = files.Files(pyboard)
+        board_files.put_files([("/a.txt", b"hello", None), ("/b.txt", b"world", None)])
+        pyboard.reconnect.assert_called_once_with()
+        self.assertIn("_ampy.recv('/a.txt', 0, 1024, 5)", calls[1])
+        self.assertIn("_ampy.recv('/b.txt', 5, 1024, 0)", calls[2])
+        self.assertIn("_ampy.recv_files(1024)", calls[3])
+
+    def test_put_files_falls_back_without_base64(self):
+        pyboard = mock.Mock()
+        pyboard.exec_ = mock.Mock(return_value=b"False\r\n")
+        sent = []
+        pyboard.exec_pipelined = self.pipelined(sent)
+        board_files = files.Files(pyboard)
+        board_files.put_files(
+            [("/lib", None, None), ("/lib/foo.txt", b"hello world", None)]
+        )
+        pyboard.exec_with_input.assert_not_called()
+        self.assertIn("_ampy_f = open('/lib/foo.txt.part', 'wb')", sent)
+
+    def test_put_falls_back_without_base64(self):
+        pyboard = mock.Mock()
+        pyboard.exec_ = mock.Mock(return_value=b"False\r\n")
+        sent = []
+        pyboard.exec_pipelined = self.pipelined(sent)
+        board_files = files.Files(pyboard)
+        board_files.put("foo.txt", b"hello world")
+        pyboard.exec_with_input.assert_not_called()
+        self.assertIn("_ampy_f.write(b'hello world')", sent)
+
+    def test_put_delta_sends_changed_blocks(self):
+        pyboard = mock.Mock()
+        old = [b"hell", b"o wo", b"rld"]
+        hashes = "".join(files.file_digest(b, "sha256") + "\n" for b in old)
+        pyboard.exec_ = mock.Mock(
+            side_effect=[b"True\r\n", ("sha256\n" + hashes).encode("utf-8")]
+        )
+        sent = []
+        pyboard.exec_with_input = mock.Mock(
+            side_effect=lambda command, chunks: sent.extend(chunks)
+        )
+        board_files = files.Files(pyboard, block_size=4)
+        result = board_files.put_delta("foo.txt", b"hello world!")
+        self.assertEqual(result, 4)
+        self.assertEqual(sent, [b"cmxkIQ=="])
+        command = pyboard.exec_with_input.call_args[0][0]
+        self.assertIn("patch('foo.txt', 12, 4, '001')", command)
+
+    def test_put_delta_missing_file(self):
+        pyboard = mock.Mock()
+        pyboard.exec_ = mock.Mock(
+            side_effect=[
+                b"True\r\n",
+                PyboardError(
+                    "exception",
+                    b"sha256\r\n",
+                    b'Traceback (most recent call last):\r\n  File "<stdin>", line 3, in <module>\r\nOSError: [Errno 2] ENOENT\r\n',
+                ),
+                b"False\r\n",
+            ]
+        )
+        board_files = files.Files(pyboard)
+        self.assertEqual(board_files.put_delta("foo.txt", b"hello"), 5)
+        self.assertIn("recv('foo.txt', 5, 1024, 0)", pyboard.exec_with_input.call_args[0][0])
+
+    def test_put_delta_other_errors(self):
+        # Only a missing file is sent in full, other errors are raised.
+        for error in (
+            PyboardError("exception", b"sha256\r\n", b"OSError: [Errno 28] ENOSPC\r\n"),
+            PyboardError("timeout waiting for first EOF reception"),
+        ):
+            pyboard = mock.Mock()
+            pyboard.exec_ = mock.Mock(side_effect=[b"True\r\n", error])
+            board_files = files.Files(pyboard)
+            with self.assertRaises(PyboardError) as context:
+                board_files.put_delta("foo.txt", b"hello")
+            self.assertIs(context.exception, error)
+            pyboard.exec_with_input.assert_not_called()
 
     def test_rm(self):
         pyboard = mock.Mock()
@@ -129,19 +544,20 @@ class TestFiles(unittest.TestCase):
 
     def test_rmdir(self):
         pyboard = mock.Mock()
-        pyboard.exec_ = mock.Mock(return_value=b"")
+        pyboard.exec_ = mock.Mock(return_value=b"3\r\n")
         board_files = files.Files(pyboard)
-        board_files.rmdir("foo")
+        self.assertEqual(board_files.rmdir("foo"), 3)
+
+    def test_rmdir_multiple(self):
+        pyboard = mock.Mock()
+        pyboard.exec_ = mock.Mock(return_value=b"5\r\n")
+        board_files = files.Files(pyboard)
+        self.assertEqual(board_files.rmdir(["/lib", "/data"], missing_okay=True), 5)
+        self.assertIn("_ampy.rmtree(['/lib', '/data'], 1)", pyboard.exec_.call_args[0][0])
 
     def test_rmdir_folder_doesnt_exist(self):
         pyboard = mock.Mock()
-        pyboard.exec_ = mock.Mock(
-            side_effect=PyboardError(
-                "exception",
-                b"",
-                b'Traceback (most recent call last):\r\n  File "<stdin>", line 3, in <module>\r\nOSError: [Errno 2] ENOENT\r\n',
-            )
-        )
+        pyboard.exec_ = mock.Mock(return_value=b"!foo\r\n")
         with self.raisesRegex(RuntimeError, "No such directory: foo"):
             board_files = files.Files(pyboard)
             result = board_files.rmdir("foo")
@@ -188,6 +604,248 @@ class TestFiles(unittest.TestCase):
             board_files = files.Files(pyboard)
             board_files.mkdir("/foo")
 
+    def test_mkdir_parents(self):
+        pyboard = mock.Mock()
+        pyboard.exec_ = mock.Mock(return_value=b"")
+        board_files = files.Files(pyboard)
+        board_files.mkdir(["/lib/a/b", "/data"], parents=True)
+        self.assertEqual(pyboard.exec_.call_count, 1)
+        self.assertIn(
+            "_ampy.mkdir(['/lib/a/b', '/data'], 1, 0)", pyboard.exec_.call_args[0][0]
+        )
+
+    def test_mkdir_parents_relative_path(self):
+        # Run the helper here, with a stand-in for the board's os module.
+        made = []
+        board = mock.Mock(os=mock.Mock(mkdir=made.append), sys=sys, binascii=binascii)
+        command, needed = files.helper_command(
+            "_ampy.mkdir(['lib/a', '/data/b/'], 1, 0)", ["mkdir"], set(["base"])
+        )
+        exec(command, {"_ampy": board})
+        self.assertEqual(made, ["lib", "lib/a", "/data", "/data/b"])
+
+    def test_mkdir_names_existing_directory(self):
+        pyboard = mock.Mock()
+        pyboard.exec_ = mock.Mock(
+            side_effect=PyboardError(
+                "exception",
+                b"/my dir\r\n",
+                b'Traceback (most recent call last):\r\n  File "<stdin>", line 3, in <module>\r\nOSError: [Errno 17] EEXIST\r\n',
+            )
+        )
+        board_files = files.Files(pyboard)
+        with self.raisesRegex(
+            files.DirectoryExistsError, "Directory already exists: /my dir"
+        ):
+            board_files.mkdir(["/lib", "/my dir"])
+
+    def test_hashes(self):
+        pyboard = mock.Mock()
+        pyboard.exec_ = mock.Mock(
+            return_value=b"crc32\r\n11:0d4a1185 /lib/foo.txt\r\n0:00000000 /my file\r\n"
+        )
+        board_files = files.Files(pyboard)
+        algorithm, result = board_files.hashes("/")
+        self.assertEqual(algorithm, "crc32")
+        self.assertDictEqual(
+            result, {"/lib/foo.txt": "11:0d4a1185", "/my file": "0:00000000"}
+        )
+        self.assertEqual(files.file_digest(b"hello world", algorithm), "11:0d4a1185")
+
+    def test_hashes_missing_directory(self):
+        pyboard = mock.Mock()
+        pyboard.exec_ = mock.Mock(
+            side_effect=PyboardError(
+                "exception",
+                b"sha256\r\n",
+                b'Traceback (most recent call last):\r\n  File "<stdin>", line 3, in <module>\r\nOSError: [Errno 2] ENOENT\r\n',
+            )
+        )
+        board_files = files.Files(pyboard)
+        self.assertEqual(board_files.hashes("/foo", missing_okay=True), (None, {}))
+        with self.raisesRegex(RuntimeError, "No such directory: /foo"):
+            board_files.hashes("/foo")
+
+    def test_hashes_other_errors(self):
+        # A full filesystem (errno 28) isn't a missing directory.
+        error = PyboardError("exception", b"sha256\r\n", b"OSError: [Errno 28] ENOSPC\r\n")
+        pyboard = mock.Mock()
+        pyboard.exec_ = mock.Mock(side_effect=error)
+        board_files = files.Files(pyboard)
+        with self.assertRaises(PyboardError) as context:
+            board_files.hashes("/foo", missing_okay=True)
+        self.assertIs(context.exception, error)
+
+    def test_file_hashes(self):
+        pyboard = mock.Mock()
+        pyboard.exec_ = mock.Mock(
+            return_value=b"crc32\r\n11:0d4a1185 /foo.txt\r\n- /my file\r\n"
+        )
+        board_files = files.Files(pyboard)
+        algorithm, result = board_files.file_hashes(["/foo.txt", "/my file"])
+        self.assertEqual(algorithm, "crc32")
+        self.assertDictEqual(result, {"/foo.txt": "11:0d4a1185", "/my file": None})
+        self.assertIn(
+            "file_hashes(['/foo.txt', '/my file'], 1024)", pyboard.exec_.call_args[0][0]
+        )
+        # The algorithm is known now.
+        self.assertEqual(board_files.hash_algorithm(), "crc32")
+        self.assertEqual(pyboard.exec_.call_count, 1)
+
+    def test_verify(self):
+        pyboard = mock.Mock()
+        pyboard.exec_ = mock.Mock(
+            return_value=b"crc32\r\n11:0d4a1185 /a.txt\r\n11:0d4a1185 /b.txt\r\n- /c.txt\r\n"
+        )
+        board_files = files.Files(pyboard)
+        digest = files.file_digest(b"hello world", "crc32")
+        board_files.verify({"/a.txt": digest, "/b.txt": digest})
+        with self.raisesRegex(RuntimeError, "Verification failed: /b.txt, /c.txt"):
+            board_files.verify({"/a.txt": digest, "/b.txt": "0:00000000", "/c.txt": digest})
+
+    def test_put_verify(self):
+        pyboard = mock.Mock()
+        digest = files.file_digest(b"hello world", "sha256")
+        pyboard.exec_ = mock.Mock(
+            side_effect=[
+                b"True\r\n",
+                b"sha256\r\n",
+                "sha256\r\n{0} foo.txt\r\n".format(digest).encode("utf-8"),
+            ]
+        )
+        board_files = files.Files(pyboard, compress=False)
+        board_files.put("foo.txt", b"hello world", verify=True)
+        self.assertIn("file_hashes(['foo.txt'], 1024)", pyboard.exec_.call_args[0][0])
+
+    def test_put_webrepl(self):
+        pyboard = mock.Mock()
+        pyboard.serial = mock.Mock(spec=WebreplToSerial)
+        pyboard.serial.put_file = mock.Mock(return_value=True)
+        pyboard.exec_ = mock.Mock(return_value=b"")
+        board_files = files.Files(pyboard)
+        board_files.put("/lib/foo.txt", b"hello world")
+        filename, data, progress = pyboard.serial.put_file.call_args[0]
+        self.assertEqual(filename, "/lib/foo.txt.part")
+        self.assertEqual(data, b"hello world")
+        # The REPL only renames the uploaded file in place.
+        self.assertEqual(pyboard.exec_.call_count, 1)
+        self.assertIn(
+            "_ampy.replace('/lib/foo.txt.part', '/lib/foo.txt')",
+            pyboard.exec_.call_args[0][0],
+        )
+
+    def test_get_webrepl(self):
+        pyboard = mock.Mock()
+        pyboard.serial = mock.Mock(spec=WebreplToSerial)
+        pyboard.serial.get_file = mock.Mock(
+            side_effect=lambda filename, sink: sink.write(b"hello world") or True
+        )
+        board_files = files.Files(pyboard)
+        self.assertEqual(board_files.get("foo.txt"), b"hello world")
+        pyboard.exec_.assert_not_called()
+        pyboard.serial.get_file = mock.Mock(return_value=False)
+        with self.raisesRegex(RuntimeError, "No such file: foo.txt"):
+            board_files.get("foo.txt")
+
+    def test_helpers_defined_once_per_session(self):
+        pyboard = mock.Mock()
+        pyboard.exec_ = mock.Mock(return_value=b"0\r\n")
+        board_files = files.Files(pyboard)
+        with board_files.session():
+            board_files.rmdir("/foo")
+            board_files.rmdir("/bar")
+        first, second = [c[0][0] for c in pyboard.exec_.call_args_list]
+        self.assertIn("def rmtree(", first)
+        self.assertEqual(second, "_ampy.rmtree(['/bar'], 0)")
+        # A new session starts from a freshly reset board.
+        board_files.rmdir("/foo")
+        self.assertIn("def rmtree(", pyboard.exec_.call_args[0][0])
+
+    def test_helpers_kept_without_soft_reset(self):
+        pyboard = mock.Mock()
+        pyboard.soft_reset = False
+        pyboard.exec_ = mock.Mock(return_value=b"0\r\n")
+        board_files = files.Files(pyboard)
+        board_files.rmdir("/foo")
+        board_files.rmdir("/bar")
+        self.assertEqual(pyboard.enter_raw_repl.call_count, 2)
+        self.assertEqual(pyboard.exec_.call_args[0][0], "_ampy.rmtree(['/bar'], 0)")
+
+    def test_helpers_keep_user_globals(self):
+        # Attached to a running program the helpers mustn't replace its
+        # globals.  The commands run here in a namespace standing in for the
+        # board's globals.
+        user_globals = {"stat": "mine", "os": "mine", "sys": "mine", "f": "mine"}
+        board_globals = dict(user_globals)
+
+        def exec_(command, data_consumer=None, chunks=()):
+            stdin = io.StringIO(b"".join(chunks).decode("utf-8"))
+            with mock.patch("sys.stdin", stdin):
+                with mock.patch("sys.stdout", new_callable=io.StringIO) as out:
+                    exec(command, board_globals)
+            return out.getvalue().encode("utf-8")
+
+        pyboard = mock.Mock()
+        pyboard.soft_reset = False
+        pyboard.exec_ = exec_
+        pyboard.exec_with_input = lambda command, chunks: exec_(command, chunks=chunks)
+        pyboard.exec_iter = lambda command: (data for data in [exec_(command)])
+        pyboard.exec_pipelined = lambda commands: (exec_(command) for command in commands)
+        board_files = files.Files(pyboard)
+        local = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, local)
+        board_files._has_decompressor()
+        board_files.put(local + "/foo.txt", b"hello world")
+        self.assertEqual(board_files.ls(local, long_format=False), [local + "/foo.txt"])
+        self.assertEqual(board_files.stat(local + "/foo.txt")[6], 11)
+        algorithm, digests = board_files.hashes(local)
+        digest = files.file_digest(b"hello world", algorithm)
+        self.assertEqual(digests, {local + "/foo.txt": digest})
+        del board_globals["__builtins__"]
+        del board_globals["_ampy"]
+        self.assertEqual(board_globals, user_globals)
+
+    def test_helpers_without_binascii(self):
+        # The fallback upload for boards without binascii still needs the
+        # base helper, for part_size and replace.
+        command, needed = files.helper_command(
+            "_ampy.part_size('/nonexistent/foo.txt')", ["part_size"], set()
+        )
+        with mock.patch.dict(sys.modules, {"binascii": None, "ubinascii": None}):
+            with mock.patch("sys.stdout", new_callable=io.StringIO) as out:
+                exec(command, {})
+        self.assertEqual(out.getvalue(), "0\n")
+
+    def test_stat(self):
+        pyboard = mock.Mock()
+        pyboard.exec_ = mock.Mock(return_value=b"(32768, 0, 0, 0, 0, 0, 11, 0, 0, 0)\r\n")
+        board_files = files.Files(pyboard)
+        self.assertEqual(board_files.stat("/foo.txt")[6], 11)
+
+    def test_stat_errors(self):
+        missing = PyboardError("exception", b"", b"OSError: [Errno 2] ENOENT\r\n")
+        timeout = PyboardError("timeout waiting for first EOF reception")
+        pyboard = mock.Mock()
+        pyboard.exec_ = mock.Mock(side_effect=[missing, timeout])
+        board_files = files.Files(pyboard)
+        with self.raisesRegex(RuntimeError, "No such file/directory: /foo.txt"):
+            board_files.stat("/foo.txt")
+        with self.assertRaises(PyboardError) as context:
+            board_files.stat("/foo.txt")
+        self.assertIs(context.exception, timeout)
+
+    def test_session_enters_raw_repl_once(self):
+        pyboard = mock.Mock()
+        pyboard.exec_ = mock.Mock(return_value=b"")
+        pyboard.exec_pipelined = self.pipelined([])
+        board_files = files.Files(pyboard)
+        with board_files.session():
+            board_files.mkdir("/foo")
+            board_files.put("/foo/bar.txt", "hello world")
+            board_files.rm("/foo/bar.txt")
+        pyboard.enter_raw_repl.assert_called_once_with()
+        pyboard.exit_raw_repl.assert_called_once_with()
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,105 @@
+# Adafruit MicroPython Tool - Fleet Tests
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+# Try importing python 3 mock library, then fall back to python 2 (external module).
+try:
+    import unittest.mock as mock
+except ImportError:
+    import mock
+
+from ampy import fleet
+from ampy.files import file_digest
+from ampy.pyboard import PyboardError
+
+
+class TestFleet(unittest.TestCase):
+    def test_expand_ports(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        for name in ("ttyUSB1", "ttyUSB0", "ttyACM0"):
+            open(os.path.join(directory, name), "w").close()
+        pattern = os.path.join(directory, "ttyUSB*")
+        first = os.path.join(directory, "ttyUSB0")
+        self.assertEqual(
+            fleet.expand_ports(["COM3", pattern, first]),
+            ["COM3", first, os.path.join(directory, "ttyUSB1")],
+        )
+        with self.assertRaises(RuntimeError):
+            fleet.expand_ports([os.path.join(directory, "ttyS*")])
+
+    def test_run_all(self):
+        boards = {}
+
+        def connect(port):
+            if port == "bad":
+                raise PyboardError("failed to access bad")
+            boards[port] = mock.Mock()
+            return boards[port]
+
+        def operation(board, echo):
+            barrier.wait()
+            if board is boards["b"]:
+                raise PyboardError("exception", b"", b"Traceback\r\nOSError: 28\r\n")
+            echo("done")
+
+        # Both boards which connect wait for each other, so this only
+        # finishes if they run at the same time.
+        barrier = threading.Barrier(2, timeout=5)
+        results = fleet.run_all(["a", "bad", "b"], connect, operation)
+        self.assertEqual([result.port for result in results], ["a", "bad", "b"])
+        self.assertEqual(
+            [result.error for result in results],
+            [None, "failed to access bad", "OSError: 28"],
+        )
+        self.assertEqual(results[0].output, ["done"])
+        boards["a"].close.assert_called_once_with()
+        boards["b"].close.assert_called_once_with()
+
+    def test_summary(self):
+        results = [
+            fleet.Result("/dev/ttyUSB0", None, 1.25, ["3 files uploaded"]),
+            fleet.Result("/dev/ttyUSB10", "could not enter raw repl", 0.5, []),
+        ]
+        self.assertEqual(
+            fleet.summary(results),
+            [
+                "PORT           STATUS  TIME  DETAIL",
+                "/dev/ttyUSB0   ok      1.2s  3 files uploaded",
+                "/dev/ttyUSB10  FAILED  0.5s  could not enter raw repl",
+            ],
+        )
+
+    def test_shared_work_hashes_once(self):
+        work = fleet.SharedWork()
+        with mock.patch("ampy.fleet.file_digest", wraps=file_digest) as digest:
+            for i in range(3):
+                self.assertEqual(
+                    work.digest(b"hello world", "crc32"), file_digest(b"hello world", "crc32")
+                )
+        self.assertEqual(digest.call_count, 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,66 @@
+# Adafruit MicroPython Tool - Pipeline Tests
+# Copyright (c) 2016 Adafruit Industries
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+import threading
+import unittest
+
+import ampy.pipeline as pipeline
+
+
+class TestPrefetch(unittest.TestCase):
+    def test_results_in_order(self):
+        results = pipeline.prefetch(lambda item: item * 2, range(20))
+        self.assertListEqual(list(results), [item * 2 for item in range(20)])
+
+    def test_bounded_look_ahead(self):
+        taken = []
+
+        def items():
+            for item in range(10):
+                taken.append(item)
+                yield item
+
+        results = pipeline.prefetch(lambda item: item, items(), depth=2)
+        for item in results:
+            # Only the item yielded and the ones prepared after it are taken.
+            self.assertLessEqual(len(taken), item + 3)
+
+    def test_exception_raised_at_its_item(self):
+        def function(item):
+            if item == 3:
+                raise RuntimeError("Bad item")
+            return item
+
+        results = pipeline.prefetch(function, range(10))
+        self.assertListEqual([next(results) for _ in range(3)], [0, 1, 2])
+        with self.assertRaisesRegex(RuntimeError, "Bad item"):
+            next(results)
+
+    def test_runs_in_other_threads(self):
+        results = pipeline.prefetch(lambda item: threading.current_thread(), range(3))
+        for thread in results:
+            self.assertIsNot(thread, threading.current_thread())
+
+    def test_sequential_without_workers(self):
+        results = pipeline.prefetch(
+            lambda item: threading.current_thread(), range(3), workers=0
+        )
+        for thread in results:
+            self.assertIs(thread, threading.current_thread())
@@ -0,0 +1,533 @@
+# Adafruit MicroPython Tool - Pyboard Tests
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+import io
+import socket
+import struct
+import threading
+import unittest
+
+try:
+    import termios
+except ImportError:
+    termios = None
+
+# Try importing python 3 mock library, then fall back to python 2 (external module).
+try:
+    import unittest.mock as mock
+except ImportError:
+    import mock
+
+from ampy.pyboard import (
+    Pyboard,
+    PyboardError,
+    ReadUntil,
+    TelnetToSerial,
+    WebreplToSerial,
+    raw_paste_flow,
+    raw_paste_window,
+)
+
+
+class FakeSerial(object):
+    """Stand-in for serial.Serial that replays canned board output and records
+    everything written to it.  Replies are (trigger, output) pairs, the output
+    only becomes readable once the host has written the trigger bytes.
+    Like a real port without a timeout, reading when there's nothing to read
+    would block forever, which fails the test instead.
+    """
+
+    def __init__(self, output=b"", replies=()):
+        self.output = bytearray(output)
+        self.replies = list(replies)
+        self.written = bytearray()
+        self.timeout = None
+
+    def feed(self, data):
+        self.output.extend(data)
+
+    def read(self, size=1):
+        if size and not self.output and self.timeout is None:
+            raise AssertionError("read would block forever")
+        data = bytes(self.output[:size])
+        del self.output[:size]
+        return data
+
+    def write(self, data):
+        self.written.extend(data)
+        while self.replies and self.written.endswith(self.replies[0][0]):
+            self.output.extend(self.replies.pop(0)[1])
+        return len(data)
+
+    def inWaiting(self):
+        return len(self.output)
+
+    def close(self):
+        pass
+
+
+def make_pyboard(output=b"", replies=()):
+    fake = FakeSerial(output, replies)
+    with mock.patch("serial.Serial", return_value=fake):
+        pyboard = Pyboard("/dev/ttyFAKE")
+    return pyboard, fake
+
+
+class FakeTelnet(object):
+    """Stand-in for telnetlib.Telnet that has already logged in and passes
+    through whatever is sent on the other end of a socket pair.
+    """
+
+    def __init__(self, ip, timeout=None):
+        self.sock, self.peer = socket.socketpair()
+        self.sock.setblocking(False)
+
+    def read_until(self, match, timeout=None):
+        return match
+
+    def read_very_eager(self):
+        try:
+            return self.sock.recv(4096)
+        except (BlockingIOError, socket.error):
+            return b""
+
+    def fileno(self):
+        return self.sock.fileno()
+
+    def write(self, data):
+        self.sock.sendall(data)
+
+    def close(self):
+        self.sock.close()
+        self.peer.close()
+
+
+class TestProtocol(unittest.TestCase):
+    def test_read_until_keeps_data_past_ending(self):
+        until = ReadUntil(b"\x04", b"ab")
+        self.assertEqual(until.feed(b"c"), b"")
+        self.assertFalse(until.done())
+        self.assertEqual(until.feed(b"d\x04ef"), b"ef")
+        self.assertTrue(until.done())
+        self.assertEqual(until.data, b"abcd\x04")
+
+    def test_read_until_consumer(self):
+        consumed = []
+        until = ReadUntil(b"\x04\x04", b"a", consumed.append)
+        until.feed(b"b\x04")
+        until.feed(b"\x04")
+        self.assertEqual(b"".join(consumed), b"ab\x04\x04")
+        self.assertEqual(until.data, b"\x04\x04")
+
+    def test_read_until_max_time(self):
+        until = ReadUntil(b">", max_time=0)
+        self.assertTrue(until.expired())
+        self.assertEqual(until.wait(10), 0)
+        self.assertIsNone(ReadUntil(b">").wait(None))
+
+    def test_raw_paste_short_reads(self):
+        self.assertEqual(raw_paste_window(b"\x00\x01"), 256)
+        with self.assertRaises(PyboardError):
+            raw_paste_window(b"\x00")
+        with self.assertRaises(PyboardError):
+            raw_paste_flow(b"", 256)
+        self.assertEqual(raw_paste_flow(b"\x01", 256), 256)
+        self.assertIsNone(raw_paste_flow(b"\x04", 256))
+
+
+class TestTelnetToSerial(unittest.TestCase):
+    def setUp(self):
+        with mock.patch("telnetlib.Telnet", FakeTelnet), mock.patch("time.sleep"):
+            self.telnet = TelnetToSerial("192.168.1.1", "micro", "python", read_timeout=1)
+        self.peer = self.telnet.tn.peer
+
+    def tearDown(self):
+        self.telnet.close()
+
+    def test_read_in_pieces(self):
+        self.peer.sendall(b"hello world")
+        self.assertEqual(self.telnet.read(5), b"hello")
+        self.assertEqual(self.telnet.inWaiting(), 6)
+        self.assertEqual(self.telnet.read(6), b" world")
+        self.assertEqual(self.telnet.inWaiting(), 0)
+
+    def test_read_timeout_returns_partial_data(self):
+        self.telnet.timeout = 0.05
+        self.peer.sendall(b"abc")
+        self.assertEqual(self.telnet.read(10), b"abc")
+
+
+class FakeWebrepl(object):
+    """Stand-in WebREPL server for a single connection on a local port.  It
+    logs in with the password, echoes the REPL text it receives and serves
+    file transfer requests from and to the files dict.
+    """
+
+    def __init__(self, password="python", files=None):
+        self.password = password
+        self.files = {} if files is None else files
+        self.listener = socket.socket()
+        self.listener.bind(("127.0.0.1", 0))
+        self.listener.listen(1)
+        self.port = self.listener.getsockname()[1]
+        self.thread = threading.Thread(target=self.serve)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def close(self):
+        self.listener.close()
+        self.thread.join(5)
+
+    def recv(self, size):
+        data = b""
+        while len(data) < size:
+            chunk = self.conn.recv(size - len(data))
+            if not chunk:
+                raise EOFError()
+            data += chunk
+        return data
+
+    def recv_frame(self):
+        header = bytearray(self.recv(2))
+        size = header[1] & 0x7F
+        if size == 126:
+            size = struct.unpack(">H", self.recv(2))[0]
+        key = bytearray(self.recv(4))
+        payload = bytearray(self.recv(size))
+        for i in range(size):
+            payload[i] ^= key[i % 4]
+        return header[0] & 0x0F, bytes(payload)
+
+    def send_frame(self, opcode, data):
+        header = bytearray([0x80 | opcode])
+        if len(data) < 126:
+            header.append(len(data))
+        else:
+            header.append(126)
+            header.extend(struct.pack(">H", len(data)))
+        self.conn.sendall(bytes(header) + data)
+
+    def recv_binary(self, size):
+        data = b""
+        while len(data) < size:
+            opcode, payload = self.recv_frame()
+            data += payload
+        return data
+
+    def serve(self):
+        self.conn, address = self.listener.accept()
+        try:
+            request = b""
+            while not request.endswith(b"\r\n\r\n"):
+                request += self.recv(1)
+            self.conn.sendall(
+                b"HTTP/1.1 101 Switching Protocols\r\n"
+                b"Upgrade: websocket\r\nConnection: Upgrade\r\n"
+                b"Sec-WebSocket-Accept: x\r\n\r\n"
+            )
+            self.send_frame(0x1, b"Password: ")
+            opcode, password = self.recv_frame()
+            if password != self.password.encode("utf-8") + b"\r":
+                self.send_frame(0x1, b"\r\nAccess denied\r\n")
+                return
+            self.send_frame(0x1, b"\r\nWebREPL connected\r\n>>> ")
+            while True:
+                opcode, payload = self.recv_frame()
+                if opcode == 0x1:
+                    self.send_frame(0x1, payload)
+                else:
+                    self.serve_file(payload + self.recv_binary(82 - len(payload)))
+        except (EOFError, socket.error):
+            pass
+        finally:
+            self.conn.close()
+
+    def serve_file(self, request):
+        signature, kind, flags, reserved, size, length, name = struct.unpack(
+            "<2sBBQLH64s", request
+        )
+        name = name[:length].decode("utf-8")
+        if kind == 1:
+            self.send_frame(0x2, b"WB\0\0")
+            self.files[name] = self.recv_binary(size)
+            self.send_frame(0x2, b"WB\0\0")
+        elif name not in self.files:
+            self.send_frame(0x2, b"WB\1\0")
+        else:
+            self.send_frame(0x2, b"WB\0\0")
+            data = self.files[name]
+            for i in range(0, len(data) + 1, 100):
+                self.recv_binary(1)
+                block = data[i : i + 100]
+                self.send_frame(0x2, struct.pack("<H", len(block)) + block)
+            if len(data) % 100:
+                self.recv_binary(1)
+                self.send_frame(0x2, b"\0\0")
+            self.send_frame(0x2, b"WB\0\0")
+
+
+class TestWebreplToSerial(unittest.TestCase):
+    def setUp(self):
+        self.server = FakeWebrepl("secret", {"/big.bin": bytes(bytearray(range(256))) * 20})
+        # Cleanups run last first, so connections close before the server.
+        self.addCleanup(self.server.close)
+        self.url = "ws://127.0.0.1:{0}".format(self.server.port)
+
+    def connect(self, password="secret"):
+        webrepl = WebreplToSerial(self.url, password, read_timeout=1)
+        self.addCleanup(webrepl.close)
+        return webrepl
+
+    def test_login_and_read_write(self):
+        webrepl = self.connect()
+        self.assertEqual(webrepl.read(4), b">>> ")
+        webrepl.write(b"x" * 200)
+        self.assertEqual(webrepl.read(200), b"x" * 200)
+        webrepl.timeout = 0.05
+        webrepl.write(b"abc")
+        self.assertEqual(webrepl.read(10), b"abc")
+        self.assertEqual(webrepl.inWaiting(), 0)
+
+    def test_password_in_url(self):
+        self.url = "ws://:secret@127.0.0.1:{0}".format(self.server.port)
+        self.connect(password="python")
+
+    def test_wrong_password(self):
+        with self.assertRaises(PyboardError):
+            WebreplToSerial(self.url, "python", read_timeout=1)
+
+    def test_put_file(self):
+        webrepl = self.connect()
+        data = b"hello world" * 300
+        sizes = []
+        self.assertTrue(webrepl.put_file("/lib/foo.txt", data, sizes.append))
+        self.assertEqual(sizes, [1024, 1024, 1024, 228])
+        # The REPL still works after the transfer.
+        webrepl.write(b"ok")
+        self.assertEqual(webrepl.read(6), b">>> ok")
+        self.assertEqual(self.server.files["/lib/foo.txt"], data)
+
+    def test_get_file(self):
+        webrepl = self.connect()
+        out = io.BytesIO()
+        self.assertTrue(webrepl.get_file("/big.bin", out))
+        self.assertEqual(out.getvalue(), self.server.files["/big.bin"])
+        self.assertFalse(webrepl.get_file("/missing.txt", io.BytesIO()))
+
+    def test_pyboard_picks_webrepl(self):
+        pyboard = Pyboard(self.url, password="secret")
+        self.addCleanup(pyboard.close)
+        self.assertIsInstance(pyboard.serial, WebreplToSerial)
+
+
+class TestPyboard(unittest.TestCase):
+    def test_read_until_keeps_data_after_ending(self):
+        pyboard, fake = make_pyboard(b"abc\x04def\x04ghi")
+        self.assertEqual(pyboard.read_until(1, b"\x04"), b"abc\x04")
+        chunks = []
+        # With a data_consumer the data is streamed instead of returned.
+        data = pyboard.read_until(1, b"\x04", data_consumer=chunks.append)
+        self.assertEqual(data, b"\x04")
+        self.assertEqual(b"".join(chunks), b"def\x04")
+        # Nothing more arrives, so this returns after the timeout.
+        self.assertEqual(pyboard.read_until(1, b"\x04", timeout=0), b"ghi")
+
+    def test_read_until_ending_split_across_reads(self):
+        pyboard, fake = make_pyboard(
+            b">", replies=[(b"x", b"raw RE"), (b"y", b"PL>tail")]
+        )
+        pyboard.serial.write(b"x")
+        self.assertEqual(pyboard.read(1), b">")
+        pyboard.serial.write(b"y")
+        self.assertEqual(pyboard.read_until(1, b"REPL>"), b"raw REPL>")
+        self.assertEqual(pyboard.read_some(), b"tail")
+
+    def test_exec_raw_paste(self):
+        pyboard, fake = make_pyboard(
+            b">",
+            replies=[
+                (b"\x05A\x01", b"R\x01" + struct.pack("<H", 4)),
+                (b"prin", b"\x01"),
+                (b"t('h", b"\x01"),
+                (b"\x04", b"\x04hi\x04\x04>"),
+            ],
+        )
+        out = pyboard.exec_("print('hi')")
+        self.assertEqual(out, b"hi")
+        self.assertEqual(bytes(fake.written), b"\x05A\x01print('hi')\x04")
+        self.assertTrue(pyboard.use_raw_paste)
+
+    def test_exec_raw_paste_unsupported(self):
+        pyboard, fake = make_pyboard(b">R\x00OKhi\x04\x04>")
+        out = pyboard.exec_("print('hi')")
+        self.assertEqual(out, b"hi")
+        self.assertEqual(bytes(fake.written), b"\x05A\x01print('hi')\x04")
+        self.assertFalse(pyboard.use_raw_paste)
+        # The next command goes straight to the paced raw REPL path.
+        fake.feed(b"OK\x04\x04>")
+        pyboard.exec_("x = 1")
+        self.assertTrue(fake.written.endswith(b"\x04x = 1\x04"))
+
+    def test_exec_error(self):
+        pyboard, fake = make_pyboard(b">R\x00OK\x04Traceback\x04>")
+        with self.assertRaises(PyboardError):
+            pyboard.exec_("1/0")
+
+    def test_exec_iter(self):
+        pyboard, fake = make_pyboard(b">R\x00OKab", replies=[(b"\x04", b"cd\x04\x04>")])
+        self.assertEqual(b"".join(pyboard.exec_iter("ls()")), b"abcd")
+        self.assertEqual(pyboard.read_some(0), b">")
+
+    def test_exec_iter_interrupted(self):
+        pyboard, fake = make_pyboard(
+            b">R\x00OKab", replies=[(b"\x03", b"cd\x04KeyboardInterrupt\x04>")]
+        )
+        output = pyboard.exec_iter("ls()")
+        self.assertEqual(next(output), b"ab")
+        output.close()
+        self.assertTrue(fake.written.endswith(b"\x03"))
+        self.assertEqual(pyboard.read_some(0), b">")
+
+    @unittest.skipIf(termios is None, "needs termios")
+    def test_read_some_port_gone(self):
+        pyboard, fake = make_pyboard()
+
+        class GoneSerial(FakeSerial):
+            # Like pyserial once the USB serial bridge went away.
+            @property
+            def timeout(self):
+                return None
+
+            @timeout.setter
+            def timeout(self, value):
+                if value is not None:
+                    raise termios.error(5, "Input/output error")
+
+        pyboard.serial = GoneSerial()
+        with self.assertRaises(PyboardError):
+            pyboard.read_some(1)
+
+    def test_exec_pipelined(self):
+        pyboard, fake = make_pyboard(
+            b">",
+            replies=[
+                (b"a\x04", b"OKA\x04\x04>"),
+                (b"b\x04", b"OKB\x04\x04>"),
+                (b"c\x04", b"OKC\x04\x04>"),
+            ],
+        )
+        outputs = pyboard.exec_pipelined(["a", "b", "c"], window=2)
+        self.assertEqual(next(outputs), b"A")
+        # The second command went out before the first one's output was read.
+        self.assertEqual(bytes(fake.written), b"a\x04b\x04")
+        self.assertEqual(list(outputs), [b"B", b"C"])
+        self.assertEqual(pyboard.read_some(0), b">")
+
+    def test_exec_pipelined_byte_window(self):
+        big = "x" * 199
+        pyboard, fake = make_pyboard(
+            b">",
+            replies=[
+                (b"a\x04", b"OKA\x04\x04>"),
+                (big.encode() + b"\x04", b"OKB\x04\x04>"),
+                (b"c\x04", b"OKC\x04\x04>"),
+            ],
+        )
+        with mock.patch("time.sleep") as sleep:
+            outputs = pyboard.exec_pipelined(["a", big, "c"], window=4, window_bytes=200)
+            self.assertEqual(next(outputs), b"A")
+            # The big command only fit once the first one was done.
+            self.assertEqual(bytes(fake.written), b"a\x04")
+            self.assertEqual(next(outputs), b"B")
+            self.assertEqual(bytes(fake.written), b"a\x04" + big.encode() + b"\x04")
+            self.assertEqual(list(outputs), [b"C"])
+        # Every write was followed by a pause.
+        self.assertEqual(sleep.call_count, 3)
+
+    def test_exec_pipelined_error(self):
+        pyboard, fake = make_pyboard(
+            b">",
+            replies=[
+                (b"a\x04", b"OKA\x04\x04>"),
+                (b"b\x04", b"OK\x04Traceback\x04>"),
+                (b"c\x04", b"OKC\x04\x04>"),
+            ],
+        )
+        outputs = pyboard.exec_pipelined(["a", "b", "c", "d"], window=2)
+        self.assertEqual(next(outputs), b"A")
+        with self.assertRaises(PyboardError) as raised:
+            next(outputs)
+        self.assertEqual(raised.exception.args, ("exception", b"", b"Traceback"))
+        # The command sent after the failing one was read, no more were sent.
+        self.assertEqual(bytes(fake.written), b"a\x04b\x04c\x04")
+        self.assertEqual(pyboard.read_some(0), b">")
+
+    def test_enter_raw_repl(self):
+        pyboard, fake = make_pyboard(
+            replies=[
+                (b"\r\x01", b"\r\n>>> raw REPL; CTRL-B to exit\r\n>"),
+                (b"\x04", b"OK\r\nMPY: soft reboot\r\nraw REPL; CTRL-B to exit\r\n>"),
+            ]
+        )
+        with mock.patch("time.sleep") as sleep:
+            pyboard.enter_raw_repl()
+        sleep.assert_not_called()
+        self.assertEqual(bytes(fake.written), b"\r\x03\x03\r\x01\x04")
+        # The prompt is left for the first exec.
+        self.assertEqual(pyboard.read_some(0), b">")
+
+    def test_enter_raw_repl_interrupts_main(self):
+        pyboard, fake = make_pyboard(
+            replies=[
+                (b"\r\x01", b"raw REPL; CTRL-B to exit\r\n>"),
+                (b"\x04", b"OK\r\nMPY: soft reboot\r\nrunning main.py"),
+                (b"\x03\x03", b"\r\nKeyboardInterrupt\r\nraw REPL; CTRL-B to exit\r\n>"),
+            ]
+        )
+        pyboard.enter_raw_repl()
+        self.assertTrue(fake.written.endswith(b"\x04\x03\x03"))
+        self.assertEqual(pyboard.read_some(0), b">")
+
+    def test_enter_raw_repl_interrupts_silent_main(self):
+        # main.py prints nothing, so only the timeout tells it's running.
+        pyboard, fake = make_pyboard(
+            replies=[
+                (b"\r\x01", b"raw REPL; CTRL-B to exit\r\n>"),
+                (b"\x04", b"OK\r\nMPY: soft reboot\r\n"),
+                (b"\x03\x03", b"\r\nKeyboardInterrupt\r\nraw REPL; CTRL-B to exit\r\n>"),
+            ]
+        )
+        pyboard.enter_raw_repl()
+        self.assertTrue(fake.written.endswith(b"\x04\x03\x03"))
+        self.assertEqual(pyboard.read_some(0), b">")
+
+    def test_enter_raw_repl_without_soft_reset(self):
+        pyboard, fake = make_pyboard(
+            replies=[(b"\r\x01", b"\r\n>>> \r\nraw REPL; CTRL-B to exit\r\n>")]
+        )
+        pyboard.soft_reset = False
+        with mock.patch("time.sleep") as sleep:
+            pyboard.enter_raw_repl()
+        sleep.assert_not_called()
+        self.assertNotIn(b"\x04", fake.written)
+        self.assertEqual(pyboard.read_some(0), b">")
+
+
+if __name__ == "__main__":
+    unittest.main()